@@ -0,0 +1,159 @@
+# ann_index.py
+"""
+Approximate nearest-neighbour search over LBPH gallery histograms.
+
+Histograms are square-rooted (so Euclidean distance approximates the
+chi-square distance LBPH uses), reduced with PCA and grouped into k-means
+lists (an IVF index). A query probes the closest lists, keeps the best
+candidates by distance in the reduced space and re-ranks them with the exact
+chi-square distance, so the returned confidence means the same as OpenCV's.
+"""
+import copy
+
+import numpy as np
+
+from config import ANN_CANDIDATES, ANN_DIMS, ANN_NPROBE
+from facerec import HistogramMatcher, chi_square_distances
+
+# Rows used to fit PCA and k-means; larger galleries are subsampled
+FIT_SAMPLES = 4096
+KMEANS_ITERATIONS = 12
+
+
+def _nearest(points, centroids, chunk=4096):
+    # Index of the closest centroid for every point, in chunks to bound memory
+    c_norms = (centroids ** 2).sum(axis=1)
+    nearest = np.empty(len(points), dtype=np.int32)
+    for start in range(0, len(points), chunk):
+        block = points[start:start + chunk]
+        d = c_norms[np.newaxis, :] - 2 * block @ centroids.T
+        nearest[start:start + len(block)] = d.argmin(axis=1)
+    return nearest
+
+
+class ANNMatcher(HistogramMatcher):
+    """
+    HistogramMatcher that searches a PCA + IVF index before exact re-ranking.
+
+    Args:
+    - histograms, labels: Gallery, as for HistogramMatcher
+    - nprobe: Lists probed per query; higher is slower with better recall
+    - candidates: Samples re-ranked exactly per query
+    - dims: PCA dimensions
+    - dtype: Histogram storage, as for HistogramMatcher
+    """
+    def __init__(self, histograms, labels, nprobe=ANN_NPROBE, candidates=ANN_CANDIDATES, dims=ANN_DIMS, dtype=None):
+        super().__init__(histograms, labels, dtype)
+        self.nprobe = nprobe
+        self.candidates = candidates
+        self.dims = dims
+        self._build_index(None)
+
+    @classmethod
+    def from_model(cls, model, dtype=None):
+        return cls(model.getHistograms(), np.asarray(model.getLabels()), dtype=dtype)
+
+    @classmethod
+    def from_arrays(cls, histograms_t, scales, labels, sums=None):
+        matcher = super().from_arrays(histograms_t, scales, labels, sums)
+        matcher.nprobe, matcher.candidates, matcher.dims = ANN_NPROBE, ANN_CANDIDATES, ANN_DIMS
+        matcher._build_index(None)
+        return matcher
+
+    def _dequantized(self, columns):
+        return self.histograms_t[:, columns].T.astype(np.float32) * self.scales[columns, np.newaxis]
+
+    def _build_index(self, basis):
+        samples = len(self.labels)
+        if samples == 0:
+            self.mean = self.components = self.centroids = None
+            self.projected = np.empty((0, 0), np.float32)
+            self.lists = []
+            return
+        if basis is None:
+            basis = self._fit(samples)
+        self.mean, self.components, self.centroids = basis
+        # Project in chunks so the whole gallery is never expanded to float32 at once
+        self.projected = np.vstack([self._project(self._dequantized(np.arange(start, min(start + FIT_SAMPLES, samples))))
+                                    for start in range(0, samples, FIT_SAMPLES)])
+        assignment = _nearest(self.projected, self.centroids)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def _fit(self, samples):
+        rng = np.random.default_rng(0)
+        pick = np.sort(rng.choice(samples, size=min(samples, FIT_SAMPLES), replace=False))
+        sample = np.sqrt(self._dequantized(pick))
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+
+        # Randomized PCA: only the top dims components are needed, so a full SVD
+        # of the samples x 16384 matrix is avoided
+        rank = min(self.dims + 8, *centered.shape)
+        basis, _ = np.linalg.qr(centered @ rng.standard_normal((centered.shape[1], rank)).astype(np.float32))
+        _, _, vt = np.linalg.svd(basis.T @ centered, full_matrices=False)
+        components = np.ascontiguousarray(vt[:min(self.dims, len(vt))].T, dtype=np.float32)
+
+        reduced = centered @ components
+        n_lists = max(1, min(len(reduced), int(2 * np.sqrt(samples))))
+        centroids = reduced[rng.choice(len(reduced), size=n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = _nearest(reduced, centroids)
+            for c in range(n_lists):
+                members = reduced[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        return mean.astype(np.float32), components, centroids.astype(np.float32)
+
+    def _project(self, histograms):
+        return ((np.sqrt(np.asarray(histograms, dtype=np.float32)) - self.mean) @ self.components).astype(np.float32)
+
+    def _basis(self):
+        return (self.mean, self.components, self.centroids) if self.mean is not None else None
+
+    def _segment(self, other):
+        # Only the new rows are projected and assigned to the existing lists; a full rebuild refits the basis
+        segment = copy.copy(self)
+        segment._set_gallery(other.histograms_t, other.scales, other.labels, other.sums)
+        segment._build_index(self._basis())
+        return segment
+
+    def nbytes(self):
+        return super().nbytes() + self.projected.nbytes
+
+    def search(self, query_histograms):
+        """
+        Find candidate gallery samples for each query in the reduced space.
+
+        Args:
+        - query_histograms: Q x D float32 histograms
+
+        Returns:
+        - List of index arrays into the gallery, one per query
+        """
+        projected = self._project(query_histograms)
+        c_dist = ((projected[:, np.newaxis, :] - self.centroids[np.newaxis, :, :]) ** 2).sum(axis=2)
+        probes = np.argsort(c_dist, axis=1)[:, :self.nprobe]
+        results = []
+        for q, lists in enumerate(probes):
+            ids = np.concatenate([self.lists[i] for i in lists])
+            if len(ids) > self.candidates:
+                d = ((self.projected[ids] - projected[q]) ** 2).sum(axis=1)
+                ids = ids[np.argpartition(d, self.candidates)[:self.candidates]]
+            results.append(ids)
+        return results
+
+    def _nearest(self, queries):
+        # Candidate search, then exact re-rank; small galleries are scanned exactly
+        if len(self.labels) <= self.candidates:
+            return super()._nearest(queries)
+        labels = np.full(len(queries), -1, dtype=np.int32)
+        best_distances = np.full(len(queries), np.inf, dtype=np.float32)
+        for q, ids in enumerate(self.search(queries)):
+            if len(ids) == 0:
+                continue
+            distances = chi_square_distances(queries[q:q + 1], self.histograms_t[:, ids], self.sums[ids], self.scales[ids])[0]
+            best = int(distances.argmin())
+            labels[q], best_distances[q] = self.labels[ids[best]], distances[best]
+        return labels, best_distances
@@ -3,6 +3,10 @@ Criminal Detection System - Web Application
 Flask backend: auth, criminal registration, face detection/recognition, CCTV frame API.
 """
 import os
+import time
+
+# Startup phases are timed from here (see /ready)
+STARTED_AT = time.perf_counter()
 
 # Ensure process CWD is project root (for face_samples, face_cascade.xml)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -11,21 +15,39 @@ if os.getcwd() != BASE_DIR:
 
 import json
 import base64
+import threading
 import cv2
 import numpy as np
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, send_from_directory
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, session, send_from_directory, g
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from functools import wraps
 
 # Local modules (face recognition, registration, DB)
-from facerec import train_model, detect_faces, recognize_face
-from register import registerCriminal
+from facerec import detect_faces, detection_profile, match_faces, recognize_face, recognized_matches
+from ingest import LatestFrame, ingest
+import crowd
+import metrics
+import motion
+import tracker
+from model_registry import registry
+from register import registerCriminal, commitRegistration, discardRegistration
 from dbHandler import insertData, retrieveData
+from config import ADMIN_USERS, METRICS_TOKEN
+from profiling import profiler
+
+IMPORT_SECONDS = time.perf_counter() - STARTED_AT
 
 app = Flask(__name__)
+sock = Sock(app)
 app.secret_key = os.environ.get("SECRET_KEY", "criminal-detection-web-secret-change-in-production")
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16 MB max upload
+# The same limit for frames sent over /ws/cctv; simple_websocket accepts any size by default
+app.config["SOCK_SERVER_OPTIONS"] = {"max_message_size": app.config["MAX_CONTENT_LENGTH"]}
 # So session cookie works over HTTPS on Render
 if os.environ.get("RENDER"):
     app.config["SESSION_COOKIE_SECURE"] = True
@@ -38,11 +60,119 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
 
 # In-memory store for recent detections (per server); optional: persist to file/DB
 recent_detections = []
+recent_lock = threading.Lock()
+# Motion gates and face trackers of HTTP CCTV clients, keyed by user and ?camera=
+http_gates = motion.ClientStates(motion.MotionGate)
+http_trackers = motion.ClientStates(tracker.FaceTracker)
 
 for d in (UPLOAD_FOLDER, PROFILE_PICS_DIR):
     os.makedirs(d, exist_ok=True)
 
 
+# ---------- Startup: model, warm-up and readiness ----------
+startup_phases = [{"phase": "imports", "seconds": round(IMPORT_SECONDS, 3)}]
+startup_lock = threading.Lock()
+startup_state = {"ready": False, "warming": False, "retrying": False, "error": None, "time_to_ready": None}
+# Seconds before the first warm-up retry after a failure; doubled per attempt up to the maximum
+WARMUP_RETRY_SECONDS = 2.0
+WARMUP_RETRY_MAX_SECONDS = 60.0
+print("Startup: imports took %.2fs" % IMPORT_SECONDS)
+
+
+@contextmanager
+def startup_phase(name):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    startup_phases.append({"phase": name, "seconds": round(seconds, 3)})
+    print("Startup: %s took %.2fs (%.2fs since start)" % (name, seconds, time.perf_counter() - STARTED_AT))
+
+
+def warm_up():
+    """
+    Load the model (or train and save it once) and run one inference through
+    the detection and recognition path, so the first real frame doesn't pay
+    for lazy initialization. The node reports ready on /ready afterwards.
+
+    Returns:
+    - True if the node is ready
+    """
+    with startup_lock:
+        if startup_state["ready"]:
+            return True
+        startup_state["warming"] = True
+        try:
+            with startup_phase("model"):
+                snapshot = registry.current()
+            with startup_phase("warmup"):
+                _, jpeg = cv2.imencode(".jpg", np.zeros((480, 640, 3), np.uint8))
+                gray = cv2.cvtColor(cv2.imdecode(jpeg, cv2.IMREAD_COLOR), cv2.COLOR_BGR2GRAY)
+                detect_faces(gray, detection_profile())
+                match_faces(snapshot.model, gray, np.array([[0, 0, 112, 92]]), snapshot.names)
+        except Exception as e:
+            startup_state["error"] = str(e)
+            print("Warm-up failed, not ready: %s" % str(e))
+            _retry_warm_up()
+            return False
+        finally:
+            startup_state["warming"] = False
+        startup_state.update(ready=True, error=None, time_to_ready=round(time.perf_counter() - STARTED_AT, 3))
+        print("Ready %.2fs after start" % startup_state["time_to_ready"])
+        return True
+
+
+def _retry_warm_up():
+    # Start the one retry loop of this process, unless it is already running.
+    # Called with startup_lock held.
+    if startup_state["retrying"]:
+        return
+    startup_state["retrying"] = True
+    thread = threading.Thread(target=_warm_up_retry_loop, name="warm-up-retry")
+    thread.daemon = True
+    thread.start()
+
+
+def _warm_up_retry_loop():
+    # Warm-up failed (e.g. Supabase or disk trouble): retry with backoff until the node is ready
+    delay = WARMUP_RETRY_SECONDS
+    while True:
+        time.sleep(delay)
+        # startup_state["retrying"] stays set, so a failing warm_up doesn't start a second loop
+        if warm_up():
+            break
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+    with startup_lock:
+        startup_state["retrying"] = False
+
+
+def _forget_retry():
+    # A forked worker (gunicorn preload) inherits the flag but not the retry thread
+    startup_state["retrying"] = False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_retry)
+
+
+def start_background():
+    """
+    Start the threads that serve requests in the background (server-side cameras).
+
+    Threads don't survive a fork, so under gunicorn with preload this runs in
+    each worker (see gunicorn.conf.py) instead of at import. Only one worker
+    ends up reading the cameras; ingest.start() elects it.
+    """
+    with startup_phase("ingest"):
+        ingest.start()
+    with startup_lock:
+        if not startup_state["ready"]:
+            _retry_warm_up()
+
+
+# With gunicorn preload this runs once in the master, before workers are forked
+warm_up()
+
+
 def load_users():
     users = {}
     if os.path.exists(USERS_FILE):
@@ -82,12 +212,31 @@ def login_required(f):
     return wrapped
 
 
+def admin_required(f):
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if not session.get("logged_in"):
+            return jsonify({"ok": False, "error": "Login required"}), 401
+        if session.get("username") not in ADMIN_USERS:
+            return jsonify({"ok": False, "error": "Admin only"}), 403
+        return f(*args, **kwargs)
+    return wrapped
+
+
 @app.route("/health")
 def health():
     """Simple health check - use this to verify the app is running on Render."""
     return jsonify({"status": "ok", "message": "Criminal Detection System is running"}), 200
 
 
+@app.route("/ready")
+def ready():
+    """Readiness check - 503 until the model is loaded and warmed up; point load balancers here."""
+    status = 200 if startup_state["ready"] else 503
+    return jsonify({"ready": startup_state["ready"], "error": startup_state["error"],
+                    "time_to_ready": startup_state["time_to_ready"], "phases": startup_phases}), status
+
+
 @app.route("/")
 def index():
     if session.get("logged_in"):
@@ -208,6 +357,8 @@ def api_register_criminal():
             return jsonify({"ok": False, "error": f"Required field missing: {field}"}), 400
 
     path = os.path.join(FACE_SAMPLES_DIR, "temp_criminal")
+    # Clear leftovers of an interrupted registration before staging new samples
+    discardRegistration(path)
     os.makedirs(path, exist_ok=True)
     img_list = []
 
@@ -232,21 +383,17 @@ def api_register_criminal():
             if idx is not None:
                 no_face.append(idx)
         if no_face:
-            import shutil
-            shutil.rmtree(path, ignore_errors=True)
+            discardRegistration(path)
             return jsonify({"ok": False, "error": f"Images without face or too small: {no_face}"}), 400
 
         row_id = insertData(entry_data)
         if row_id <= 0:
-            import shutil
-            shutil.rmtree(path, ignore_errors=True)
+            discardRegistration(path)
             return jsonify({"ok": False, "error": "Database error while storing data"}), 500
 
-        dest_dir = os.path.join(FACE_SAMPLES_DIR, entry_data["Name"])
-        if os.path.exists(dest_dir):
-            import shutil
-            shutil.rmtree(dest_dir, ignore_errors=True)
-        os.rename(path, dest_dir)
+        commitRegistration(path, entry_data["Name"], FACE_SAMPLES_DIR)
+        # Only the new samples are added; a full rebuild happens on /api/model/retrain {"full": true}
+        registry.add_identity(entry_data["Name"])
 
         profile_idx = min(int(request.form.get("profile_image_index", 1)) - 1, len(img_list) - 1)
         profile_img = img_list[profile_idx]
@@ -254,8 +401,7 @@ def api_register_criminal():
 
         return jsonify({"ok": True, "message": "Criminal registered successfully", "id": row_id})
     except Exception as e:
-        import shutil
-        shutil.rmtree(path, ignore_errors=True)
+        discardRegistration(path)
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
@@ -272,7 +418,8 @@ def api_detect():
         if f.filename:
             buf = f.read()
             nparr = np.frombuffer(buf, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            with metrics.stage("imdecode"):
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     if img is None and request.get_data():
         # Base64 from body (e.g. canvas data URL)
         try:
@@ -280,9 +427,11 @@ def api_detect():
             b64 = data.get("image") or request.get_data().decode()
             if b64.startswith("data:image"):
                 b64 = b64.split(",", 1)[-1]
-            buf = base64.b64decode(b64)
+            with metrics.stage("base64_decode"):
+                buf = base64.b64decode(b64)
             nparr = np.frombuffer(buf, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            with metrics.stage("imdecode"):
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         except Exception:
             pass
 
@@ -295,52 +444,286 @@ def api_detect():
     if len(face_coords) == 0:
         return jsonify({"ok": False, "error": "No face found in image or face too small"}), 400
 
-    model, names = train_model()
-    frame, recognized = recognize_face(model, frame, gray, face_coords, names)
+    snapshot = registry.get()
+    with metrics.stage("recognize"):
+        frame, recognized = recognize_face(snapshot.model, frame, gray, face_coords, snapshot.names)
     if not recognized:
-        return jsonify({"ok": False, "error": "No criminal recognized"}), 200
+        return jsonify({"ok": False, "error": "No criminal recognized", "model_version": snapshot.version}), 200
 
-    for name, _ in recognized:
-        recent_detections.insert(0, (name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        if len(recent_detections) > 20:
-            recent_detections.pop()
+    record_detections(recognized)
+
+    return jsonify({
+        "ok": True,
+        "recognized": [{"name": r[0], "confidence": float(r[1])} for r in recognized],
+        "model_version": snapshot.version,
+    })
 
-    return jsonify({"ok": True, "recognized": [{"name": r[0], "confidence": float(r[1])} for r in recognized]})
+
+# ---------- Metrics (Prometheus text format) and Server-Timing ----------
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.begin_timings()
+    g.profile = profiler.start(request.endpoint, request.path)
+
+
+@app.after_request
+def observe_request(response):
+    start = g.pop("request_start", None)
+    timings = metrics.end_timings()
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        metrics.request_seconds.observe(elapsed, request.endpoint or "unmatched")
+        if timings:
+            # Shows per-stage times of this response in the browser devtools (Network > Timing)
+            response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+    return response
+
+
+@app.teardown_request
+def finish_request_profile(exc):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiler.stop(profile, request.endpoint)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Scrapers can't log in; METRICS_TOKEN (if set) must be sent as a bearer token
+    if METRICS_TOKEN and request.headers.get("Authorization") != "Bearer " + METRICS_TOKEN:
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# ---------- Recognize from CCTV frame (raw JPEG body, or base64 JSON fallback) ----------
+BINARY_FRAME_TYPES = ("image/jpeg", "image/png", "application/octet-stream")
+
+
+def read_binary_body():
+    """
+    Read the raw request body into one preallocated buffer, without intermediate copies.
+
+    The buffer is sized from Content-Length, so bodies declared larger than
+    MAX_CONTENT_LENGTH are refused before anything is allocated.
+    """
+    length = request.content_length
+    if not length:
+        return request.get_data(cache=False)
+    if length > app.config["MAX_CONTENT_LENGTH"]:
+        raise RequestEntityTooLarge()
+    buf = bytearray(length)
+    view = memoryview(buf)
+    read = 0
+    while read < length:
+        n = request.stream.readinto(view[read:])
+        if not n:
+            break
+        read += n
+    return view[:read]
 
 
-# ---------- Recognize from base64 frame (CCTV) ----------
 @app.route("/api/criminal/recognize-frame", methods=["POST"])
 @login_required
 def api_recognize_frame():
-    data = request.get_json() or {}
-    b64 = data.get("frame")
-    if not b64:
-        return jsonify({"ok": False, "error": "No frame"}), 400
-    try:
-        if b64.startswith("data:image"):
-            b64 = b64.split(",", 1)[-1]
-        buf = base64.b64decode(b64)
-        nparr = np.frombuffer(buf, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    except Exception as e:
-        return jsonify({"ok": False, "error": "Invalid image: " + str(e)}), 400
+    if request.mimetype in BINARY_FRAME_TYPES:
+        with metrics.stage("read_body"):
+            buf = read_binary_body()
+        if len(buf) == 0:
+            return jsonify({"ok": False, "error": "No frame"}), 400
+        with metrics.stage("imdecode"):
+            img = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        data = request.get_json(silent=True) or {}
+        b64 = data.get("frame")
+        if not b64:
+            return jsonify({"ok": False, "error": "No frame"}), 400
+        try:
+            if b64.startswith("data:image"):
+                b64 = b64.split(",", 1)[-1]
+            with metrics.stage("base64_decode"):
+                buf = base64.b64decode(b64)
+            nparr = np.frombuffer(buf, np.uint8)
+            with metrics.stage("imdecode"):
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        except Exception as e:
+            metrics.errors_total.inc("decode")
+            return jsonify({"ok": False, "error": "Invalid image: " + str(e)}), 400
     if img is None:
+        metrics.errors_total.inc("decode")
         return jsonify({"ok": False, "error": "Could not decode image"}), 400
-
-    frame = cv2.flip(img, 1, 0)
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    face_coords = detect_faces(gray)
+    camera = request.args.get("camera", "")
+    client = (session.get("username"), camera)
+    return jsonify(recognize_frame(img, http_gates.get(client), http_trackers.get(client), detection_profile(camera)))
+
+
+def recognize_frame(img, gate=None, face_tracker=None, profile=None, source="http"):
+    """
+    Recognize faces in one CCTV frame and record the hits in recent detections.
+
+    Shared by the HTTP endpoint and the WebSocket channel.
+
+    Args:
+    - img: BGR frame as decoded from the camera JPEG
+    - gate: MotionGate of the feed; unchanged frames return its previous result
+    - face_tracker: FaceTracker of the feed; recognition reruns only for new or stale tracks
+    - profile: DetectionProfile of the camera (see DETECTION_PROFILES)
+    - source: Label of the frame counters on /metrics ("http" or "ws")
+
+    Returns:
+    - Result dictionary (ok, recognized and model_version when a face was found;
+      skipped when the previous result was reused)
+    """
+    metrics.frames_total.inc(source)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if gate is not None:
+        with metrics.stage("motion_gate"):
+            skip = gate.skip(gray)
+        if skip:
+            return dict(gate.result, skipped=True)
+
+    gray = cv2.flip(gray, 1, 0)
+    face_coords = detect_faces(gray, profile or detection_profile())
     if len(face_coords) == 0:
-        return jsonify({"ok": True, "recognized": []})
+        result = {"ok": True, "recognized": []}
+    else:
+        # Results are JSON only, so the colour frame is not flipped or annotated
+        metrics.faces_total.inc(source, amount=len(face_coords))
+        snapshot = registry.get()
+        with metrics.stage("recognize"):
+            if face_tracker is not None:
+                matches = face_tracker.match(snapshot.model, gray, face_coords, snapshot.names)
+            else:
+                matches = match_faces(snapshot.model, gray, face_coords, snapshot.names)
+        recognized = recognized_matches(matches)
+        metrics.recognitions_total.inc(source, amount=len(recognized))
+        record_detections([(m.name.capitalize(), m.confidence) for m in recognized])
+        result = {
+            "ok": True,
+            "recognized": [{"name": m.name.capitalize(), "confidence": float(m.confidence), "track_id": m.track_id}
+                           for m in recognized],
+            "model_version": snapshot.version,
+        }
+    if gate is not None:
+        gate.remember(result)
+    return result
+
+
+def record_detections(recognized):
+    with recent_lock:
+        for name, _ in recognized:
+            recent_detections.insert(0, (name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        while len(recent_detections) > 20:
+            recent_detections.pop()
 
-    model, names = train_model()
-    _, recognized = recognize_face(model, frame, gray, face_coords, names)
-    for name, _ in recognized:
-        recent_detections.insert(0, (name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    while len(recent_detections) > 20:
-        recent_detections.pop()
 
-    return jsonify({"ok": True, "recognized": [{"name": r[0], "confidence": float(r[1])} for r in recognized]})
+# Server-side cameras from CAMERA_SOURCES feed the same recent detections as the CCTV page
+ingest.on_detection = lambda camera, recognized: record_detections(recognized)
+if os.environ.get("DEFER_BACKGROUND_THREADS") != "1":
+    start_background()
+
+
+# ---------- CCTV WebSocket (binary JPEG frames in, results pushed back) ----------
+def cctv_socket_worker(ws, slot, profile):
+    gate = motion.MotionGate()
+    face_tracker = tracker.FaceTracker()
+    while True:
+        buf = slot.take()
+        if buf is None:
+            return
+        start = time.perf_counter()
+        metrics.begin_timings()
+        with metrics.stage("imdecode"):
+            img = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            metrics.errors_total.inc("decode")
+            result = {"ok": False, "error": "Could not decode image"}
+        else:
+            try:
+                result = recognize_frame(img, gate, face_tracker, profile, source="ws")
+            except Exception as e:
+                metrics.errors_total.inc("recognize")
+                result = {"ok": False, "error": str(e)}
+        # Per-stage milliseconds, the WebSocket counterpart of the Server-Timing header
+        timings = metrics.end_timings()
+        timings["total"] = time.perf_counter() - start
+        timing = {name: round(seconds * 1000.0, 2) for name, seconds in timings.items()}
+        # The page counts its frames in flight as sent - answered - dropped
+        result.update(type="result", received=slot.received, dropped=slot.dropped, timing=timing)
+        try:
+            ws.send(json.dumps(result))
+            if result.get("recognized"):
+                with recent_lock:
+                    detections = recent_detections[:10]
+                ws.send(json.dumps({"type": "recent", "detections": detections}))
+        except ConnectionClosed:
+            slot.close()
+            return
+
+
+@sock.route("/ws/cctv")
+def ws_cctv(ws):
+    if not session.get("logged_in"):
+        ws.close(reason=1008, message="Login required")
+        return
+    slot = LatestFrame()
+    profile = detection_profile(request.args.get("camera", ""))
+    worker = threading.Thread(target=cctv_socket_worker, args=(ws, slot, profile))
+    worker.daemon = True
+    worker.start()
+    try:
+        while True:
+            data = ws.receive()
+            if isinstance(data, (bytes, bytearray)) and data:
+                slot.put(data)
+    except ConnectionClosed:
+        pass
+    finally:
+        slot.close()
+        worker.join()
+
+
+# ---------- Server-side cameras (RTSP / video files) ----------
+@app.route("/api/cameras")
+@login_required
+def api_cameras():
+    return jsonify({"ok": True, "ingest": ingest.stats()})
+
+
+# The server opens whatever source it is given (URLs, files, devices), so only admins change the list.
+# Changes go to the shared camera list and are applied by the one process that reads the cameras.
+@app.route("/api/cameras", methods=["POST"])
+@admin_required
+def api_add_camera():
+    data = request.get_json(silent=True) or {}
+    name = (data.get("name") or "").strip()
+    source = str(data.get("source") or "").strip()
+    if not name or not source:
+        return jsonify({"ok": False, "error": "name and source are required"}), 400
+    if not ingest.request_add(name, source):
+        return jsonify({"ok": False, "error": "Camera name already in use"}), 409
+    return jsonify({"ok": True, "cameras": ingest.camera_list()}), 202
+
+
+@app.route("/api/cameras/<name>", methods=["DELETE"])
+@admin_required
+def api_remove_camera(name):
+    if not ingest.request_remove(name):
+        return jsonify({"ok": False, "error": "Not found"}), 404
+    return jsonify({"ok": True, "cameras": ingest.camera_list()}), 202
+
+
+@app.route("/api/motion")
+@login_required
+def api_motion():
+    """Frames skipped by motion gating across the HTTP, WebSocket and camera feeds."""
+    return jsonify({"ok": True, "motion": motion.totals()})
+
+
+@app.route("/api/tracking")
+@login_required
+def api_tracking():
+    """Faces recognized vs. served from a track's cached identity, and crowd-mode budget use."""
+    return jsonify({"ok": True, "tracking": tracker.totals(), "crowd": crowd.totals()})
 
 
 # ---------- Criminal profile by name ----------
@@ -366,11 +749,53 @@ def profile_pic(id):
     return send_from_directory(PROFILE_PICS_DIR, "criminal %d.png" % id, mimetype="image/png")
 
 
+# ---------- Recognition model ----------
+@app.route("/api/model")
+@login_required
+def api_model_info():
+    return jsonify({"ok": True, "model": registry.info()})
+
+
+@app.route("/api/model/retrain", methods=["POST"])
+@login_required
+def api_model_retrain():
+    data = request.get_json(silent=True) or {}
+    if data.get("full"):
+        registry.compact()
+    else:
+        registry.retrain_async()
+    return jsonify({"ok": True, "model": registry.info()}), 202
+
+
+# ---------- Request profiling (admin) ----------
+@app.route("/api/admin/profile")
+@admin_required
+def api_profile_status():
+    return jsonify({"ok": True, "profile": profiler.status()})
+
+
+@app.route("/api/admin/profile", methods=["POST"])
+@admin_required
+def api_profile_arm():
+    # {"endpoint": "api_recognize_frame" or "/api/criminal/recognize-frame", "requests": 10}
+    data = request.get_json(silent=True) or {}
+    endpoint = (data.get("endpoint") or "").strip()
+    try:
+        count = int(data.get("requests", 1))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "requests must be a number"}), 400
+    if count > 0 and not endpoint:
+        return jsonify({"ok": False, "error": "endpoint required"}), 400
+    return jsonify({"ok": True, "profile": profiler.arm(endpoint, count)})
+
+
 # ---------- Recent detections (for CCTV page) ----------
 @app.route("/api/recent-detections")
 @login_required
 def api_recent_detections():
-    return jsonify({"ok": True, "detections": recent_detections[:10]})
+    with recent_lock:
+        detections = recent_detections[:10]
+    return jsonify({"ok": True, "detections": detections})
 
 
 if __name__ == "__main__":
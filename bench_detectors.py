@@ -0,0 +1,149 @@
+"""
+Compare face detector backends on speed and detections.
+
+With an image directory, every image is run through each backend and the
+number of faces found is reported. Without one, synthetic scenes are built by
+pasting face samples onto noisy backgrounds, which also gives recall and
+false positives against the known face positions.
+
+Usage: python bench_detectors.py [image_dir] [--backends haar,haar_alt2,lbp,dnn,yunet]
+                                 [--scenes 40] [--width 1280] [--height 720] [--repeat 3]
+                                 [--min-face 40] [--tile 960]
+
+--tile also runs every backend in tiled mode (see detectors.detect_tiled).
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detectors import BACKENDS, DEFAULT_PROFILE, create_detector, detect_tiled
+from facerec import IMAGE_EXTENSIONS, STAGING_DIR, gallery_fingerprint
+from gallery import packed_gallery
+from tracker import iou
+
+# Detections overlapping a pasted face by at least this much count as a hit
+MATCH_IOU = 0.3
+
+
+def load_images(image_dir):
+    images = []
+    for filename in sorted(os.listdir(image_dir)):
+        if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        image = cv2.imread(os.path.join(image_dir, filename), cv2.IMREAD_GRAYSCALE)
+        if image is not None:
+            images.append((image, None))
+    return images
+
+
+def synthetic_scenes(count, width, height, min_face, seed=0, fn_dir='face_samples'):
+    """
+    Paste 1-4 padded face samples per scene at random sizes and positions.
+
+    Args:
+    - fn_dir: Face samples directory; the pack is built from it first if
+      missing or out of date (it is not part of a fresh checkout)
+
+    Returns:
+    - List of (gray scene, list of ground-truth face boxes)
+    """
+    packed_gallery.sync(fn_dir, gallery_fingerprint(fn_dir), skip=(STAGING_DIR,))
+    faces, _, _ = packed_gallery.load(skip=(STAGING_DIR,))
+    if len(faces) == 0:
+        raise SystemExit("No face samples to build scenes from; pass an image directory instead")
+    rng = np.random.default_rng(seed)
+    scenes = []
+    for _ in range(count):
+        scene = rng.integers(40, 200, size=(height // 8, width // 8), dtype=np.uint8)
+        scene = cv2.resize(scene, (width, height), interpolation=cv2.INTER_LINEAR)
+        boxes = []
+        for _ in range(rng.integers(1, 5)):
+            face = np.asarray(faces[rng.integers(len(faces))])
+            # Pad the tight crop so the detector sees some head around the face
+            padded = cv2.copyMakeBorder(face, 30, 30, 30, 30, cv2.BORDER_REPLICATE)
+            face_w = int(rng.uniform(min_face, max(min_face + 1, 0.3 * height)))
+            scale = face_w / float(face.shape[1])
+            padded = cv2.resize(padded, (int(padded.shape[1] * scale), int(padded.shape[0] * scale)))
+            ph, pw = padded.shape
+            if pw >= width or ph >= height:
+                continue
+            x, y = int(rng.integers(0, width - pw)), int(rng.integers(0, height - ph))
+            box = (x + int(30 * scale), y + int(30 * scale), int(face.shape[1] * scale), int(face.shape[0] * scale))
+            if any(_overlaps(box, other) for other in boxes):
+                continue
+            scene[y:y + ph, x:x + pw] = padded
+            boxes.append(box)
+        scenes.append((scene, boxes))
+    return scenes
+
+
+def _overlaps(a, b, margin=40):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return ax < bx + bw + margin and bx < ax + aw + margin and ay < by + bh + margin and by < ay + ah + margin
+
+
+def run(detect, images, repeat):
+    times, found, hits, truth = [], 0, 0, 0
+    for image, boxes in images:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            detections = detect(image)
+        times.append((time.perf_counter() - start) * 1000 / repeat)
+        found += len(detections)
+        if boxes is not None:
+            truth += len(boxes)
+            hits += sum(1 for box in boxes if any(iou(box, tuple(d)) >= MATCH_IOU for d in detections))
+    return {
+        "ms": float(np.mean(times)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "faces": found,
+        "recall": hits / float(truth) if truth else None,
+        "false_positives": found - hits if truth else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("image_dir", nargs="?", help="Directory of test images (default: synthetic scenes)")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--scenes", type=int, default=40)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-face", type=int, default=DEFAULT_PROFILE.min_face,
+                        help="Smallest face to look for (and to paste into synthetic scenes)")
+    parser.add_argument("--tile", type=int, default=0, help="Also run tiled detection with this tile size")
+    args = parser.parse_args()
+    profile = DEFAULT_PROFILE._replace(min_face=args.min_face, tile=args.tile)
+
+    if args.image_dir:
+        images = load_images(args.image_dir)
+        print("%d images from %s" % (len(images), args.image_dir))
+    else:
+        images = synthetic_scenes(args.scenes, args.width, args.height, args.min_face)
+        print("%d synthetic %dx%d scenes, %d faces" % (len(images), args.width, args.height,
+                                                       sum(len(b) for _, b in images)))
+
+    print("%-16s %9s %9s %7s %8s %8s" % ("backend", "ms/frame", "p95 ms", "faces", "recall", "false+"))
+    for backend in args.backends.split(","):
+        try:
+            detector = create_detector(backend.strip())
+        except (IOError, ValueError, cv2.error) as e:
+            print("%-16s skipped: %s" % (backend, str(e)))
+            continue
+        modes = [(backend, lambda image: detector.detect(image, profile))]
+        if args.tile:
+            modes.append((backend + "/tiled", lambda image: detect_tiled(detector, image, profile)))
+        for label, detect in modes:
+            r = run(detect, images, args.repeat)
+            recall = "%7.1f%%" % (r["recall"] * 100) if r["recall"] is not None else "%8s" % "-"
+            false_pos = "%8d" % r["false_positives"] if r["false_positives"] is not None else "%8s" % "-"
+            print("%-16s %9.2f %9.2f %7d %s %s" % (label, r["ms"], r["p95_ms"], r["faces"], recall, false_pos))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Compare the batched NumPy matcher with OpenCV's per-face LBPH predict loop.
+
+Usage: python bench_matcher.py [--faces 1,4,16,32] [--dtype uint8] [--repeat 3]
+"""
+import argparse
+
+import numpy as np
+
+from facerec import STAGING_DIR, HistogramMatcher, train_model
+from gallery import packed_gallery
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--faces", default="1,4,16,32", help="Faces per frame to time, comma-separated")
+    parser.add_argument("--dtype", help="Gallery dtype of the matcher (default: GALLERY_DTYPE)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per size; the best one is reported")
+    args = parser.parse_args()
+    try:
+        batch_sizes = [int(b) for b in args.faces.split(",") if b.strip()]
+    except ValueError:
+        parser.error("--faces must be comma-separated integers")
+
+    model, names = train_model()
+    matcher = HistogramMatcher.from_model(model, args.dtype)
+    faces, _, _ = packed_gallery.load(skip=(STAGING_DIR,))
+    rng = np.random.default_rng(0)
+
+    print("Gallery: %d samples, %d identities" % (matcher.sample_count(), len(names)))
+    print("%8s %12s %12s %9s %10s" % ("faces", "opencv ms", "numpy ms", "speedup", "agreement"))
+    for batch in batch_sizes:
+        picks = rng.integers(0, len(faces), size=batch)
+        # Add noise so the queries are not exact copies of gallery samples
+        queries = [np.clip(faces[i].astype(np.int16) + rng.integers(-8, 9, faces[i].shape), 0, 255).astype(np.uint8)
+                   for i in picks]
+        r = matcher.compare_with_opencv(model, queries, args.repeat)
+        print("%8d %12.2f %12.2f %8.2fx %9.0f%%" % (
+            r["faces"], r["opencv_ms"], r["numpy_ms"], r["speedup"], r["agreement"] * 100))
+
+
+if __name__ == "__main__":
+    main()
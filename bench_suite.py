@@ -0,0 +1,344 @@
+"""
+Benchmark the training, detection and recognition hot paths.
+
+Uses the face samples of the packed gallery, scaled up synthetically: every
+extra copy of the gallery is a new set of identities made of flipped, shifted
+and noise-augmented samples. All inputs come from a fixed seed, so two runs
+on the same machine measure the same work.
+
+Sections:
+- train:     facerec.train_model (pack sync, load, LBPH training) against
+             gallery size, each run in a fresh process with its peak memory
+- detect:    detect_faces latency and recall against frame resolution
+- recognize: recognize_face latency against faces per frame, gallery size and
+             recognizer backend
+- e2e:       /api/criminal/recognize-frame throughput through the Flask test client
+
+Results are written as JSON (default bench_results/<time>-<commit>.json);
+--compare prints the change of every timing against an earlier result file.
+
+Usage: python bench_suite.py [--sections train,detect,recognize,e2e] [--quick]
+                             [--out results.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from bench_detectors import run as run_detection, synthetic_scenes
+from config import DETECTOR_BACKEND, RECOGNIZER_BACKEND
+from facerec import STAGING_DIR, detect_faces, gallery_fingerprint, make_recognizer, recognize_face, train_model
+from gallery import PackedGallery, packed_gallery
+
+SECTIONS = ("train", "detect", "recognize", "e2e")
+RESULTS_DIR = "bench_results"
+SEED = 0
+
+
+# ---------- Inputs ----------
+def base_gallery(fn_dir="face_samples"):
+    # The pack is not part of a fresh checkout; build it from face_samples first, as train_model does
+    packed_gallery.sync(fn_dir, gallery_fingerprint(fn_dir), skip=(STAGING_DIR,))
+    faces, labels, names = packed_gallery.load(skip=(STAGING_DIR,))
+    if len(faces) == 0:
+        raise SystemExit("No face samples in %s; register a subject first" % fn_dir)
+    return np.asarray(faces), np.asarray(labels, dtype=np.int32), names
+
+
+def scaled_gallery(faces, labels, factor, seed=SEED):
+    """
+    Grow the gallery to factor times its size with new, augmented identities.
+
+    Returns:
+    - Tuple of (faces array, labels array, names dictionary)
+    """
+    rng = np.random.default_rng(seed)
+    label_span = int(labels.max()) + 1
+    all_faces, all_labels = [faces], [labels]
+    for copy in range(1, factor):
+        augmented = faces[:, :, ::-1] if copy % 2 else faces
+        shift = int(rng.integers(-3, 4))
+        augmented = np.roll(augmented, shift, axis=2)
+        noise = rng.integers(-10, 11, size=augmented.shape)
+        all_faces.append(np.clip(augmented.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+        all_labels.append(labels + copy * label_span)
+    labels = np.concatenate(all_labels)
+    names = {int(label): "subject%d" % label for label in np.unique(labels)}
+    return np.ascontiguousarray(np.concatenate(all_faces)), labels, names
+
+
+def train(faces, labels, backend=None):
+    model = cv2.face.LBPHFaceRecognizer_create()
+    model.train(faces, labels)
+    return make_recognizer(model, backend)
+
+
+def crowd_frame(faces, count, seed=SEED):
+    """
+    Lay count gallery faces out on a grid in a 1280x720 frame.
+
+    Returns:
+    - Tuple of (BGR frame, gray frame, list of face boxes)
+    """
+    rng = np.random.default_rng(seed)
+    gray = rng.integers(40, 200, size=(720, 1280), dtype=np.uint8)
+    # Gallery samples are at the recognizer's input size, so crop_faces won't resize them
+    face_h, face_w = faces.shape[1:3]
+    columns = 1280 // (face_w + 8)
+    boxes = []
+    for i in range(count):
+        x, y = 4 + (i % columns) * (face_w + 8), 4 + (i // columns) * (face_h + 8)
+        gray[y:y + face_h, x:x + face_w] = faces[rng.integers(len(faces))]
+        boxes.append((x, y, face_w, face_h))
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), gray, np.asarray(boxes, dtype=np.int32)
+
+
+def timings(samples_ms):
+    return {
+        "ms": round(float(np.mean(samples_ms)), 3),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+    }
+
+
+# ---------- Train ----------
+def write_samples(fn_dir, faces, labels, names):
+    # A face_samples tree of the scaled gallery, laid out as registration saves it
+    counts = {}
+    for face, label in zip(faces, labels):
+        subject_dir = os.path.join(fn_dir, names[int(label)])
+        counts[subject_dir] = counts.get(subject_dir, 0) + 1
+        if counts[subject_dir] == 1:
+            os.makedirs(subject_dir)
+        cv2.imwrite(os.path.join(subject_dir, "%d.png" % counts[subject_dir]), face)
+
+
+def _memory_kb(field):
+    # Resident memory figures of this process from /proc (Linux only)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _train_child(fn_dir, pack_dir, results):
+    # Runs in a freshly spawned process, so its peak RSS so far is the interpreter and imports alone
+    packed_gallery.pack_dir = pack_dir
+    before = _memory_kb("VmHWM")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        train_model(fn_dir)
+    seconds = time.perf_counter() - start
+    peak = _memory_kb("VmHWM")
+    results.put((seconds, (peak - before) / 1024.0 if before and peak else None))
+
+
+def bench_train(faces, labels, scales, repeat):
+    """
+    Time facerec.train_model (pack sync, load and LBPH training) on scaled galleries.
+
+    Every run is a new spawned process, so the peak memory it reports is what
+    training added on top of a clean interpreter, not noise from this one's heap.
+    """
+    cases = []
+    ctx = multiprocessing.get_context("spawn")
+    for factor in scales:
+        scaled, scaled_labels, names = scaled_gallery(faces, labels, factor)
+        with tempfile.TemporaryDirectory(prefix="bench-train-") as work_dir:
+            fn_dir, pack_dir = os.path.join(work_dir, "face_samples"), os.path.join(work_dir, "face_gallery")
+            os.makedirs(pack_dir)
+            write_samples(fn_dir, scaled, scaled_labels, names)
+            # Pack once up front: the timed runs measure a restart, where the pack is current
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                PackedGallery(pack_dir).rebuild(fn_dir, gallery_fingerprint(fn_dir), skip=(STAGING_DIR,))
+            pack_ms = (time.perf_counter() - start) * 1000
+            seconds, peaks = [], []
+            for _ in range(repeat):
+                results = ctx.Queue()
+                child = ctx.Process(target=_train_child, args=(fn_dir, pack_dir, results))
+                child.start()
+                elapsed, peak = results.get()
+                child.join()
+                seconds.append(elapsed * 1000)
+                peaks.append(peak)
+        case = {"samples": len(scaled), "identities": len(names), "pack_ms": round(pack_ms, 1)}
+        case.update(timings(seconds))
+        case["peak_mb"] = round(max(peaks), 1) if None not in peaks else None
+        cases.append(case)
+        print("train      %6d samples %5d identities %10.1f ms %8s MB  (pack %.0f ms)" % (
+            case["samples"], case["identities"], case["ms"],
+            "%.1f" % case["peak_mb"] if case["peak_mb"] is not None else "-", pack_ms))
+    return cases
+
+
+# ---------- Detect ----------
+def bench_detect(resolutions, scenes, repeat):
+    cases = []
+    for width, height in resolutions:
+        images = synthetic_scenes(scenes, width, height, 40, seed=SEED)
+        r = run_detection(detect_faces, images, repeat)
+        case = {"width": width, "height": height, "frames": len(images),
+                "ms": round(r["ms"], 3), "p95_ms": round(r["p95_ms"], 3),
+                "recall": round(r["recall"], 3) if r["recall"] is not None else None,
+                "false_positives": r["false_positives"]}
+        cases.append(case)
+        print("detect     %4dx%-4d %10.1f ms  p95 %7.1f ms  recall %5.1f%%" % (
+            width, height, case["ms"], case["p95_ms"], (case["recall"] or 0) * 100))
+    return cases
+
+
+# ---------- Recognize ----------
+def bench_recognize(faces, labels, scales, face_counts, backends, repeat):
+    cases = []
+    for factor in scales:
+        scaled, scaled_labels, names = scaled_gallery(faces, labels, factor)
+        for backend in backends:
+            model = train(scaled, scaled_labels, backend)
+            for count in face_counts:
+                frame, gray, boxes = crowd_frame(scaled, count)
+                samples = []
+                for _ in range(repeat):
+                    canvas = frame.copy()
+                    start = time.perf_counter()
+                    recognize_face(model, canvas, gray, boxes, names)
+                    samples.append((time.perf_counter() - start) * 1000)
+                case = {"backend": backend, "samples": len(scaled), "faces": count}
+                case.update(timings(samples))
+                cases.append(case)
+                print("recognize  %-6s %6d samples %3d faces %9.2f ms" % (backend, len(scaled), count, case["ms"]))
+    return cases
+
+
+# ---------- End to end ----------
+def bench_e2e(frames, width, height):
+    from app import app
+    scenes = synthetic_scenes(min(frames, 20), width, height, 40, seed=SEED)
+    bodies = [cv2.imencode(".jpg", cv2.cvtColor(scene, cv2.COLOR_GRAY2BGR))[1].tobytes() for scene, _ in scenes]
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+        session["username"] = "bench"
+
+    samples, skipped, failed = [], 0, 0
+    start = time.perf_counter()
+    for i in range(frames):
+        sent = time.perf_counter()
+        response = client.post("/api/criminal/recognize-frame?camera=bench", data=bodies[i % len(bodies)],
+                               content_type="image/jpeg")
+        samples.append((time.perf_counter() - sent) * 1000)
+        result = response.get_json(silent=True) or {}
+        if response.status_code != 200 or not result.get("ok"):
+            failed += 1
+        skipped += bool(result.get("skipped"))
+    elapsed = time.perf_counter() - start
+    case = {"frames": frames, "width": width, "height": height, "fps": round(frames / elapsed, 2),
+            "skipped": skipped, "failed": failed}
+    case.update(timings(samples))
+    case["p99_ms"] = round(float(np.percentile(samples, 99)), 3)
+    print("e2e        %4dx%-4d %8.1f fps %9.1f ms  p95 %7.1f ms  (%d skipped, %d failed)" % (
+        width, height, case["fps"], case["ms"], case["p95_ms"], skipped, failed))
+    return [case]
+
+
+# ---------- Results ----------
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "recognizer_backend": RECOGNIZER_BACKEND,
+        "detector_backend": DETECTOR_BACKEND,
+    }
+
+
+def _case_key(section, case):
+    # Parameters that identify a case, i.e. everything but the measurements
+    measured = ("ms", "p50_ms", "p95_ms", "p99_ms", "peak_mb", "pack_ms", "fps", "recall", "false_positives",
+                "skipped", "failed")
+    return section + " " + " ".join("%s=%s" % (k, case[k]) for k in sorted(case) if k not in measured)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {_case_key(section, case): case for section, cases in baseline.get("results", {}).items()
+           for case in cases}
+    print("\nChange against %s (commit %s):" % (baseline_path, baseline.get("environment", {}).get("commit")))
+    for section, cases in results.items():
+        for case in cases:
+            key = _case_key(section, case)
+            if key in old and old[key].get("ms"):
+                change = (case["ms"] - old[key]["ms"]) / old[key]["ms"] * 100
+                print("  %-60s %9.2f -> %9.2f ms  %+6.1f%%" % (key, old[key]["ms"], case["ms"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sections", default=",".join(SECTIONS))
+    parser.add_argument("--quick", action="store_true", help="Fewer sizes and repeats, for a smoke run")
+    parser.add_argument("--backends", default="lbph,numpy,ann", help="Recognizer backends for the recognize section")
+    parser.add_argument("--out", help="Result file (default %s/<time>-<commit>.json)" % RESULTS_DIR)
+    parser.add_argument("--compare", help="Earlier result file to compare timings with")
+    args = parser.parse_args()
+    sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error("unknown sections: %s" % ", ".join(sorted(unknown)))
+
+    quick = args.quick
+    scales = [1, 2, 4] if quick else [1, 2, 4, 8, 16]
+    repeat = 2 if quick else 5
+    faces, labels, _ = base_gallery()
+    env = environment()
+    print("Gallery: %d samples; commit %s; %d CPUs" % (len(faces), env["commit"], env["cpus"]))
+
+    results = {}
+    if "train" in sections:
+        results["train"] = bench_train(faces, labels, scales, repeat)
+    if "detect" in sections:
+        resolutions = [(640, 480), (1280, 720)] if quick else [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+        results["detect"] = bench_detect(resolutions, 5 if quick else 20, repeat)
+    if "recognize" in sections:
+        face_counts = [1, 8] if quick else [1, 4, 16, 32]
+        backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+        results["recognize"] = bench_recognize(faces, labels, scales[:2] if quick else scales[::2], face_counts,
+                                               backends, repeat * 4)
+    if "e2e" in sections:
+        results["e2e"] = bench_e2e(40 if quick else 200, 1280, 720)
+
+    out = args.out or os.path.join(RESULTS_DIR, "%s-%s.json" % (
+        datetime.now().strftime("%Y%m%d-%H%M%S"), env["commit"] or "nogit"))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"environment": env, "quick": quick, "results": results}, f, indent=2)
+    print("Results written to %s" % out)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
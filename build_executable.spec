@@ -20,6 +20,14 @@ a = Analysis(
         'PIL',
         'tkinter',
         'facerec',
+        'detectors',
+        'gallery',
+        'model_registry',
+        'motion',
+        'tracker',
+        'crowd',
+        'metrics',
+        'ingest',
         'register',
         'dbHandler',
         'numpy',
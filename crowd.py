@@ -0,0 +1,131 @@
+# crowd.py
+"""
+Crowd-scene recognition.
+
+When a frame has many faces to recognize, the crops are ranked (new faces
+first, then larger and sharper ones), the best CROWD_MAX_FACES are split into
+small chunks and recognized in parallel on a thread pool, and whatever is not
+finished within CROWD_BUDGET_MS is deferred. OpenCV's LBPH predict and the
+NumPy matchers release the GIL, so chunks run on all cores. The tracker keeps
+deferred faces at the front of the queue for the next frame.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+
+from config import CROWD_BUDGET_MS, CROWD_CHUNK, CROWD_MAX_FACES, CROWD_MIN_FACES, CROWD_MODE, CROWD_WORKERS
+from facerec import predict_faces
+
+# Laplacian variance of a 92x112 crop above which a face counts as fully sharp
+SHARP_VARIANCE = 150.0
+
+_totals_lock = threading.Lock()
+_totals = {"frames": 0, "recognized": 0, "deferred": 0, "over_budget": 0}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, CROWD_WORKERS), thread_name_prefix='crowd')
+    return _pool
+
+
+def _forget_pool():
+    # A forked worker (gunicorn preload) inherits the pool but not its threads
+    global _pool
+    _pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pool)
+
+
+def totals():
+    """
+    Crowd-mode counters for this process.
+
+    Returns:
+    - Dictionary with frames handled in crowd mode, faces recognized and
+      deferred, and frames that hit the latency budget
+    """
+    with _totals_lock:
+        return dict(_totals)
+
+
+def face_quality(face):
+    """
+    Sharpness of a face crop between 0 (blurred) and 1.
+
+    Args:
+    - face: 92x112 grayscale crop
+
+    Returns:
+    - Float quality score
+    """
+    return min(1.0, cv2.Laplacian(face, cv2.CV_32F).var() / SHARP_VARIANCE)
+
+
+class CrowdRecognizer:
+    """
+    Parallel, budgeted recognition of many faces.
+
+    Args:
+    - max_faces: Faces recognized per frame at most
+    - budget_ms: Time after which unfinished faces are deferred
+    - chunk: Faces per worker task
+    - min_faces: Fewer faces than this are recognized inline instead
+    """
+    def __init__(self, max_faces=CROWD_MAX_FACES, budget_ms=CROWD_BUDGET_MS, chunk=CROWD_CHUNK,
+                 min_faces=CROWD_MIN_FACES):
+        self.max_faces = max_faces
+        self.budget_ms = budget_ms
+        self.chunk = max(1, chunk)
+        self.min_faces = min_faces
+
+    def applies(self, count):
+        return CROWD_MODE and count >= self.min_faces
+
+    def recognize(self, model, faces, priorities):
+        """
+        Recognize the highest-priority faces within the budget.
+
+        Args:
+        - model: Recognizer, as for facerec.predict_faces
+        - faces: List of 92x112 grayscale crops
+        - priorities: Sort key per face; higher keys are recognized first
+
+        Returns:
+        - List with a (label, confidence) tuple per face, or None for deferred faces
+        """
+        order = sorted(range(len(faces)), key=lambda i: priorities[i], reverse=True)[:self.max_faces]
+        pool = _executor()
+        tasks = []
+        for start in range(0, len(order), self.chunk):
+            indexes = order[start:start + self.chunk]
+            tasks.append((indexes, pool.submit(predict_faces, model, [faces[i] for i in indexes])))
+
+        done, pending = wait([task for _, task in tasks], timeout=self.budget_ms / 1000.0)
+        for task in pending:
+            # Chunks that haven't started are dropped; running ones finish but are ignored
+            task.cancel()
+
+        results = [None] * len(faces)
+        for indexes, task in tasks:
+            if task in done and task.exception() is None:
+                for i, prediction in zip(indexes, task.result()):
+                    results[i] = prediction
+        recognized = sum(1 for r in results if r is not None)
+        with _totals_lock:
+            _totals["frames"] += 1
+            _totals["recognized"] += recognized
+            _totals["deferred"] += len(faces) - recognized
+            if pending:
+                _totals["over_budget"] += 1
+        return results
@@ -1,4 +1,5 @@
 from supabase import create_client, Client
+import metrics
 from config import SUPABASE_URL, SUPABASE_KEY, TABLE_NAME
 
 # Initialize Supabase client
@@ -37,13 +38,15 @@ def insertData(data):
     }
     
     try:
-        response = supabase.table(TABLE_NAME).insert(insert_data).execute()
+        with metrics.stage("supabase_insert"):
+            response = supabase.table(TABLE_NAME).insert(insert_data).execute()
         if response.data:
             rowId = response.data[0]["id"]
             print("Data stored on row %d" % rowId)
         else:
             print("Data insertion failed: No data returned")
     except Exception as e:
+        metrics.errors_total.inc("supabase_insert")
         print("Data insertion failed: %s" % str(e))
     
     print("Connection closed")
@@ -65,7 +68,8 @@ def retrieveData(name):
     print("Connecting to Supabase...")
     
     try:
-        response = supabase.table(TABLE_NAME).select("*").eq("name", name.lower()).execute()
+        with metrics.stage("supabase_select"):
+            response = supabase.table(TABLE_NAME).select("*").eq("name", name.lower()).execute()
         
         if response.data and len(response.data) > 0:
             result = response.data[0]
@@ -86,6 +90,7 @@ def retrieveData(name):
         else:
             print("No data found for name: %s" % name)
     except Exception as e:
+        metrics.errors_total.inc("supabase_select")
         print("Error: Unable to fetch data - %s" % str(e))
     
     print("Connection closed")
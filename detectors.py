@@ -0,0 +1,427 @@
+# detectors.py
+"""
+Face detector backends.
+
+Every backend takes a grayscale frame and a DetectionProfile and returns face
+boxes in frame coordinates. The backend used by detect_faces is chosen with
+DETECTOR_BACKEND:
+
+- haar:      face_cascade.xml shipped with the app (default)
+- haar_alt2: OpenCV's haarcascade_frontalface_alt2 from cv2.data
+- lbp:       an LBP cascade (e.g. lbpcascade_frontalface_improved.xml) from DETECTOR_LBP_MODEL;
+             faster than Haar, slightly lower recall
+- dnn:       OpenCV's res10 SSD face detector run with cv2.dnn, from DETECTOR_DNN_MODEL
+             (.caffemodel) and DETECTOR_DNN_CONFIG (deploy.prototxt)
+- yunet:     cv2.FaceDetectorYN from DETECTOR_YUNET_MODEL (.onnx)
+
+Model files are not bundled; the dnn/lbp/yunet backends need them on disk.
+"""
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from config import (DETECT_MAX_LEVELS, DETECT_MAX_WIDTH, DETECT_MIN_FACE, DETECT_TILE, DETECT_TILE_OVERLAP,
+                    DETECT_TILE_WORKERS, DETECTION_PROFILES, DETECTOR_BACKEND, DETECTOR_DNN_CONFIDENCE,
+                    DETECTOR_DNN_CONFIG, DETECTOR_DNN_MODEL, DETECTOR_LBP_MODEL, DETECTOR_YUNET_MODEL)
+
+
+def resource_path(relative_path):
+    """Get absolute path to resource, works for dev and for PyInstaller"""
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+
+# ---------- Detection planner ----------
+# What to look for in a feed; plan_detection turns it into detector parameters for a frame size
+DetectionProfile = namedtuple('DetectionProfile', ['min_face', 'max_face', 'max_width', 'scale_factor',
+                                                   'min_neighbors', 'max_levels', 'tile', 'tile_overlap'])
+
+
+def checked_profile(profile, name='default'):
+    """
+    Clamp the tile overlap of a profile to half a tile.
+
+    An overlap close to the tile size shrinks the step between tiles to a few
+    pixels, which splits a 4K frame into thousands of tiles.
+
+    Args:
+    - profile: DetectionProfile
+    - name: Camera name for the warning
+
+    Returns:
+    - The profile, with tile_overlap at most tile // 2 when tiling is on
+    """
+    if profile.tile > 0 and profile.tile_overlap > profile.tile // 2:
+        print("Detection profile %s: tile overlap %d clamped to half of tile %d" % (
+            name, profile.tile_overlap, profile.tile))
+        profile = profile._replace(tile_overlap=profile.tile // 2)
+    return profile
+
+
+DEFAULT_PROFILE = checked_profile(DetectionProfile(min_face=DETECT_MIN_FACE, max_face=1.0,
+                                                   max_width=DETECT_MAX_WIDTH, scale_factor=1.1, min_neighbors=3,
+                                                   max_levels=DETECT_MAX_LEVELS, tile=DETECT_TILE,
+                                                   tile_overlap=DETECT_TILE_OVERLAP))
+# Downscale factor, detectMultiScale parameters and the detection frame size
+DetectionPlan = namedtuple('DetectionPlan', ['scale', 'scale_factor', 'min_size', 'max_size',
+                                             'min_neighbors', 'width', 'height'])
+
+
+def detection_profile(camera=None):
+    """
+    Get the detection profile of a camera.
+
+    Args:
+    - camera: Camera name; DETECTION_PROFILES entries override the defaults
+
+    Returns:
+    - DetectionProfile
+    """
+    overrides = DETECTION_PROFILES.get(camera) if camera else None
+    if not overrides:
+        return DEFAULT_PROFILE
+    return checked_profile(DEFAULT_PROFILE._replace(**{k: v for k, v in overrides.items()
+                                                       if k in DetectionProfile._fields}), camera)
+
+
+@lru_cache(maxsize=64)
+def plan_detection(height, width, profile=DEFAULT_PROFILE, window=(24, 24)):
+    """
+    Choose the detection resolution and cascade parameters for a frame size.
+
+    The frame is shrunk until the smallest wanted face just fills the
+    detector's window, and further if it is still wider than max_width, so
+    large inputs cost about the same as small ones. The scale factor is
+    raised if needed so the image pyramid has at most max_levels levels.
+
+    Args:
+    - height, width: Input frame size
+    - profile: DetectionProfile
+    - window: Smallest face (width, height) the detector finds at its input resolution
+
+    Returns:
+    - DetectionPlan
+    """
+    window_w, window_h = window
+    scale = max(1.0, profile.min_face / float(min(window_w, window_h)))
+    if profile.max_width:
+        scale = max(scale, width / float(profile.max_width))
+    det_w, det_h = max(window_w, int(round(width / scale))), max(window_h, int(round(height / scale)))
+
+    min_size = (window_w, window_h)
+    max_side = max(min_size[0], int(min(det_w, det_h) * profile.max_face))
+    max_size = (max_side, max_side)
+    scale_factor = profile.scale_factor
+    if profile.max_levels:
+        scale_factor = max(scale_factor, (max_side / float(min(min_size))) ** (1.0 / profile.max_levels))
+    return DetectionPlan(scale, scale_factor, min_size, max_size, profile.min_neighbors, det_w, det_h)
+
+
+def _shrink(gray_frame, plan):
+    if plan.scale > 1.0:
+        return cv2.resize(gray_frame, (plan.width, plan.height), interpolation=cv2.INTER_AREA)
+    return gray_frame
+
+
+def _to_frame(boxes, scale):
+    # Detection-resolution boxes -> N x 4 int32 boxes in input frame coordinates
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.round(np.asarray(boxes, dtype=np.float64) * scale).astype(np.int32)
+
+
+# ---------- Backends ----------
+class CascadeDetector:
+    """
+    Haar or LBP cascade run with cv2.CascadeClassifier.detectMultiScale.
+
+    Args:
+    - path: Cascade XML file
+    """
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise IOError("Cascade file not found: %s" % path)
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise IOError("Could not load cascade: %s" % path)
+        self.window = tuple(self.cascade.getOriginalWindowSize())
+
+    def detect(self, gray_frame, profile=DEFAULT_PROFILE):
+        height, width = gray_frame.shape[:2]
+        plan = plan_detection(height, width, profile, self.window)
+        faces = self.cascade.detectMultiScale(_shrink(gray_frame, plan), scaleFactor=plan.scale_factor,
+                                              minNeighbors=plan.min_neighbors, minSize=plan.min_size,
+                                              maxSize=plan.max_size)
+        return _to_frame(faces, plan.scale)
+
+
+class DNNDetector:
+    """
+    OpenCV's res10 SSD face detector run with cv2.dnn.
+
+    The network always sees a 300x300 input, so its cost does not depend on
+    the frame size; the profile only filters boxes by size.
+
+    Args:
+    - model: .caffemodel weights
+    - config: deploy.prototxt
+    - confidence: Minimum detection score
+    """
+    INPUT_SIZE = (300, 300)
+    MEAN = (104.0, 177.0, 123.0)
+
+    def __init__(self, model, config, confidence=DETECTOR_DNN_CONFIDENCE):
+        for path in (model, config):
+            if not os.path.isfile(path):
+                raise IOError("DNN model file not found: %s" % path)
+        self.net = cv2.dnn.readNet(model, config)
+        self.confidence = confidence
+        # cv2.dnn.Net is not safe to call from several threads at once
+        self._lock = threading.Lock()
+
+    def detect(self, gray_frame, profile=DEFAULT_PROFILE):
+        height, width = gray_frame.shape[:2]
+        frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2BGR)
+        blob = cv2.dnn.blobFromImage(frame, 1.0, self.INPUT_SIZE, self.MEAN, swapRB=False, crop=False)
+        with self._lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()
+        faces = []
+        max_side = profile.max_face * min(height, width)
+        for score, x1, y1, x2, y2 in detections[0, 0, :, 2:7]:
+            if score < self.confidence:
+                continue
+            x1, y1 = max(0.0, x1 * width), max(0.0, y1 * height)
+            x2, y2 = min(float(width), x2 * width), min(float(height), y2 * height)
+            w, h = x2 - x1, y2 - y1
+            if min(w, h) >= profile.min_face and max(w, h) <= max_side:
+                faces.append((x1, y1, w, h))
+        return _to_frame(faces, 1.0)
+
+
+class YuNetDetector:
+    """
+    cv2.FaceDetectorYN (YuNet, an ONNX CNN) run at the planned detection resolution.
+
+    Args:
+    - model: .onnx model file
+    - confidence: Minimum detection score
+    """
+    # YuNet finds faces down to about 10 px at its input resolution
+    WINDOW = (10, 10)
+
+    def __init__(self, model, confidence=DETECTOR_DNN_CONFIDENCE):
+        if not os.path.isfile(model):
+            raise IOError("YuNet model file not found: %s" % model)
+        self.model = model
+        self.confidence = confidence
+        # FaceDetectorYN keeps per-call state, so each thread gets its own instance
+        self._local = threading.local()
+
+    def _detector(self, width, height):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(self.model, "", (width, height), self.confidence)
+            self._local.detector = detector
+        detector.setInputSize((width, height))
+        return detector
+
+    def detect(self, gray_frame, profile=DEFAULT_PROFILE):
+        height, width = gray_frame.shape[:2]
+        plan = plan_detection(height, width, profile, self.WINDOW)
+        frame = cv2.cvtColor(_shrink(gray_frame, plan), cv2.COLOR_GRAY2BGR)
+        _, faces = self._detector(frame.shape[1], frame.shape[0]).detect(frame)
+        if faces is None:
+            return _to_frame([], plan.scale)
+        # Same size limits the cascade applies through minSize/maxSize
+        boxes = [face[:4] for face in faces
+                 if min(face[2], face[3]) >= plan.min_size[0] and max(face[2], face[3]) <= plan.max_size[0]]
+        return _to_frame(boxes, plan.scale)
+
+
+def create_detector(backend):
+    """
+    Build a detector backend by name.
+
+    Args:
+    - backend: One of haar, haar_alt2, lbp, dnn, yunet
+
+    Returns:
+    - Detector with a detect(gray_frame, profile) method
+    """
+    if backend == 'haar':
+        return CascadeDetector(resource_path('face_cascade.xml'))
+    if backend == 'haar_alt2':
+        return CascadeDetector(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_alt2.xml'))
+    if backend == 'lbp':
+        return CascadeDetector(DETECTOR_LBP_MODEL)
+    if backend == 'dnn':
+        return DNNDetector(DETECTOR_DNN_MODEL, DETECTOR_DNN_CONFIG)
+    if backend == 'yunet':
+        return YuNetDetector(DETECTOR_YUNET_MODEL)
+    raise ValueError("Unknown detector backend: %s" % backend)
+
+
+BACKENDS = ('haar', 'haar_alt2', 'lbp', 'dnn', 'yunet')
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """
+    Get the deployment's detector (DETECTOR_BACKEND), created on first use.
+
+    Falls back to the bundled Haar cascade if the configured backend's model
+    files can't be loaded.
+
+    Returns:
+    - Detector with a detect(gray_frame, profile) method
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                try:
+                    _detector = create_detector(DETECTOR_BACKEND)
+                except (IOError, ValueError, cv2.error) as e:
+                    print("Detector backend %s unavailable (%s), using haar" % (DETECTOR_BACKEND, str(e)))
+                    _detector = create_detector('haar')
+    return _detector
+
+
+# ---------- Tiled detection ----------
+_tile_pool = None
+_tile_pool_lock = threading.Lock()
+
+
+def _pool():
+    global _tile_pool
+    if _tile_pool is None:
+        with _tile_pool_lock:
+            if _tile_pool is None:
+                _tile_pool = ThreadPoolExecutor(max_workers=max(1, DETECT_TILE_WORKERS),
+                                                thread_name_prefix='detect-tile')
+    return _tile_pool
+
+
+def _forget_pool():
+    # A forked worker (gunicorn preload) inherits the pool but not its threads
+    global _tile_pool
+    _tile_pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pool)
+
+
+def tile_origins(length, tile, overlap):
+    """
+    Start offsets of overlapping tiles covering [0, length); the last tile ends at the edge.
+    """
+    if overlap >= tile:
+        raise ValueError("Tile overlap %d must be smaller than the tile size %d" % (overlap, tile))
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile, tile - overlap))
+    origins.append(length - tile)
+    return origins
+
+
+def non_max_suppression(boxes, threshold=0.3):
+    """
+    Merge duplicate boxes, e.g. the same face found in two overlapping tiles.
+
+    Boxes are kept largest first; a box is dropped if its overlap with a kept
+    box covers more than threshold of the smaller of the two, which also
+    removes a face cut by a tile edge that was found whole elsewhere.
+
+    Args:
+    - boxes: N x 4 array of (x, y, w, h) boxes
+    - threshold: Overlap (relative to the smaller box) above which boxes are duplicates
+
+    Returns:
+    - M x 4 int32 array of kept boxes
+    """
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+    if len(boxes) < 2:
+        return boxes
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2].astype(np.int64) * boxes[:, 3]
+    order = np.argsort(-areas, kind='stable')
+    keep = []
+    while len(order):
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        overlap = (w * h) / np.minimum(areas[i], areas[rest]).astype(np.float64)
+        order = rest[overlap <= threshold]
+    return boxes[sorted(keep)]
+
+
+def detect_tiled(detector, gray_frame, profile):
+    """
+    Detect faces in overlapping full-resolution tiles on the tile thread pool.
+
+    Tiles only look for faces up to the overlap size, which always fit whole
+    in some tile; larger faces come from one extra pass over the downscaled
+    frame. Results are merged with non_max_suppression. OpenCV releases the
+    GIL while detecting, so tiles run on all cores.
+
+    Args:
+    - detector: Backend with a detect(gray_frame, profile) method
+    - gray_frame: Grayscale frame
+    - profile: DetectionProfile with tile > 0
+
+    Returns:
+    - N x 4 int32 array of face boxes in frame coordinates
+    """
+    height, width = gray_frame.shape[:2]
+    tile, overlap = profile.tile, min(profile.tile_overlap, profile.tile // 2)
+    tile_profile = profile._replace(max_width=0, max_face=overlap / float(tile), tile=0)
+    whole_profile = profile._replace(min_face=max(profile.min_face, overlap * 3 // 4), tile=0)
+
+    pool = _pool()
+    jobs = [(0, 0, pool.submit(detector.detect, gray_frame, whole_profile))]
+    for y in tile_origins(height, tile, overlap):
+        for x in tile_origins(width, tile, overlap):
+            view = gray_frame[y:y + tile, x:x + tile]
+            jobs.append((x, y, pool.submit(detector.detect, view, tile_profile)))
+
+    boxes = []
+    for x, y, job in jobs:
+        found = job.result()
+        if len(found):
+            boxes.append(found + np.array([x, y, 0, 0], dtype=np.int32))
+    if not boxes:
+        return np.empty((0, 4), dtype=np.int32)
+    return non_max_suppression(np.vstack(boxes))
+
+
+def detect(gray_frame, profile=DEFAULT_PROFILE):
+    """
+    Detect faces with the deployment's detector, tiling frames larger than profile.tile.
+
+    Args:
+    - gray_frame: Grayscale frame
+    - profile: DetectionProfile
+
+    Returns:
+    - N x 4 int32 array of face boxes in frame coordinates
+    """
+    detector = get_detector()
+    height, width = gray_frame.shape[:2]
+    if profile.tile and (width > profile.tile or height > profile.tile):
+        return detect_tiled(detector, gray_frame, profile)
+    return detector.detect(gray_frame, profile)
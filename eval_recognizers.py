@@ -0,0 +1,256 @@
+"""
+Accuracy and latency regression harness for the recognizer backends.
+
+The face samples of the packed gallery are split with stratified k-fold (or
+leave-one-out) cross-validation; folds run in a process pool. In every fold
+one identity is left out of training entirely and its samples are used as
+impostor queries, while the held-out samples of the other identities are the
+genuine queries. Per backend this gives:
+
+- accuracy:   genuine queries whose nearest label is correct (top-1)
+- far:        impostor queries accepted, i.e. with confidence below
+              RECOGNITION_THRESHOLD (false-accept rate)
+- ms_per_query: recognition time per face
+
+A backend is "name" or "name:dtype" (gallery quantization of the NumPy
+matchers), e.g. lbph, numpy, numpy:float32, ann:uint8.
+
+The run fails (exit status 1) when a backend's accuracy drops, or its FAR
+rises, by more than the tolerance: against --baseline if given, otherwise
+against the first backend of the run (OpenCV LBPH by default).
+
+Usage: python eval_recognizers.py [--folds 5 | --loo] [--backends lbph,numpy:float32,numpy,ann]
+                                  [--baseline eval.json] [--save results.json]
+                                  [--accuracy-tolerance 0.01] [--far-tolerance 0.01]
+                                  [--latency-tolerance 0.5] [--samples face_samples]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from facerec import (RECOGNITION_THRESHOLD, STAGING_DIR, gallery_fingerprint, make_recognizer, matcher_class,
+                     predict_faces)
+from gallery import packed_gallery
+
+DEFAULT_BACKENDS = "lbph,numpy:float32,numpy,ann"
+SEED = 0
+
+# Samples of the gallery, set once per pool worker
+_faces = None
+_labels = None
+
+
+def _init_worker(faces, labels):
+    global _faces, _labels
+    _faces, _labels = faces, labels
+
+
+def assign_folds(labels, folds, seed=SEED):
+    """
+    Stratified fold number of every sample.
+
+    Args:
+    - labels: Label per sample
+    - folds: Number of folds, or 0 for leave-one-out
+
+    Returns:
+    - Tuple of (fold per sample, number of folds)
+    """
+    if not folds:
+        return np.arange(len(labels)), len(labels)
+    rng = np.random.default_rng(seed)
+    assigned = np.empty(len(labels), dtype=np.int64)
+    for label in np.unique(labels):
+        indexes = np.flatnonzero(labels == label)
+        rng.shuffle(indexes)
+        assigned[indexes] = np.arange(len(indexes)) % folds
+    return assigned, folds
+
+
+def build_engine(model, backend):
+    name, _, dtype = backend.partition(":")
+    if not dtype:
+        return make_recognizer(model, name)
+    engine = matcher_class(name)
+    if engine is None:
+        raise ValueError("%s has no gallery dtype" % name)
+    return engine.from_model(model, dtype)
+
+
+def evaluate_fold(fold, assigned, impostor, backends):
+    """
+    Train on one fold's training split and score every backend on its test split.
+
+    Returns:
+    - Dictionary of backend to raw counts and timings
+    """
+    test = assigned == fold
+    train = ~test & (_labels != impostor)
+    genuine = test & (_labels != impostor)
+    impostors = _labels == impostor
+
+    model = cv2.face.LBPHFaceRecognizer_create()
+    model.train(_faces[train], _labels[train])
+    genuine_faces, genuine_labels = list(_faces[genuine]), _labels[genuine]
+    impostor_faces = list(_faces[impostors])
+
+    results = {}
+    for backend in backends:
+        engine = build_engine(model, backend)
+        start = time.perf_counter()
+        predictions = predict_faces(engine, genuine_faces)
+        rejections = predict_faces(engine, impostor_faces)
+        elapsed = time.perf_counter() - start
+        results[backend] = {
+            "genuine": len(genuine_faces),
+            "correct": sum(1 for (label, _), truth in zip(predictions, genuine_labels) if label == truth),
+            "genuine_accepted": sum(1 for (label, confidence), truth in zip(predictions, genuine_labels)
+                                    if label == truth and confidence < RECOGNITION_THRESHOLD),
+            "impostors": len(impostor_faces),
+            "false_accepts": sum(1 for _, confidence in rejections if confidence < RECOGNITION_THRESHOLD),
+            "seconds": elapsed,
+        }
+    return results
+
+
+def evaluate(faces, labels, backends, folds, workers):
+    """
+    Cross-validate every backend.
+
+    Returns:
+    - Dictionary of backend to accuracy, far, genuine_accept_rate and ms_per_query
+    """
+    assigned, folds = assign_folds(labels, folds)
+    identities = np.unique(labels)
+    if len(identities) < 2:
+        raise SystemExit("Need at least two identities to evaluate")
+    jobs = []
+    for fold in range(folds):
+        # Rotate the left-out identity; it must not be the only owner of the fold's test samples
+        impostor = identities[fold % len(identities)]
+        if not np.any((assigned == fold) & (labels != impostor)):
+            impostor = identities[(fold + 1) % len(identities)]
+        jobs.append((fold, assigned, impostor, backends))
+
+    totals = {backend: {"genuine": 0, "correct": 0, "genuine_accepted": 0, "impostors": 0, "false_accepts": 0,
+                        "seconds": 0.0} for backend in backends}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(faces, labels)) as pool:
+        for fold_results in pool.map(evaluate_fold, *zip(*jobs)):
+            for backend, counts in fold_results.items():
+                for key, value in counts.items():
+                    totals[backend][key] += value
+
+    summary = {}
+    for backend, t in totals.items():
+        queries = t["genuine"] + t["impostors"]
+        summary[backend] = {
+            "accuracy": round(t["correct"] / float(t["genuine"]), 4) if t["genuine"] else None,
+            "far": round(t["false_accepts"] / float(t["impostors"]), 4) if t["impostors"] else None,
+            "genuine_accept_rate": round(t["genuine_accepted"] / float(t["genuine"]), 4) if t["genuine"] else None,
+            "ms_per_query": round(t["seconds"] * 1000 / queries, 4) if queries else None,
+            "queries": queries,
+        }
+    return summary
+
+
+def _percent(value):
+    # Rates are None when a run had no queries of that kind
+    return "%8.2f%%" % (value * 100) if value is not None else "%9s" % "-"
+
+
+def regressions(summary, reference, accuracy_tolerance, far_tolerance, latency_tolerance):
+    """
+    Compare a run with reference figures.
+
+    Args:
+    - summary: Backend results of this run
+    - reference: Dictionary of backend to the figures it must not fall behind
+    - latency_tolerance: Allowed relative slowdown, or None to ignore latency
+
+    Returns:
+    - List of human-readable failures
+    """
+    failures = []
+    for backend, result in summary.items():
+        ref = reference.get(backend)
+        if ref is None:
+            continue
+        if result["accuracy"] is not None and ref.get("accuracy") is not None \
+                and result["accuracy"] < ref["accuracy"] - accuracy_tolerance:
+            failures.append("%s: accuracy %.4f < %.4f - %.4f" % (backend, result["accuracy"], ref["accuracy"],
+                                                                accuracy_tolerance))
+        if result["far"] is not None and ref.get("far") is not None and result["far"] > ref["far"] + far_tolerance:
+            failures.append("%s: FAR %.4f > %.4f + %.4f" % (backend, result["far"], ref["far"], far_tolerance))
+        if latency_tolerance is not None and ref.get("ms_per_query") and result["ms_per_query"] is not None \
+                and result["ms_per_query"] > ref["ms_per_query"] * (1 + latency_tolerance):
+            failures.append("%s: %.4f ms/query > %.4f ms + %.0f%%" % (
+                backend, result["ms_per_query"], ref["ms_per_query"], latency_tolerance * 100))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    split = parser.add_mutually_exclusive_group()
+    split.add_argument("--folds", type=int, default=5, help="Number of stratified folds")
+    split.add_argument("--loo", action="store_true", help="Leave-one-out instead of k-fold")
+    parser.add_argument("--backends", default=DEFAULT_BACKENDS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--baseline", help="Earlier --save output to compare with (default: the first backend)")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.01, help="Allowed accuracy drop (absolute)")
+    parser.add_argument("--far-tolerance", type=float, default=0.01, help="Allowed FAR increase (absolute)")
+    parser.add_argument("--latency-tolerance", type=float,
+                        help="Allowed relative slowdown against --baseline, e.g. 0.5 (default: not checked)")
+    parser.add_argument("--samples", default="face_samples", help="Face samples directory the pack mirrors")
+    args = parser.parse_args()
+
+    # Same as train_model: rebuild the pack first if face_samples changed since it was written
+    packed_gallery.sync(args.samples, gallery_fingerprint(args.samples), skip=(STAGING_DIR,))
+    faces, labels, names = packed_gallery.load(skip=(STAGING_DIR,))
+    if len(faces) == 0:
+        raise SystemExit("No face samples in %s; register a subject first" % args.samples)
+    faces, labels = np.asarray(faces), np.asarray(labels, dtype=np.int32)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    folds = 0 if args.loo else args.folds
+    print("%d samples, %d identities, %s, threshold %d" % (
+        len(faces), len(names), "leave-one-out" if args.loo else "%d-fold" % folds, RECOGNITION_THRESHOLD))
+
+    summary = evaluate(faces, labels, backends, folds, args.workers)
+    print("%-16s %9s %9s %9s %12s" % ("backend", "accuracy", "FAR", "accept", "ms/query"))
+    for backend, r in summary.items():
+        print("%-16s %s %s %s %12s" % (
+            backend, _percent(r["accuracy"]), _percent(r["far"]), _percent(r["genuine_accept_rate"]),
+            "%.4f" % r["ms_per_query"] if r["ms_per_query"] is not None else "-"))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"samples": len(faces), "folds": folds, "threshold": RECOGNITION_THRESHOLD,
+                       "results": summary}, f, indent=2)
+        print("Results written to %s" % args.save)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get("samples"), baseline.get("folds")) != (len(faces), folds):
+            raise SystemExit("Baseline has %s samples in %s folds; rerun it on the same gallery and split" % (
+                baseline.get("samples"), baseline.get("folds")))
+        reference = baseline["results"]
+        latency_tolerance = args.latency_tolerance
+    else:
+        # Latency differs between backends by design, so it is only checked against a baseline
+        reference = {backend: summary[backends[0]] for backend in backends[1:]}
+        latency_tolerance = None
+    failures = regressions(summary, reference, args.accuracy_tolerance, args.far_tolerance, latency_tolerance)
+    for failure in failures:
+        print("REGRESSION %s" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,17 @@ import cv2
 import numpy as np
 import os
 import sys
+import json
+import copy
+import hashlib
+import time
+from collections import namedtuple
+from datetime import datetime
+from config import GALLERY_DTYPE, RECOGNIZER_BACKEND
+import detectors
+import metrics
+from detectors import DEFAULT_PROFILE, DetectionProfile, detection_profile, plan_detection
+from gallery import packed_gallery
 
 def resource_path(relative_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -13,63 +24,752 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-size = 2
-haar_cascade = cv2.CascadeClassifier(resource_path('face_cascade.xml'))
+# LBPH chi-square distance below which a face counts as recognized
+RECOGNITION_THRESHOLD = 95
 
-def train_model():
+# Trained models are cached on disk, keyed by a fingerprint of face_samples/
+MODEL_DIR = 'model_cache'
+MODEL_FORMAT_VERSION = 3
+# Registration stages new samples here before renaming the folder
+STAGING_DIR = 'temp_criminal'
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.pgm']
+
+class SegmentedModel:
+    """
+    LBPH recognizer made of independently trained segments.
+
+    predict() returns the nearest training sample over all segments, which is
+    the same answer one recognizer trained on all the samples would give. New
+    samples go into a new segment (see add_samples), so segments that request
+    threads may be predicting with are never modified.
+    """
+    def __init__(self, segments):
+        self.segments = list(segments)
+
+    def predict(self, face):
+        best_label, best_confidence = -1, float('inf')
+        for segment in self.segments:
+            label, confidence = segment.predict(face)
+            if label != -1 and confidence < best_confidence:
+                best_label, best_confidence = label, confidence
+        return best_label, best_confidence
+
+    def getHistograms(self):
+        return [h for segment in self.segments for h in segment.getHistograms()]
+
+    def getLabels(self):
+        return np.concatenate([np.asarray(segment.getLabels()).reshape(-1) for segment in self.segments])
+
+# ---------- Vectorized LBP histogram matcher ----------
+# Same parameters as cv2.face.LBPHFaceRecognizer_create() defaults
+LBP_RADIUS, LBP_NEIGHBORS, LBP_GRID_X, LBP_GRID_Y = 1, 8, 8, 8
+# Upper bound on the temporary queries x gallery x bins block, in bytes
+MATCH_CHUNK_BYTES = 16 * 1024 * 1024
+
+def lbp_histograms(faces, radius=LBP_RADIUS, neighbors=LBP_NEIGHBORS, grid_x=LBP_GRID_X, grid_y=LBP_GRID_Y):
+    """
+    Compute LBPH spatial histograms for a batch of faces.
+
+    This follows OpenCV's LBPHFaceRecognizer (circular LBP with bilinear
+    interpolation, per-cell histograms normalised by cell area), so the rows
+    can be compared with the histograms stored in a trained model.
+
+    Args:
+    - faces: Array of grayscale faces of equal size, shape N x H x W
+    - radius, neighbors, grid_x, grid_y: LBPH parameters
+
+    Returns:
+    - float32 array of shape N x (grid_x * grid_y * 2**neighbors)
+    """
+    src = np.asarray(faces, dtype=np.float32)
+    if src.ndim == 2:
+        src = src[np.newaxis]
+    count, rows, cols = src.shape
+    center = src[:, radius:rows - radius, radius:cols - radius]
+    codes = np.zeros(center.shape, dtype=np.int32)
+    eps = np.finfo(np.float32).eps
+
+    def shifted(dy, dx):
+        return src[:, radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+
+    for n in range(neighbors):
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty, tx = np.float32(y - fy), np.float32(x - fx)
+        w1, w2 = (1 - tx) * (1 - ty), tx * (1 - ty)
+        w3, w4 = (1 - tx) * ty, tx * ty
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        codes += ((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n
+
+    bins = 2 ** neighbors
+    cell_h, cell_w = codes.shape[1] // grid_y, codes.shape[2] // grid_x
+    cells = codes[:, :grid_y * cell_h, :grid_x * cell_w]
+    cells = cells.reshape(count, grid_y, cell_h, grid_x, cell_w).transpose(0, 1, 3, 2, 4)
+    cells = cells.reshape(count, grid_y * grid_x, cell_h * cell_w)
+    offsets = (np.arange(count * grid_y * grid_x, dtype=np.int64) * bins).reshape(count, -1, 1)
+    hist = np.bincount((cells + offsets).ravel(), minlength=count * grid_y * grid_x * bins)
+    hist = hist.reshape(count, grid_y * grid_x * bins).astype(np.float32)
+    return hist / np.float32(cell_h * cell_w)
+
+def chi_square_distances(queries, gallery_t, gallery_sums, gallery_scales=None):
+    """
+    Chi-square distance (OpenCV HISTCMP_CHISQR_ALT) of every query to every gallery sample.
+
+    Uses 2 * sum((a-b)^2 / (a+b)) = 2 * (sum(a) + sum(b) - 4 * sum(a*b / (a+b))),
+    where the last sum only runs over the bins in which the query is non-zero.
+    LBP histograms are sparse, so only those rows of the bins x samples
+    gallery matrix are read.
+
+    Args:
+    - queries: Q x D float32 histograms
+    - gallery_t: D x G gallery histograms (one column per sample)
+    - gallery_sums: Per-sample histogram sums, length G
+    - gallery_scales: Per-sample scales if gallery_t holds quantized counts
+
+    Returns:
+    - Q x G float32 distance matrix
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    samples = gallery_t.shape[1]
+    distances = np.empty((len(queries), samples), dtype=np.float32)
+    for q, query in enumerate(queries):
+        nonzero = np.flatnonzero(query)
+        a = query[nonzero][:, np.newaxis]
+        cross = np.empty(samples, dtype=np.float64)
+        chunk = max(1, MATCH_CHUNK_BYTES // max(1, 4 * len(nonzero)))
+        for start in range(0, samples, chunk):
+            b = np.asarray(gallery_t[nonzero, start:start + chunk], dtype=np.float32)
+            if gallery_scales is not None:
+                b *= gallery_scales[start:start + chunk]
+            den = b + a
+            np.multiply(b, a, out=b)
+            np.divide(b, den, out=b)
+            cross[start:start + b.shape[1]] = b.sum(axis=0, dtype=np.float64)
+        distances[q] = np.maximum(2 * (query.sum(dtype=np.float64) + gallery_sums - 4 * cross), 0)
+    return distances
+
+def quantize_histograms(histograms, dtype):
+    """
+    Store histograms as integer counts with one float scale per sample.
+
+    LBPH cells hold pixel counts divided by the cell area, so the smallest
+    non-zero bin is one count and the histogram is stored exactly whenever
+    the largest count fits in dtype (always the case for uint8 and 92x112
+    faces). Otherwise the sample is scaled so its largest bin maps to the
+    dtype maximum.
+
+    Args:
+    - histograms: G x D float histograms
+    - dtype: 'uint8', 'uint16' or 'float32' (no quantization)
+
+    Returns:
+    - Tuple (values, scales): G x D array of dtype and float32 scales of length G
+    """
+    histograms = np.asarray(histograms, dtype=np.float32)
+    if np.dtype(dtype) == np.float32:
+        return histograms, np.ones(len(histograms), dtype=np.float32)
+    top = np.iinfo(dtype).max
+    unit = np.where(histograms > 0, histograms, np.inf).min(axis=1)
+    unit[~np.isfinite(unit)] = 1.0
+    peak = histograms.max(axis=1)
+    counts = histograms / unit[:, np.newaxis]
+    exact = (peak / unit <= top) & (np.abs(counts - np.rint(counts)).max(axis=1) < 1e-3)
+    scales = np.where(exact, unit, np.maximum(peak, 1e-12) / top).astype(np.float32)
+    values = np.clip(np.rint(histograms / scales[:, np.newaxis]), 0, top).astype(dtype)
+    return values, scales
+
+class HistogramMatcher:
+    """
+    LBPH matcher that keeps all gallery histograms in one contiguous matrix.
+
+    The matrix is stored bins x samples so the bins a query uses can be
+    gathered as whole rows, and holds quantized counts (GALLERY_DTYPE) with
+    a scale per sample instead of float32 histograms. predict_batch() scores
+    every face of a frame against the whole gallery with NumPy; predict() has
+    the same signature as LBPHFaceRecognizer.predict so the matcher can stand
+    in for the model.
+
+    Identities added after training (see extended) are kept as small segment
+    matchers searched alongside the base gallery, so a registration costs
+    time and memory in proportion to its own samples; a full rebuild
+    (ModelRegistry.compact) merges them.
+    """
+    # Samples quantized at a time, to bound the float32 temporaries
+    BUILD_CHUNK = 1024
+
+    def __init__(self, histograms, labels, dtype=None):
+        # histograms: one row per sample (array or list of rows, as returned by the LBPH model)
+        dtype = np.dtype(dtype or GALLERY_DTYPE)
+        samples = len(histograms)
+        bins = LBP_GRID_X * LBP_GRID_Y * 2 ** LBP_NEIGHBORS
+        if samples:
+            bins = np.asarray(histograms[0]).size
+        histograms_t = np.empty((bins, samples), dtype=dtype)
+        scales = np.empty(samples, dtype=np.float32)
+        for start in range(0, samples, self.BUILD_CHUNK):
+            block = np.vstack([np.asarray(h, dtype=np.float32).reshape(1, -1)
+                               for h in histograms[start:start + self.BUILD_CHUNK]])
+            values, block_scales = quantize_histograms(block, dtype)
+            histograms_t[:, start:start + len(block)] = values.T
+            scales[start:start + len(block)] = block_scales
+        self._set_gallery(histograms_t, scales, labels)
+
+    def _set_gallery(self, histograms_t, scales, labels, sums=None):
+        self.histograms_t = histograms_t
+        self.scales = scales
+        self.labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        self.sums = sums if sums is not None else histograms_t.sum(axis=0, dtype=np.float64) * scales
+        # Matchers of identities added since the base gallery was built
+        self.segments = []
+        # shared_gallery part the base arrays are mapped from, if any
+        self.shared_part = None
+
+    @classmethod
+    def from_arrays(cls, histograms_t, scales, labels, sums=None):
+        """
+        Build a matcher around existing gallery arrays without copying them.
+
+        Used to serve a gallery memory-mapped from shared_gallery.
+
+        Args:
+        - histograms_t: D x G quantized histograms
+        - scales: Per-sample scales, length G
+        - labels: Per-sample labels, length G
+        - sums: Per-sample histogram sums, computed if not given
+        """
+        matcher = cls.__new__(cls)
+        matcher._set_gallery(histograms_t, scales, labels, sums)
+        return matcher
+
+    @classmethod
+    def from_model(cls, model, dtype=None):
+        """
+        Build a matcher from the histograms stored in a trained LBPH model.
+        """
+        return cls(model.getHistograms(), np.asarray(model.getLabels()), dtype)
+
+    def extended(self, other):
+        """
+        Return a new matcher that also searches another matcher's samples.
+
+        The base gallery is shared with this matcher, not copied; other
+        becomes one more segment.
+        """
+        matcher = copy.copy(self)
+        matcher.segments = self.segments + [self._segment(other)]
+        return matcher
+
+    def _segment(self, other):
+        # Segment to search alongside this gallery; subclasses index it their way
+        return other
+
+    def sample_count(self):
+        return len(self.labels) + sum(len(segment.labels) for segment in self.segments)
+
+    def nbytes(self):
+        """
+        Memory held by the gallery arrays, segments included, in bytes.
+        """
+        return (self.histograms_t.nbytes + self.scales.nbytes + self.labels.nbytes + self.sums.nbytes
+                + sum(segment.nbytes() for segment in self.segments))
+
+    def predict_batch(self, faces):
+        """
+        Predict labels for several faces at once.
+
+        Args:
+        - faces: List of 92x112 grayscale faces
+
+        Returns:
+        - List of (label, confidence) tuples, as LBPHFaceRecognizer.predict returns
+        """
+        if len(faces) == 0:
+            return []
+        queries = lbp_histograms(np.asarray(faces))
+        labels, distances = self._nearest(queries)
+        for segment in self.segments:
+            segment_labels, segment_distances = segment._nearest(queries)
+            closer = segment_distances < distances
+            labels[closer], distances[closer] = segment_labels[closer], segment_distances[closer]
+        return [(int(label), float(distance)) for label, distance in zip(labels, distances)]
+
+    def _nearest(self, queries):
+        # Best label and distance per query in the base gallery (segments not included)
+        if len(self.labels) == 0:
+            return np.full(len(queries), -1, dtype=np.int32), np.full(len(queries), np.inf, dtype=np.float32)
+        distances = chi_square_distances(queries, self.histograms_t, self.sums, self.scales)
+        best = distances.argmin(axis=1)
+        return self.labels[best], distances[np.arange(len(queries)), best]
+
+    def predict(self, face):
+        return self.predict_batch([face])[0]
+
+    def compare_with_opencv(self, model, faces, repeat=3):
+        """
+        Time predict_batch against a loop of LBPHFaceRecognizer.predict calls.
+
+        Args:
+        - model: The LBPH model this matcher was built from
+        - faces: List of 92x112 grayscale faces to predict
+        - repeat: Number of timed runs; the best one is reported
+
+        Returns:
+        - Dictionary with opencv_ms, numpy_ms, speedup and the share of faces
+          on which both return the same label
+        """
+        def best_time(fn):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = fn()
+                best = min(best, time.perf_counter() - start)
+            return best * 1000, result
+
+        opencv_ms, expected = best_time(lambda: [model.predict(face) for face in faces])
+        numpy_ms, actual = best_time(lambda: self.predict_batch(faces))
+        agree = sum(1 for e, a in zip(expected, actual) if e[0] == a[0])
+        return {
+            "faces": len(faces),
+            "gallery": self.sample_count(),
+            "opencv_ms": opencv_ms,
+            "numpy_ms": numpy_ms,
+            "speedup": opencv_ms / numpy_ms if numpy_ms > 0 else float('inf'),
+            "agreement": agree / len(faces) if faces else 1.0,
+        }
+
+def make_recognizer(model, backend=None):
+    """
+    Wrap a trained LBPH model in the recognition engine chosen for this deployment.
+
+    Args:
+    - model: Trained face recognition model (LBPH or SegmentedModel)
+    - backend: 'lbph' (OpenCV predict per face), 'numpy' (HistogramMatcher) or
+      'ann' (ann_index.ANNMatcher); defaults to RECOGNIZER_BACKEND from config
+
+    Returns:
+    - Object with predict() (and predict_batch() for batched engines)
+    """
+    engine = matcher_class(backend)
+    if engine is None:
+        return model
+    return engine.from_model(model)
+
+def matcher_class(backend=None):
+    """
+    Get the matcher class of a recognizer backend.
+
+    Args:
+    - backend: Backend name; defaults to RECOGNIZER_BACKEND from config
+
+    Returns:
+    - HistogramMatcher or a subclass, or None for the plain OpenCV 'lbph' backend
+    """
+    backend = backend or RECOGNIZER_BACKEND
+    if backend == 'numpy':
+        return HistogramMatcher
+    if backend == 'ann':
+        from ann_index import ANNMatcher
+        return ANNMatcher
+    if backend != 'lbph':
+        print("Unknown recognizer backend %r, using lbph" % backend)
+    return None
+
+def train_segment(images, labels):
+    """
+    Train a stand-alone LBPH segment on new samples with LBPHFaceRecognizer.update().
+
+    Args:
+    - images: List of grayscale face images
+    - labels: List of integer labels, one per image
+
+    Returns:
+    - Trained LBPH model holding only these samples
+    """
+    segment = cv2.face.LBPHFaceRecognizer_create()
+    segment.update(np.array(images), np.array(labels))
+    return segment
+
+def add_segment(model, segment):
+    """
+    Return a recognizer that also knows the samples of a new segment.
+
+    The given model is left untouched for threads still using it.
+
+    Args:
+    - model: Current recognizer (LBPH, SegmentedModel or HistogramMatcher)
+    - segment: LBPH model from train_segment()
+
+    Returns:
+    - New recognizer of the same kind
+    """
+    if isinstance(model, HistogramMatcher):
+        return model.extended(HistogramMatcher.from_model(segment, model.histograms_t.dtype))
+    if isinstance(model, SegmentedModel):
+        return SegmentedModel(model.segments + [segment])
+    return SegmentedModel([model, segment])
+
+def add_samples(model, images, labels):
+    """
+    Add training samples to a model without retraining it.
+
+    The cost is proportional to the new samples only.
+
+    Args:
+    - model: Current recognizer
+    - images: List of grayscale face images
+    - labels: List of integer labels, one per image
+
+    Returns:
+    - New recognizer including the samples
+    """
+    return add_segment(model, train_segment(images, labels))
+
+def gallery_fingerprint(fn_dir='face_samples'):
+    """
+    Compute a fingerprint of the face samples tree.
+
+    Only file names, sizes and modification times are hashed, so this is
+    cheap compared to decoding the images.
+
+    Args:
+    - fn_dir: Directory containing one sub-directory per subject
+
+    Returns:
+    - Hex digest identifying the current contents of the tree
+    """
+    digest = hashlib.sha1(str(MODEL_FORMAT_VERSION).encode())
+    if not os.path.isdir(fn_dir):
+        return digest.hexdigest()
+    for subdir in sorted(os.listdir(fn_dir)):
+        subject_path = os.path.join(fn_dir, subdir)
+        if subdir == STAGING_DIR or not os.path.isdir(subject_path):
+            continue
+        for filename in sorted(os.listdir(subject_path)):
+            st = os.stat(os.path.join(subject_path, filename))
+            digest.update(("%s/%s:%d:%d\n" % (subdir, filename, st.st_size, st.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+def _meta_path(fingerprint):
+    return os.path.join(MODEL_DIR, 'lbph-v%d-%s.json' % (MODEL_FORMAT_VERSION, fingerprint[:16]))
+
+def _write_segment(segment, index=0):
+    # cv2 picks the storage format from the extension, so keep it last
+    filename = 'seg-%s-%d-%d.yml' % (datetime.now().strftime('%Y%m%d%H%M%S%f'), os.getpid(), index)
+    tmp_path = os.path.join(MODEL_DIR, filename[:-4] + '.tmp%d.yml' % os.getpid())
+    segment.write(tmp_path)
+    os.replace(tmp_path, os.path.join(MODEL_DIR, filename))
+    return filename
+
+def _write_meta(fingerprint, segment_files, names, trained_at):
+    meta_path = _meta_path(fingerprint)
+    tmp_path = meta_path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'format': MODEL_FORMAT_VERSION,
+            'fingerprint': fingerprint,
+            'trained_at': trained_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'segments': segment_files,
+            'names': {str(k): v for k, v in names.items()},
+        }, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+    keep = set(segment_files) | {os.path.basename(meta_path)}
+    for filename in os.listdir(MODEL_DIR):
+        if filename.startswith(('lbph-', 'seg-')) and filename not in keep and '.tmp' not in filename:
+            try:
+                os.remove(os.path.join(MODEL_DIR, filename))
+            except OSError:
+                pass
+
+def save_model(model, names, fingerprint, trained_at=None):
+    """
+    Save a trained model and its label->name map as a versioned artifact.
+
+    Each model segment is stored in its own file and the metadata file lists
+    them. Files are written to a temporary name first and renamed into place,
+    so a concurrent reader never sees a half-written artifact. Files not used
+    by this artifact are removed.
+
+    Args:
+    - model: Trained face recognition model (LBPH or SegmentedModel)
+    - names: Dictionary containing subject names
+    - fingerprint: Fingerprint of the face samples the model was trained on
+    - trained_at: Time of the last full training, defaults to now
+    """
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    segments = model.segments if isinstance(model, SegmentedModel) else [model]
+    segment_files = [_write_segment(segment, i) for i, segment in enumerate(segments)]
+    _write_meta(fingerprint, segment_files, names, trained_at)
+
+def save_segment(segment, names, fingerprint, base_fingerprint, trained_at=None):
+    """
+    Save an artifact that extends an already saved one by a single segment.
+
+    Only the new segment is written, so saving after add_samples() costs as
+    much as the new samples rather than the whole gallery.
+
+    Args:
+    - segment: LBPH model from train_segment()
+    - names: Dictionary containing subject names, including the new ones
+    - fingerprint: Fingerprint of the face samples including the new samples
+    - base_fingerprint: Fingerprint of the artifact being extended
+    - trained_at: Time of the last full training
+
+    Returns:
+    - True if saved, False if there is no saved artifact to extend
+    """
+    base = read_model_meta(base_fingerprint)
+    if base is None:
+        return False
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    _write_meta(fingerprint, base['segments'] + [_write_segment(segment)], names, trained_at)
+    return True
+
+def read_model_meta(fingerprint):
+    """
+    Read the metadata saved next to a model artifact.
+
+    Args:
+    - fingerprint: Fingerprint of the face samples tree
+
+    Returns:
+    - Dictionary with format, fingerprint, trained_at, segments and names, or None
+    """
+    meta_path = _meta_path(fingerprint)
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except Exception as e:
+        print("Ignoring unreadable model metadata: %s" % str(e))
+        return None
+    if meta.get('format') != MODEL_FORMAT_VERSION or meta.get('fingerprint') != fingerprint:
+        return None
+    return meta
+
+def load_saved_model(fingerprint):
+    """
+    Load the artifact saved for a fingerprint.
+
+    Args:
+    - fingerprint: Fingerprint of the face samples tree
+
+    Returns:
+    - Tuple containing model and names, or None if no matching artifact exists
+    """
+    meta = read_model_meta(fingerprint)
+    if meta is None:
+        return None
+    segments = []
+    try:
+        for filename in meta['segments']:
+            segment = cv2.face.LBPHFaceRecognizer_create()
+            segment.read(os.path.join(MODEL_DIR, filename))
+            segments.append(segment)
+    except Exception as e:
+        print("Ignoring unreadable model artifact: %s" % str(e))
+        return None
+    names = {int(k): v for k, v in meta['names'].items()}
+    if len(segments) == 1:
+        return segments[0], names
+    return SegmentedModel(segments), names
+
+def load_model(fn_dir='face_samples'):
+    """
+    Get a model for the current face samples, retraining only when needed.
+
+    The artifact saved on disk is used when it matches the fingerprint of
+    the face samples tree; otherwise the model is retrained and saved for
+    next time. The live copy is held by model_registry, not cached here, so
+    the LBPH histograms can be freed once a compact engine is built.
+
+    Args:
+    - fn_dir: Directory containing one sub-directory per subject
+
+    Returns:
+    - Tuple containing trained model and corresponding names
+    """
+    fingerprint = gallery_fingerprint(fn_dir)
+    loaded = load_saved_model(fingerprint)
+    if loaded is None:
+        loaded = train_model(fn_dir)
+        try:
+            save_model(loaded[0], loaded[1], fingerprint)
+        except Exception as e:
+            print("Could not save model artifact: %s" % str(e))
+    return loaded
+
+def load_subject_images(subject_path):
+    """
+    Read the grayscale training samples of one subject.
+
+    Args:
+    - subject_path: Directory holding the subject's face images
+
+    Returns:
+    - List of grayscale images
+    """
+    images = []
+    for filename in os.listdir(subject_path):
+        name, extension = os.path.splitext(filename)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            print("Skipping " + filename + ", wrong file type")
+            continue
+        images.append(cv2.imread(os.path.join(subject_path, filename), 0))
+    return images
+
+@metrics.timed('train_model')
+def train_model(fn_dir='face_samples'):
     """
     Train a face recognition model using LBPHFaceRecognizer.
+
+    Samples are read from the packed gallery, which is memory-mapped rather
+    than decoded image by image. The pack is rebuilt from fn_dir first if it
+    no longer mirrors it.
+
+    Args:
+    - fn_dir: Directory containing one sub-directory per subject
     
     Returns:
     - Tuple containing trained model and corresponding names
     """
     model = cv2.face.LBPHFaceRecognizer_create()
-    fn_dir = 'face_samples'
     print('Training...')
 
-    images, labels, names = [], [], {}
-    id = 0
-
-    for subdir, dirs, files in os.walk(fn_dir):
-        for subdir in dirs:
-            names[id] = subdir
-            subject_path = os.path.join(fn_dir, subdir)
-            for filename in os.listdir(subject_path):
-                name, extension = os.path.splitext(filename)
-                if extension.lower() not in ['.png', '.jpg', '.jpeg', '.gif', '.pgm']:
-                    print("Skipping " + filename + ", wrong file type")
-                    continue
-                path = os.path.join(subject_path, filename)
-                label = id
-                images.append(cv2.imread(path, 0))
-                labels.append(int(label))
-            id += 1
-
-    images, labels = np.array(images), np.array(labels)
-    model.train(images, labels)
+    packed_gallery.sync(fn_dir, gallery_fingerprint(fn_dir), skip=(STAGING_DIR,))
+    images, labels, names = packed_gallery.load(skip=(STAGING_DIR,))
+    model.train(np.asarray(images), labels)
+    metrics.retrains_total.inc('full')
     return model, names
 
-def detect_faces(gray_frame):
+@metrics.timed('detect_faces')
+def detect_faces(gray_frame, profile=DEFAULT_PROFILE):
     """
-    Detect faces in a grayscale frame.
+    Detect faces in a grayscale frame with the DETECTOR_BACKEND detector.
     
     Args:
     - gray_frame: Grayscale frame
+    - profile: DetectionProfile of the feed (see detection_profile)
     
     Returns:
-    - List of face coordinates
+    - N x 4 array of face boxes (x, y, w, h) in gray_frame coordinates
+    """
+    return detectors.detect(gray_frame, profile)
+
+# One face of a frame: box in frame coordinates, subject name (None if not
+# recognized), LBPH confidence and the tracker ID (None when not tracked)
+FaceMatch = namedtuple('FaceMatch', ['box', 'name', 'confidence', 'track_id'])
+FaceMatch.__new__.__defaults__ = (None,)
+
+@metrics.timed('crop_faces')
+def crop_faces(gray_frame, face_coords):
+    """
+    Cut detected faces out of a frame at the recognizer's input size.
+
+    Args:
+    - gray_frame: Grayscale frame
+    - face_coords: Face boxes from detect_faces()
+
+    Returns:
+    - Tuple (boxes, faces): (x, y, w, h) int tuples and 92x112 grayscale crops
     """
-    global size, haar_cascade
-    mini_frame = cv2.resize(gray_frame, (int(gray_frame.shape[1] / size), int(gray_frame.shape[0] / size)))
-    faces = haar_cascade.detectMultiScale(mini_frame)
-    return faces
+    img_width, img_height = 112, 92
+
+    boxes, faces = [], []
+    for face_coord in face_coords:
+        x, y, w, h = [int(v) for v in face_coord]
+        face = gray_frame[y:y + h, x:x + w]
+        boxes.append((x, y, w, h))
+        faces.append(cv2.resize(face, (img_width, img_height)))
+    return boxes, faces
+
+@metrics.timed('predict')
+def predict_faces(model, faces):
+    """
+    Run the recognizer on face crops.
+
+    Returns:
+    - List of (label, confidence) tuples
+    """
+    # Batched engines score all faces of the frame in one call
+    if hasattr(model, 'predict_batch'):
+        return model.predict_batch(faces)
+    return [model.predict(face) for face in faces]
+
+def to_match(box, prediction, names):
+    """Turn a (label, confidence) prediction into a FaceMatch, applying the recognition threshold."""
+    label, confidence = prediction
+    return FaceMatch(box, names[label] if confidence < RECOGNITION_THRESHOLD else None, confidence)
+
+def match_faces(model, gray_frame, face_coords, names):
+    """
+    Predict the identity of every detected face.
+
+    Args:
+    - model: Trained face recognition model, or an engine from make_recognizer()
+    - gray_frame: Grayscale frame
+    - face_coords: Face boxes from detect_faces()
+    - names: Dictionary containing subject names
+
+    Returns:
+    - List of FaceMatch tuples in frame coordinates; name is None when the
+      confidence is above the recognition threshold
+    """
+    boxes, faces = crop_faces(gray_frame, face_coords)
+    return [to_match(box, prediction, names) for box, prediction in zip(boxes, predict_faces(model, faces))]
+
+def recognized_matches(matches):
+    """
+    Keep the first match of each recognized subject.
+
+    Args:
+    - matches: List of FaceMatch tuples
+
+    Returns:
+    - List of FaceMatch tuples with a name, one per subject
+    """
+    recognized = []
+    recog_names = []
+    for match in matches:
+        if match.name is not None and match.name not in recog_names:
+            recog_names.append(match.name)
+            recognized.append(match)
+    return recognized
+
+def draw_matches(frame, matches):
+    """
+    Draw match_faces() results: red boxes for criminals, green for unknown faces.
+
+    Args:
+    - frame: Frame to annotate in place, or None to only collect the recognized subjects
+    - matches: List of FaceMatch tuples
+
+    Returns:
+    - List of (name, confidence) tuples, one per recognized subject
+    """
+    recognized = recognized_matches(matches)
+    if frame is not None:
+        drawn = set(id(match) for match in recognized)
+        for match in matches:
+            if match.name is None:
+                color = (0, 255, 0)
+            elif id(match) in drawn:
+                color = (0, 0, 255)
+            else:
+                continue
+            x, y, w, h = match.box
+            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+    return [(match.name.capitalize(), match.confidence) for match in recognized]
 
 def recognize_face(model, frame, gray_frame, face_coords, names):
     """
     Recognize faces in a frame using a trained model.
     
     Args:
-    - model: Trained face recognition model
+    - model: Trained face recognition model, or an engine from make_recognizer()
     - frame: Input frame
     - gray_frame: Grayscale frame
     - face_coords: List of face coordinates
@@ -78,21 +778,5 @@ def recognize_face(model, frame, gray_frame, face_coords, names):
     Returns:
     - Tuple containing the annotated frame and recognized faces
     """
-    img_width, img_height = 112, 92
-    recognized = []
-    recog_names = []
-
-    for face_coord in face_coords:
-        x, y, w, h = [v * size for v in face_coord]
-        face = gray_frame[y:y + h, x:x + w]
-        face_resize = cv2.resize(face, (img_width, img_height))
-        prediction, confidence = model.predict(face_resize)
-
-        if confidence < 95 and names[prediction] not in recog_names:
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
-            recog_names.append(names[prediction])
-            recognized.append((names[prediction].capitalize(), confidence))
-        elif confidence >= 95:
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-    return frame, recognized
+    matches = match_faces(model, gray_frame, face_coords, names)
+    return frame, draw_matches(frame, matches)
@@ -0,0 +1,358 @@
+# gallery.py
+"""
+Packed face gallery.
+
+All training samples are kept in one raw uint8 file of shape N x 92 x 112
+(faces.u8) that is memory-mapped for training, next to an int32 label index
+(labels.i32) and a JSON manifest holding the sample count, the label->name
+map and the fingerprint of the face_samples tree the pack mirrors.
+
+face_samples/ stays the source of truth. Registration appends to the pack as
+it saves the PNGs, so the pack only has to be rebuilt from the images when
+face_samples is changed by hand.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+PACK_DIR = 'face_gallery'
+FACES_FILE = 'faces.u8'
+LABELS_FILE = 'labels.i32'
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = 'pack.lock'
+PACK_FORMAT_VERSION = 1
+FACE_HEIGHT, FACE_WIDTH = 92, 112
+# A lock file older than this is assumed to be left over from a crash
+STALE_LOCK_SECONDS = 60
+
+
+@contextmanager
+def file_lock(lock_path, stale_after=STALE_LOCK_SECONDS):
+    """
+    Hold a cross-process lock, implemented as an exclusively created file.
+
+    Works the same on Windows (desktop app) and Linux (gunicorn workers).
+
+    Args:
+    - lock_path: Path of the lock file; its directory is created if needed
+    - stale_after: Seconds after which a lock file is assumed abandoned
+    """
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+class PackedGallery:
+    def __init__(self, pack_dir=PACK_DIR):
+        self.pack_dir = pack_dir
+
+    def _path(self, filename):
+        return os.path.join(self.pack_dir, filename)
+
+    def _locked(self):
+        # Cross-process lock so gunicorn workers and the desktop app don't interleave appends
+        return file_lock(self._path(LOCK_FILE))
+
+    def read_manifest(self):
+        """
+        Read the pack manifest.
+
+        Returns:
+        - Manifest dictionary, or None if there is no usable pack
+        """
+        try:
+            with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('format') != PACK_FORMAT_VERSION:
+            return None
+        if (manifest.get('height'), manifest.get('width')) != (FACE_HEIGHT, FACE_WIDTH):
+            return None
+        return manifest
+
+    def _write_manifest(self, manifest):
+        tmp_path = self._path(MANIFEST_FILE + '.tmp%d' % os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._path(MANIFEST_FILE))
+
+    def _empty_manifest(self):
+        return {
+            'format': PACK_FORMAT_VERSION,
+            'height': FACE_HEIGHT,
+            'width': FACE_WIDTH,
+            'count': 0,
+            'next_label': 0,
+            'names': {},
+            'removed': [],
+            'source_fingerprint': None,
+        }
+
+    @staticmethod
+    def _label_of(manifest, name):
+        for label, subject in manifest['names'].items():
+            if subject == name and int(label) not in manifest['removed']:
+                return int(label)
+        return None
+
+    def append(self, name, faces):
+        """
+        Append samples of a subject to the pack.
+
+        Rows are written before the manifest count is raised, so a crash
+        mid-append leaves only unreferenced bytes that the next append
+        overwrites.
+
+        Args:
+        - name: Subject name (the face_samples sub-directory)
+        - faces: List of 92x112 grayscale faces
+
+        Returns:
+        - Label of the subject in the pack
+        """
+        faces = np.ascontiguousarray(np.asarray(faces, dtype=np.uint8).reshape(-1, FACE_HEIGHT, FACE_WIDTH))
+        with self._locked():
+            manifest = self.read_manifest() or self._empty_manifest()
+            label = self._label_of(manifest, name)
+            if label is None:
+                label = manifest['next_label']
+                manifest['next_label'] = label + 1
+                manifest['names'][str(label)] = name
+
+            count = manifest['count']
+            face_bytes = FACE_HEIGHT * FACE_WIDTH
+            for filename, item_size, data in (
+                    (FACES_FILE, face_bytes, faces.tobytes()),
+                    (LABELS_FILE, 4, np.full(len(faces), label, dtype=np.int32).tobytes())):
+                mode = 'r+b' if os.path.exists(self._path(filename)) else 'wb'
+                with open(self._path(filename), mode) as f:
+                    f.seek(count * item_size)
+                    f.write(data)
+                    f.truncate()
+            manifest['count'] = count + len(faces)
+            self._write_manifest(manifest)
+        return label
+
+    def rename(self, old_name, new_name, source_fingerprint=None, base_fingerprint=None):
+        """
+        Rename a subject, e.g. the staging folder once registration succeeds.
+
+        An existing subject called new_name is removed first, matching the
+        folder replacement done on registration.
+
+        Args:
+        - old_name: Current subject name
+        - new_name: New subject name
+        - source_fingerprint: Fingerprint of face_samples after the rename, marks the pack in
+          sync (ignored if old_name is not packed, so the next sync rebuilds instead)
+        - base_fingerprint: Fingerprint of face_samples before the rename; source_fingerprint
+          is only adopted if the pack mirrored this tree, otherwise it is left stale
+        """
+        with self._locked():
+            manifest = self.read_manifest()
+            if manifest is None:
+                return
+            old_label = self._label_of(manifest, old_name)
+            existing = self._label_of(manifest, new_name)
+            if existing is not None and existing != old_label:
+                manifest['removed'].append(existing)
+            if old_label is not None:
+                manifest['names'][str(old_label)] = new_name
+                if source_fingerprint is not None and base_fingerprint is not None \
+                        and manifest.get('source_fingerprint') == base_fingerprint:
+                    manifest['source_fingerprint'] = source_fingerprint
+            self._write_manifest(manifest)
+
+    def remove(self, name):
+        """
+        Drop a subject from the pack.
+
+        Its rows stay in the file but are skipped on load until the next sync compacts them.
+
+        Args:
+        - name: Subject name
+        """
+        with self._locked():
+            manifest = self.read_manifest()
+            if manifest is None:
+                return
+            label = self._label_of(manifest, name)
+            if label is not None:
+                manifest['removed'].append(label)
+                self._write_manifest(manifest)
+
+    def load(self, skip=()):
+        """
+        Map the packed samples into memory.
+
+        Args:
+        - skip: Subject names to leave out (e.g. the registration staging folder)
+
+        Returns:
+        - Tuple (faces, labels, names): faces is an N x 92 x 112 uint8 array
+          backed by the pack file, labels an int32 array and names the
+          label->name map of live subjects. Skipped subjects being staged sit
+          at the end of the pack and are sliced off; only rows removed since
+          the last sync force a copy
+        """
+        manifest = self.read_manifest()
+        if manifest is None or manifest['count'] == 0:
+            return np.empty((0, FACE_HEIGHT, FACE_WIDTH), np.uint8), np.empty(0, np.int32), {}
+        count = manifest['count']
+        faces = np.memmap(self._path(FACES_FILE), dtype=np.uint8, mode='r',
+                          shape=(count, FACE_HEIGHT, FACE_WIDTH))
+        labels = np.fromfile(self._path(LABELS_FILE), dtype=np.int32, count=count)
+        removed = set(manifest['removed'])
+        removed.update(int(k) for k, v in manifest['names'].items() if v in skip)
+        names = {int(k): v for k, v in manifest['names'].items() if int(k) not in removed}
+        if removed:
+            keep = ~np.isin(labels, list(removed))
+            kept = int(keep.sum())
+            if keep[:kept].all():
+                faces, labels = faces[:kept], labels[:kept]
+            else:
+                faces, labels = faces[keep], labels[keep]
+        return faces, labels, names
+
+    def subject(self, name):
+        """
+        Get the label and samples of one subject.
+
+        Args:
+        - name: Subject name
+
+        Returns:
+        - Tuple (label, faces), or (None, None) if the subject is not in the pack
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None, None
+        label = self._label_of(manifest, name)
+        if label is None:
+            return None, None
+        faces, labels, _ = self.load()
+        return label, np.asarray(faces[labels == label])
+
+    def rebuild(self, fn_dir, source_fingerprint, skip=()):
+        """
+        Rebuild the pack from the images in face_samples.
+
+        This is the only place PNGs are decoded; it runs when the pack is
+        missing or face_samples was changed outside of registration.
+
+        Args:
+        - fn_dir: Directory containing one sub-directory per subject
+        - source_fingerprint: Fingerprint of fn_dir to record in the manifest
+        - skip: Sub-directories to leave out (e.g. the registration staging folder)
+        """
+        from facerec import load_subject_images
+
+        print('Packing face samples...')
+        manifest = self._empty_manifest()
+        faces, labels = [], []
+        for subdir in sorted(os.listdir(fn_dir)) if os.path.isdir(fn_dir) else []:
+            subject_path = os.path.join(fn_dir, subdir)
+            if subdir in skip or not os.path.isdir(subject_path):
+                continue
+            label = manifest['next_label']
+            manifest['next_label'] = label + 1
+            manifest['names'][str(label)] = subdir
+            for face in load_subject_images(subject_path):
+                if face is None:
+                    continue
+                if face.shape != (FACE_HEIGHT, FACE_WIDTH):
+                    face = cv2.resize(face, (FACE_WIDTH, FACE_HEIGHT))
+                faces.append(face)
+                labels.append(label)
+
+        with self._locked():
+            tmp_suffix = '.tmp%d' % os.getpid()
+            np.asarray(faces, dtype=np.uint8).reshape(-1, FACE_HEIGHT, FACE_WIDTH).tofile(self._path(FACES_FILE + tmp_suffix))
+            np.asarray(labels, dtype=np.int32).tofile(self._path(LABELS_FILE + tmp_suffix))
+            os.replace(self._path(FACES_FILE + tmp_suffix), self._path(FACES_FILE))
+            os.replace(self._path(LABELS_FILE + tmp_suffix), self._path(LABELS_FILE))
+            manifest['count'] = len(faces)
+            manifest['source_fingerprint'] = source_fingerprint
+            self._write_manifest(manifest)
+
+    def compact(self, chunk_rows=4096):
+        """
+        Drop the rows of removed subjects from the pack files.
+
+        Rows are copied chunk by chunk into new files that replace the old
+        ones, like rebuild does, so readers holding a map of the old files
+        are not affected.
+
+        Args:
+        - chunk_rows: Number of rows copied at a time
+
+        Returns:
+        - Number of rows dropped
+        """
+        with self._locked():
+            manifest = self.read_manifest()
+            if manifest is None or not manifest['removed']:
+                return 0
+            count = manifest['count']
+            face_bytes = FACE_HEIGHT * FACE_WIDTH
+            labels = np.fromfile(self._path(LABELS_FILE), dtype=np.int32, count=count)
+            keep = ~np.isin(labels, manifest['removed'])
+            tmp_suffix = '.tmp%d' % os.getpid()
+            with open(self._path(FACES_FILE), 'rb') as src, open(self._path(FACES_FILE + tmp_suffix), 'wb') as dst:
+                for start in range(0, count, chunk_rows):
+                    stop = min(start + chunk_rows, count)
+                    rows = np.fromfile(src, dtype=np.uint8, count=(stop - start) * face_bytes)
+                    rows.reshape(-1, face_bytes)[keep[start:stop]].tofile(dst)
+            labels[keep].tofile(self._path(LABELS_FILE + tmp_suffix))
+            os.replace(self._path(FACES_FILE + tmp_suffix), self._path(FACES_FILE))
+            os.replace(self._path(LABELS_FILE + tmp_suffix), self._path(LABELS_FILE))
+            for label in manifest['removed']:
+                manifest['names'].pop(str(label), None)
+            manifest['removed'] = []
+            manifest['count'] = int(keep.sum())
+            self._write_manifest(manifest)
+        return count - int(keep.sum())
+
+    def sync(self, fn_dir, source_fingerprint, skip=()):
+        """
+        Rebuild the pack if it does not mirror the given face_samples fingerprint.
+
+        Otherwise rows of removed subjects are compacted away, so load can
+        return the mapped files.
+
+        Returns:
+        - True if the pack was rebuilt
+        """
+        manifest = self.read_manifest()
+        if manifest is not None and manifest.get('source_fingerprint') == source_fingerprint:
+            if manifest['removed']:
+                self.compact()
+            return False
+        self.rebuild(fn_dir, source_fingerprint, skip)
+        return True
+
+
+packed_gallery = PackedGallery()
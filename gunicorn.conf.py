@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, read from the working directory on start.
+
+The app is imported once in the master (preload_app): it loads or trains the
+model and runs the warm-up inference before any worker is forked, so workers
+share the model pages copy-on-write and take traffic warm. Threads can't
+cross a fork, so background threads start in the workers after the fork;
+of the server-side cameras, only the worker holding the ingest owner lock
+reads them (see ingest.py).
+"""
+import os
+
+preload_app = True
+# Tell app.py not to start background threads in the master
+os.environ["DEFER_BACKGROUND_THREADS"] = "1"
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background()
@@ -1,6 +1,7 @@
 import os
 import json
 import cv2
+import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
@@ -12,6 +13,10 @@ from datetime import datetime
 from facerec import *
 from register import *
 from dbHandler import *
+from model_registry import registry
+from motion import MotionGate
+from tracker import FaceTracker
+from ingest import LatestFrame
 
 # ---------- RESOURCE PATH HELPER (for PyInstaller) ----------
 def resource_path(relative_path):
@@ -44,6 +49,7 @@ left_frame = None
 right_frame = None
 heading = None
 webcam = None
+surveillance = None
 img_label = None
 img_read = None
 img_list = []
@@ -54,7 +60,14 @@ camera_index_var = None
 available_cameras = []
 recent_detections = []  # list of (name, timestamp_string)
 recent_history_frame = None
+recent_history_rows = None
 detected_list_frame = None
+detected_rows = None
+# Display buffers of showImage, reused while the display size stays the same
+display_bgr = None
+display_rgba = None
+display_image = None
+display_photo = None
 users = {}
 
 # Creating tkinter window
@@ -126,6 +139,52 @@ def save_users():
         print("Failed to save users:", e)
 
 
+class PanelRows:
+    """
+    Rows of a panel that are updated in place.
+
+    A row widget is created the first time a position is used and afterwards
+    only reconfigured when its value changes; rows past the end of the list
+    are hidden rather than destroyed, so panels that change every few frames
+    don't churn Tk widgets.
+
+    Args:
+    - parent: Frame holding the rows
+    - make_row: Function (parent) -> (row widget, function showing a value in it)
+    - empty: Widget shown while there are no rows, or None
+    - pack: Keyword arguments for packing a row
+    """
+    def __init__(self, parent, make_row, empty=None, **pack):
+        self.parent = parent
+        self.make_row = make_row
+        self.empty = empty
+        self.pack = pack
+        self.rows = []  # [widget, show, value, visible]
+
+    def update(self, values):
+        if self.empty is not None:
+            if values:
+                self.empty.pack_forget()
+            elif not self.empty.winfo_manager():
+                self.empty.pack(pady=6)
+        for i, value in enumerate(values):
+            if i == len(self.rows):
+                widget, show = self.make_row(self.parent)
+                self.rows.append([widget, show, None, False])
+            row = self.rows[i]
+            if row[2] != value:
+                row[1](value)
+                row[2] = value
+            if not row[3]:
+                # Hidden rows are always the tail, so packing appends in order
+                row[0].pack(**self.pack)
+                row[3] = True
+        for row in self.rows[len(values):]:
+            if row[3]:
+                row[0].pack_forget()
+                row[3] = False
+
+
 def add_recent_detection(name: str):
     """Record a newly detected criminal with the current timestamp, keeping only the last 5."""
     global recent_detections
@@ -140,47 +199,51 @@ def add_recent_detection(name: str):
 
 def update_recent_history_ui():
     """Refresh the 'Recent Detections' column in the CCTV page, if visible."""
-    global recent_history_frame
-    if recent_history_frame is None:
-        return
+    # The CCTV page's widgets are gone once it was left
+    if recent_history_rows is not None and recent_history_rows.parent.winfo_exists():
+        recent_history_rows.update(recent_detections)
 
-    for w in recent_history_frame.winfo_children():
-        w.destroy()
 
-    if not recent_detections:
-        tk.Label(
-            recent_history_frame,
-            text="No detections yet.",
-            bg=CARD_BG,
-            fg=TEXT_MUTED,
-            font=("Segoe UI", scaled(11, min_px=10, max_px=13)),
-        ).pack(pady=6)
-        return
+def make_history_row(parent):
+    row = tk.Frame(parent, bg=CARD_BG)
 
-    for name, ts in recent_detections:
-        row = tk.Frame(recent_history_frame, bg=CARD_BG)
-        row.pack(fill="x", padx=6, pady=4)
+    name_lbl = tk.Label(
+        row,
+        bg=CARD_BG,
+        fg=ACCENT_ALT,
+        font=("Segoe UI", scaled(12, min_px=10, max_px=14), "bold"),
+        cursor="hand2",
+    )
+    name_lbl.pack(side="left", anchor="w")
+    # Bound once: the row shows a different name as detections come in
+    name_lbl.bind("<Button-1>", lambda e: showCriminalProfile(name_lbl.cget("text")))
 
-        name_lbl = tk.Label(
-            row,
-            text=name,
-            bg=CARD_BG,
-            fg=ACCENT_ALT,
-            font=("Segoe UI", scaled(12, min_px=10, max_px=14), "bold"),
-            cursor="hand2",
-        )
-        name_lbl.pack(side="left", anchor="w")
-        # capture name with default arg
-        name_lbl.bind("<Button-1>", lambda e, n=name: showCriminalProfile(n))
+    time_lbl = tk.Label(
+        row,
+        bg=CARD_BG,
+        fg=TEXT_MUTED,
+        font=("Segoe UI", scaled(10, min_px=9, max_px=12)),
+    )
+    time_lbl.pack(side="right", anchor="e")
 
-        time_lbl = tk.Label(
-            row,
-            text=ts,
-            bg=CARD_BG,
-            fg=TEXT_MUTED,
-            font=("Segoe UI", scaled(10, min_px=9, max_px=12)),
-        )
-        time_lbl.pack(side="right", anchor="e")
+    def show(detection):
+        name_lbl.configure(text=detection[0])
+        time_lbl.configure(text=detection[1])
+    return row, show
+
+
+def make_detected_row(parent):
+    label = tk.Label(
+        parent,
+        bg=PANEL_BG,
+        fg=TEXT_PRIMARY,
+        font=("Segoe UI", scaled(13, min_px=11, max_px=15), "bold"),
+        pady=10,
+        padx=12,
+        cursor="hand2",
+    )
+    label.bind("<Button-1>", lambda e: showCriminalProfile(label.cget("text")))
+    return label, lambda name: label.configure(text=name)
 
 # Create Pages (stacked full‑window frames)
 pages = []
@@ -194,11 +257,7 @@ def goBack():
     global active_page, thread_event, webcam
 
     if (active_page == 3 and thread_event is not None and not thread_event.is_set()):
-        thread_event.set()
-        try:
-            webcam.release()
-        except Exception:
-            pass
+        stopSurveillance()
 
     for widget in pages[active_page].winfo_children():
         widget.destroy()
@@ -211,14 +270,9 @@ def logout():
     """Logout current user and return to the Login / Create Account screen."""
     global thread_event, webcam, auth_frame
 
-    # Stop any running surveillance thread and release camera
+    # Stop any running surveillance threads and release camera
     if thread_event is not None and not thread_event.is_set():
-        thread_event.set()
-        try:
-            if webcam is not None:
-                webcam.release()
-        except Exception:
-            pass
+        stopSurveillance()
 
     # Rebuild the authentication UI overlay and show the auth choice screen
     try:
@@ -291,21 +345,32 @@ def basicPageSetup(pageNo):
 
 # Function to show image on a frame
 def showImage(frame, img_size):
-    global img_label, left_frame
+    """
+    Show a BGR frame in img_label, scaled to a square of img_size pixels.
+
+    One PhotoImage is updated in place with paste(); resizing and colour
+    conversion write into buffers that are reused while the size stays the same.
+    """
+    global img_label, left_frame, display_bgr, display_rgba, display_image, display_photo
 
     if img_size <= 0:
         img_size = 200
-    img = cv2.resize(frame, (img_size, img_size))
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = Image.fromarray(img)
-    img = ImageTk.PhotoImage(img)
+    if display_photo is None or display_rgba.shape[0] != img_size:
+        display_bgr = np.empty((img_size, img_size, 3), np.uint8)
+        display_rgba = np.empty((img_size, img_size, 4), np.uint8)
+        display_image = Image.frombuffer("RGBA", (img_size, img_size), display_rgba, "raw", "RGBA", 0, 1)
+        display_photo = ImageTk.PhotoImage("RGBA", (img_size, img_size))
+        if img_label is not None:
+            img_label.configure(image=display_photo)
+            img_label.image = display_photo
+    cv2.resize(frame, (img_size, img_size), dst=display_bgr)
+    # RGBA, because Pillow only shares the memory of 4-byte pixel buffers
+    cv2.cvtColor(display_bgr, cv2.COLOR_BGR2RGBA, dst=display_rgba)
+    display_photo.paste(display_image)
     if (img_label is None):
-        img_label = tk.Label(left_frame, image=img, bg=CARD_BG)
-        img_label.image = img
+        img_label = tk.Label(left_frame, image=display_photo, bg=CARD_BG)
+        img_label.image = display_photo
         img_label.pack(padx=20)
-    else:
-        img_label.configure(image=img)
-        img_label.image = img
 
 # Function to move to the next or previous image in a slideshow
 def getNewSlide(control):
@@ -399,8 +464,9 @@ def register(entries, required, menu_var):
 
     # Setting Directory
     path = os.path.join('face_samples', "temp_criminal")
-    if not os.path.isdir(path):
-        os.mkdir(path)
+    # Clear leftovers of an interrupted registration before staging new samples
+    discardRegistration(path)
+    os.mkdir(path)
 
     no_face = []
     for i, img in enumerate(img_list):
@@ -416,14 +482,15 @@ def register(entries, required, menu_var):
             no_face_st += "Image " + str(i) + ", "
         messagebox.showerror("Registration Error", "Registration failed!\n\nFollowing images doesn't contain"
                                                     " face or Face is too small:\n\n%s" % (no_face_st))
-        shutil.rmtree(path, ignore_errors=True)
+        discardRegistration(path)
     else:
         # Storing data in database
         rowId = insertData(entry_data)
 
         if (rowId > 0):
             messagebox.showinfo("Success", "Criminal Registered Successfully.")
-            shutil.move(path, os.path.join('face_samples', entry_data["Name"]))
+            commitRegistration(path, entry_data["Name"])
+            registry.add_identity(entry_data["Name"])
 
             # save profile pic
             profile_img_num = int(menu_var.get().split(' ')[1]) - 1
@@ -433,7 +500,7 @@ def register(entries, required, menu_var):
 
             goBack()
         else:
-            shutil.rmtree(path, ignore_errors=True)
+            discardRegistration(path)
             messagebox.showerror("Database Error", "Some error occurred while storing data.")
 
 # Function to handle canvas scroll event (reused for other canvas)
@@ -668,9 +735,9 @@ def startRecognition():
     if (len(face_coords) == 0):
         messagebox.showerror("Error", "Image doesn't contain any face or face is too small.")
     else:
-        (model, names) = train_model()
-        print('Training Successful. Detecting Faces')
-        (frame, recognized) = recognize_face(model, frame, gray_frame, face_coords, names)
+        snapshot = registry.get()
+        print('Model version %d. Detecting Faces' % snapshot.version)
+        (frame, recognized) = recognize_face(snapshot.model, frame, gray_frame, face_coords, snapshot.names)
 
         img_size = max(left_frame.winfo_height() - 40, 200)
         frame = cv2.flip(frame, 1, 0)
@@ -768,77 +835,142 @@ def detect_cameras(max_devices: int = 5):
     return cams
 
 
-# Function to handle video stream for recognition
-def videoLoop(model, names, camera_index):
-    global thread_event, left_frame, webcam, img_label, detected_list_frame
-    webcam = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    old_recognized = []
-    crims_found_labels = []
-    img_label = None
-
+# Surveillance pipeline: a capture thread, a recognition worker and a renderer on
+# the Tk thread, connected by latest-frame slots. Video renders at camera FPS;
+# recognition runs as fast as the CPU allows, and each rendered frame carries
+# the boxes of the most recent recognition result.
+RENDER_INTERVAL_MS = 10
+
+
+class SurveillancePipeline:
+    """
+    State shared by the stages of one surveillance session.
+
+    Args:
+    - camera_index: OpenCV index of the camera to read
+    """
+    def __init__(self, camera_index):
+        self.camera_index = camera_index
+        self.stop = threading.Event()
+        self.to_recognize = LatestFrame()
+        self.to_render = LatestFrame()
+        self._lock = threading.Lock()
+        self._matches = []
+        # Names in the detected-criminals panel and the frame boxes are drawn
+        # on; only touched on the Tk thread
+        self.shown_names = []
+        self.canvas = None
+
+    def publish(self, matches):
+        with self._lock:
+            self._matches = matches
+
+    def matches(self):
+        with self._lock:
+            return self._matches
+
+    def close(self):
+        self.stop.set()
+        self.to_recognize.close()
+        self.to_render.close()
+
+
+# Capture stage: reads the camera at its own rate and hands every frame on
+def captureLoop(pipeline):
+    global webcam
+    webcam = cv2.VideoCapture(pipeline.camera_index, cv2.CAP_DSHOW)
     try:
-        while not thread_event.is_set():
-            # Loop until the camera is working
-            while (True):
-                # Put the image from the webcam into 'frame'
-                (return_val, frame) = webcam.read()
-                if (return_val == True):
-                    break
-                else:
-                    print("Failed to open webcam. Trying again...")
-
+        while not pipeline.stop.is_set():
+            (return_val, frame) = webcam.read()
+            if not return_val:
+                print("Failed to open webcam. Trying again...")
+                pipeline.stop.wait(0.5)
+                continue
             # Flip the image (optional)
             frame = cv2.flip(frame, 1, 0)
-            # Convert frame to grayscale
+            pipeline.to_render.put(frame)
+            pipeline.to_recognize.put(frame)
+    finally:
+        pipeline.close()
+        webcam.release()
+
+
+# Recognition stage: works on the newest frame and skips the ones it was too slow for
+def recognitionLoop(pipeline):
+    # Skips detection while the scene is unchanged; the last result stays published
+    gate = MotionGate()
+    # Caches identities per tracked face so LBPH runs only for new or stale tracks
+    face_tracker = FaceTracker()
+    while True:
+        frame = pipeline.to_recognize.take()
+        if frame is None:
+            return
+        try:
             gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            # Detect Faces
+            if gate.skip(gray_frame):
+                continue
             face_coords = detect_faces(gray_frame)
-            (frame, recognized) = recognize_face(model, frame, gray_frame, face_coords, names)
-
-            # Recognize Faces
-            recog_names = [item[0] for item in recognized]
-            if (recog_names != old_recognized):
-                # Update the current detections panel (left side of right_frame on CCTV page)
-                parent = detected_list_frame if detected_list_frame is not None else right_frame
-                for wid in parent.winfo_children():
-                    wid.destroy()
-                del (crims_found_labels[:])
-
-                for i, crim in enumerate(recognized):
-                    name = crim[0]
-                    crims_found_labels.append(
-                        tk.Label(
-                            parent,
-                            text=name,
-                            bg=PANEL_BG,
-                            fg=TEXT_PRIMARY,
-                            font=("Segoe UI", scaled(13, min_px=11, max_px=15), "bold"),
-                            pady=10,
-                            padx=12,
-                            cursor="hand2",
-                        )
-                    )
-                    crims_found_labels[i].pack(fill="x", padx=10, pady=6)
-                    crims_found_labels[i].bind("<Button-1>", lambda e, n=name: showCriminalProfile(n))
-                    # Record in recent history list
-                    add_recent_detection(name)
-
-                old_recognized = recog_names
-
+            # Fetch per frame so a background retrain is picked up without restarting
+            snapshot = registry.get()
+            matches = face_tracker.match(snapshot.model, gray_frame, face_coords, snapshot.names)
+            gate.remember(matches)
+            pipeline.publish(matches)
+        except Exception as e:
+            print("[INFO]Recognition failed: %s" % str(e))
+
+
+# Render stage: runs on the Tk thread via root.after, the only stage that touches widgets
+def renderFrame(pipeline):
+    if pipeline.stop.is_set():
+        return
+    frame = pipeline.to_render.take(block=False)
+    try:
+        if frame is not None:
+            # The recognition worker may still be reading this frame, so draw on a copy
+            if pipeline.canvas is None or pipeline.canvas.shape != frame.shape:
+                pipeline.canvas = np.empty_like(frame)
+            np.copyto(pipeline.canvas, frame)
+            frame = pipeline.canvas
+            recognized = draw_matches(frame, pipeline.matches())
+            updateDetectedPanel(pipeline, recognized)
             # Display Video stream
             img_size = min(left_frame.winfo_width(), left_frame.winfo_height()) - 20
-
             showImage(frame, max(img_size, 200))
-
-    except RuntimeError:
-        print("[INFO]Caught Runtime Error")
     except tk.TclError:
+        # The page was torn down (back or logout)
         print("[INFO]Caught Tcl Error")
+        pipeline.close()
+        return
+    root.after(RENDER_INTERVAL_MS, renderFrame, pipeline)
+
+
+def updateDetectedPanel(pipeline, recognized):
+    recog_names = [item[0] for item in recognized]
+    if recog_names == pipeline.shown_names:
+        return
+    # Update the current detections panel (left side of right_frame on CCTV page)
+    detected_rows.update(recog_names)
+    for name in recog_names:
+        # Record in recent history list
+        add_recent_detection(name)
+
+    pipeline.shown_names = recog_names
+
+
+# Stop the running surveillance session, if any
+def stopSurveillance():
+    if surveillance is not None:
+        surveillance.close()
+    try:
+        if webcam is not None:
+            webcam.release()
+    except Exception:
+        pass
+
 
 # Start video surveillance with the selected camera
-def startVideoSurveillance(model, names):
-    global thread_event, camera_index_var
+def startVideoSurveillance():
+    global thread_event, camera_index_var, surveillance, img_label
 
     # Avoid starting multiple threads accidentally
     if thread_event is not None and not thread_event.is_set():
@@ -850,16 +982,20 @@ def startVideoSurveillance(model, names):
     except Exception:
         camera_index = 0
 
-    thread_event = threading.Event()
-    thread = threading.Thread(target=videoLoop, args=(model, names, camera_index))
-    thread.daemon = True
-    thread.start()
+    surveillance = SurveillancePipeline(camera_index)
+    thread_event = surveillance.stop
+    img_label = None
+    for target in (captureLoop, recognitionLoop):
+        thread = threading.Thread(target=target, args=(surveillance,))
+        thread.daemon = True
+        thread.start()
+    renderFrame(surveillance)
 
 
 # Function to get the Video Surveillance Page
 def getPage3():
     global active_page, video_loop, left_frame, right_frame, thread_event, heading, camera_index_var, available_cameras
-    global detected_list_frame, recent_history_frame
+    global detected_list_frame, recent_history_frame, detected_rows, recent_history_rows
     active_page = 3
     pages[3].lift()
 
@@ -885,6 +1021,7 @@ def getPage3():
         padx=(scaled(10, min_px=6, max_px=20), scaled(6, min_px=4, max_px=14)),
         pady=scaled(10, min_px=6, max_px=18),
     )
+    detected_rows = PanelRows(detected_list_frame, make_detected_row, fill="x", padx=10, pady=6)
 
     recent_history_frame = tk.LabelFrame(
         right_frame,
@@ -904,10 +1041,19 @@ def getPage3():
         padx=(scaled(6, min_px=4, max_px=14), scaled(10, min_px=6, max_px=20)),
         pady=scaled(10, min_px=6, max_px=18),
     )
+    no_detections = tk.Label(
+        recent_history_frame,
+        text="No detections yet.",
+        bg=CARD_BG,
+        fg=TEXT_MUTED,
+        font=("Segoe UI", scaled(11, min_px=10, max_px=13)),
+    )
+    recent_history_rows = PanelRows(recent_history_frame, make_history_row, empty=no_detections,
+                                    fill="x", padx=6, pady=4)
     update_recent_history_ui()
 
-    (model, names) = train_model()
-    print('Training Successful. Detecting Faces')
+    snapshot = registry.current()
+    print('Model version %d loaded. Detecting Faces' % snapshot.version)
 
     # Camera selection controls
     camera_panel = tk.Frame(left_frame, bg=CARD_BG)
@@ -943,7 +1089,7 @@ def getPage3():
     start_btn = tk.Button(
         left_frame,
         text="Start Surveillance",
-        command=lambda: startVideoSurveillance(model, names),
+        command=startVideoSurveillance,
         font=("Segoe UI", scaled(15, min_px=12, max_px=18), "bold"),
         bg=ACCENT,
         fg=TEXT_PRIMARY,
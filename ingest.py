@@ -0,0 +1,538 @@
+# ingest.py
+"""
+Server-side camera ingestion.
+
+Every camera (an RTSP URL, or a local video file standing in for one) gets a
+reader thread that keeps only its newest frame in a LatestFrame slot. A small
+pool of recognition workers takes frames from whichever cameras have one
+waiting, so a camera that produces frames faster than they can be recognized
+drops the stale ones instead of building a backlog.
+
+Under gunicorn every worker imports this, but only one process of the
+deployment reads the cameras: the one holding the owner lock under
+INGEST_DIR. The camera list (CAMERA_SOURCES plus cameras added or removed
+through the API) and the owner's stats are shared through files there, so
+any worker can change the list or report the stats, and another worker takes
+over if the owner dies.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+import metrics
+from config import CAMERA_SOURCES, INGEST_WORKERS
+from facerec import MODEL_DIR, detect_faces, detection_profile, draw_matches
+from gallery import file_lock
+from model_registry import registry
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no gunicorn workers, the one process is always the owner
+    fcntl = None
+from motion import MotionGate
+from tracker import FaceTracker
+
+# Seconds between reconnect attempts when a source can't be opened or stops delivering
+RECONNECT_SECONDS = 2.0
+# Window over which FPS figures are averaged
+FPS_WINDOW_SECONDS = 2.0
+# Camera list, owner stats and owner lock shared by the processes of a deployment
+INGEST_DIR = os.path.join(MODEL_DIR, 'ingest')
+CAMERAS_FILE = 'cameras.json'
+STATS_FILE = 'stats.json'
+OWNER_LOCK = 'owner.lock'
+# Seconds between the owner's checks of the camera list (and stats updates), and between takeover attempts
+SYNC_SECONDS = 2.0
+
+
+def _owner_lock(path):
+    """
+    Take an exclusive lock that is held until this process exits.
+
+    Returns:
+    - File descriptor holding the lock, or None if another process holds it
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class LatestFrame:
+    """
+    Single-slot mailbox between a frame producer and a recognition worker.
+
+    A frame that arrives while the previous one is still waiting replaces it,
+    so a slow consumer drops stale frames instead of queueing them.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        """
+        Store a frame, replacing one that was not taken yet.
+
+        Returns:
+        - True if the slot was empty, i.e. this frame is new work for a consumer
+        """
+        with self._cond:
+            self.received += 1
+            was_empty = self._frame is None
+            if not was_empty:
+                self.dropped += 1
+            self._frame = frame
+            self._cond.notify()
+            return was_empty
+
+    def take(self, block=True):
+        """
+        Take the waiting frame.
+
+        Args:
+        - block: Wait for a frame; returns None once the slot is closed
+
+        Returns:
+        - The frame, or None if there is none (or the slot was closed)
+        """
+        with self._cond:
+            while block and self._frame is None and not self._closed:
+                self._cond.wait()
+            frame, self._frame = self._frame, None
+            return frame
+
+    def pending(self):
+        return 0 if self._frame is None else 1
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._frame = None
+            self._cond.notify_all()
+
+
+class RateMeter:
+    # Events per second over the last FPS_WINDOW_SECONDS
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._count = 0
+        self.rate = 0.0
+
+    def tick(self):
+        with self._lock:
+            self._count += 1
+            now = time.monotonic()
+            elapsed = now - self._start
+            if elapsed >= FPS_WINDOW_SECONDS:
+                self.rate = self._count / elapsed
+                self._start, self._count = now, 0
+
+
+class Camera:
+    """
+    One video source read on its own thread.
+
+    Args:
+    - name: Camera name used in the API and in detections
+    - source: Anything cv2.VideoCapture opens: RTSP/HTTP URL, video file or device index
+    """
+    def __init__(self, name, source, on_frame):
+        self.name = name
+        self.source = source
+        self.slot = LatestFrame()
+        self.gate = MotionGate()
+        self.tracker = FaceTracker()
+        self.profile = detection_profile(name)
+        self.read_fps = RateMeter()
+        self.processed_fps = RateMeter()
+        self.processed = 0
+        self.errors = 0
+        self.connected = False
+        self.last_error = None
+        self.last_recognized = []
+        self.last_seen = None
+        self._on_frame = on_frame
+        # Set while the camera is queued for or held by a recognition worker, so
+        # its frames go through the gate and tracker one at a time and in order
+        self._busy = False
+        self._busy_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, name='camera-%s' % name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, wait=0.0):
+        self._stop.set()
+        self.slot.close()
+        if wait and self._thread.is_alive():
+            self._thread.join(wait)
+
+    def claim(self):
+        """
+        Mark the camera as queued for a worker.
+
+        Returns:
+        - True if it was idle, i.e. the caller must hand it to a worker
+        """
+        with self._busy_lock:
+            if self._busy:
+                return False
+            self._busy = True
+            return True
+
+    def release(self):
+        """
+        Done with the current frame.
+
+        Returns:
+        - True if a newer frame arrived meanwhile and the camera stays claimed
+          for the caller to queue again
+        """
+        with self._busy_lock:
+            if self.slot.pending():
+                return True
+            self._busy = False
+            return False
+
+    def _open(self):
+        source = int(self.source) if str(self.source).isdigit() else self.source
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            capture.release()
+            return None, 0.0
+        # Files are read as fast as they decode; pace them at their own frame
+        # rate so they behave like a live stream. Live streams report no frame count.
+        is_file = capture.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+        fps = capture.get(cv2.CAP_PROP_FPS) if is_file else 0.0
+        return capture, (1.0 / fps if fps and fps > 0 else 0.0)
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            capture, frame_interval = self._open()
+            if capture is None:
+                self.connected = False
+                self.last_error = "Could not open source"
+                self._stop.wait(RECONNECT_SECONDS)
+                continue
+            self.connected = True
+            self.last_error = None
+            next_frame = time.monotonic()
+            try:
+                while not self._stop.is_set():
+                    ok, frame = capture.read()
+                    if not ok:
+                        if frame_interval:
+                            # End of a video file: loop it like a continuous feed
+                            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                            ok, frame = capture.read()
+                        if not ok:
+                            self.last_error = "Stream ended"
+                            break
+                    self.read_fps.tick()
+                    self.slot.put(frame)
+                    if self.claim():
+                        self._on_frame(self)
+                    if frame_interval:
+                        next_frame = max(next_frame + frame_interval, time.monotonic() - frame_interval)
+                        self._stop.wait(max(0.0, next_frame - time.monotonic()))
+            finally:
+                capture.release()
+                self.connected = False
+            self._stop.wait(RECONNECT_SECONDS)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "source": str(self.source),
+            "connected": self.connected,
+            "read_fps": round(self.read_fps.rate, 2),
+            "processed_fps": round(self.processed_fps.rate, 2),
+            "frames_read": self.slot.received,
+            "frames_processed": self.processed,
+            "frames_dropped": self.slot.dropped,
+            "frames_skipped": self.gate.skipped,
+            "tracking": self.tracker.stats(),
+            "queue_depth": self.slot.pending(),
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_recognized": self.last_recognized,
+            "last_seen": self.last_seen,
+        }
+
+
+class IngestManager:
+    """
+    Camera readers plus the shared recognition worker pool.
+
+    Args:
+    - workers: Number of recognition threads shared by all cameras
+    - on_detection: Called with (camera name, recognized list) for frames with hits
+    - sources: Configured cameras, as (name, source) tuples
+    - state_dir: Directory shared with the deployment's other processes
+    """
+    def __init__(self, workers=INGEST_WORKERS, on_detection=None, sources=CAMERA_SOURCES, state_dir=INGEST_DIR):
+        self.workers = max(1, workers)
+        self.on_detection = on_detection
+        self.sources = list(sources)
+        self.state_dir = state_dir
+        self.is_owner = False
+        self.cameras = {}
+        self._lock = threading.Lock()
+        # Cameras with a frame waiting, in arrival order
+        self._ready = queue.Queue()
+        self._threads = []
+        self._owner_thread = None
+        self._owner_fd = None
+        self._stopping = threading.Event()
+
+    def _path(self, filename):
+        return os.path.join(self.state_dir, filename)
+
+    def _start_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work_loop, name='ingest-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def add_camera(self, name, source):
+        """
+        Start reading a source.
+
+        Args:
+        - name: Unique camera name
+        - source: RTSP/HTTP URL, video file path or device index
+
+        Returns:
+        - The Camera, or None if the name is already in use
+        """
+        with self._lock:
+            if name in self.cameras:
+                return None
+            self._start_workers()
+            camera = Camera(name, source, self._ready.put)
+            self.cameras[name] = camera
+        camera.start()
+        print("Camera %s started: %s" % (name, source))
+        return camera
+
+    def remove_camera(self, name):
+        with self._lock:
+            camera = self.cameras.pop(name, None)
+        if camera is None:
+            return False
+        camera.stop()
+        print("Camera %s stopped" % name)
+        return True
+
+    def stop_all(self):
+        # Stop readers and workers before the interpreter exits; OpenCV aborts
+        # if a thread is still inside it at shutdown
+        self._stopping.set()
+        with self._lock:
+            cameras = list(self.cameras.values())
+            self.cameras.clear()
+            threads, self._threads = self._threads, []
+        for camera in cameras:
+            camera.stop(wait=RECONNECT_SECONDS)
+        for _ in threads:
+            self._ready.put(None)
+        for t in threads:
+            t.join(RECONNECT_SECONDS)
+
+    # ---------- One reading process per deployment ----------
+    def start(self):
+        """
+        Read the deployment's cameras in this process once it holds the owner lock.
+
+        Every gunicorn worker calls this; the others keep trying in the
+        background, so one of them takes over if the owner exits.
+        """
+        if self._owner_thread is not None:
+            return
+        self._owner_thread = threading.Thread(target=self._owner_loop, name='ingest-owner')
+        self._owner_thread.daemon = True
+        self._owner_thread.start()
+
+    def _owner_loop(self):
+        while self._owner_fd is None:
+            self._owner_fd = _owner_lock(self._path(OWNER_LOCK))
+            if self._owner_fd is None and self._stopping.wait(SYNC_SECONDS):
+                return
+        self.is_owner = True
+        print("Ingest: process %d reads the server-side cameras" % os.getpid())
+        while not self._stopping.is_set():
+            try:
+                self._reconcile()
+                _write_json(self._path(STATS_FILE), self._local_stats())
+            except Exception as e:
+                print("Ingest: could not apply the camera list: %s" % str(e))
+            self._stopping.wait(SYNC_SECONDS)
+
+    def _reconcile(self):
+        # Start and stop cameras until the running ones match the shared list
+        wanted = self.camera_list()
+        with self._lock:
+            running = {name: camera.source for name, camera in self.cameras.items()}
+        for name, source in running.items():
+            if wanted.get(name) != source:
+                self.remove_camera(name)
+        for name, source in wanted.items():
+            if running.get(name) != source:
+                self.add_camera(name, source)
+
+    def _read_overrides(self):
+        try:
+            with open(self._path(CAMERAS_FILE), 'r', encoding='utf-8') as f:
+                overrides = json.load(f)
+        except (OSError, ValueError):
+            overrides = {}
+        return {"added": dict(overrides.get("added", {})), "removed": list(overrides.get("removed", []))}
+
+    def _list_from(self, overrides):
+        cameras = {name: source for name, source in self.sources if name not in overrides["removed"]}
+        cameras.update(overrides["added"])
+        return cameras
+
+    def camera_list(self):
+        """
+        Cameras the deployment should read: CAMERA_SOURCES plus API changes.
+
+        Returns:
+        - Dictionary of camera name to source
+        """
+        return self._list_from(self._read_overrides())
+
+    def request_add(self, name, source):
+        """
+        Add a camera to the shared list; the owner process starts it within SYNC_SECONDS.
+
+        Returns:
+        - False if the name is already in use
+        """
+        with file_lock(self._path(CAMERAS_FILE + '.lock')):
+            overrides = self._read_overrides()
+            if name in self._list_from(overrides):
+                return False
+            overrides["added"][name] = source
+            overrides["removed"] = [n for n in overrides["removed"] if n != name]
+            _write_json(self._path(CAMERAS_FILE), overrides)
+        return True
+
+    def request_remove(self, name):
+        """
+        Remove a camera from the shared list; the owner process stops it within SYNC_SECONDS.
+
+        Returns:
+        - False if there is no such camera
+        """
+        with file_lock(self._path(CAMERAS_FILE + '.lock')):
+            overrides = self._read_overrides()
+            if name not in self._list_from(overrides):
+                return False
+            overrides["added"].pop(name, None)
+            if any(n == name for n, _ in self.sources):
+                overrides["removed"].append(name)
+            _write_json(self._path(CAMERAS_FILE), overrides)
+        return True
+
+    def _work_loop(self):
+        while True:
+            camera = self._ready.get()
+            if camera is None:
+                return
+            frame = camera.slot.take(block=False)
+            if frame is not None:
+                try:
+                    self._recognize(camera, frame)
+                except Exception as e:
+                    camera.errors += 1
+                    camera.last_error = str(e)
+                    metrics.errors_total.inc("ingest")
+            if camera.release():
+                # A frame arrived while this one was recognized; back of the line
+                self._ready.put(camera)
+
+    def _recognize(self, camera, frame):
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        camera.processed += 1
+        camera.processed_fps.tick()
+        source = "camera:" + camera.name
+        metrics.frames_total.inc(source)
+        if camera.gate.skip(gray_frame):
+            # Unchanged scene: the last result still stands and was already reported
+            return
+        face_coords = detect_faces(gray_frame, camera.profile)
+        recognized = []
+        if len(face_coords) > 0:
+            metrics.faces_total.inc(source, amount=len(face_coords))
+            snapshot = registry.get()
+            with metrics.stage("recognize"):
+                recognized = draw_matches(None, camera.tracker.match(snapshot.model, gray_frame, face_coords,
+                                                                     snapshot.names))
+            metrics.recognitions_total.inc(source, amount=len(recognized))
+        camera.gate.remember(recognized)
+        camera.last_recognized = [{"name": r[0], "confidence": float(r[1])} for r in recognized]
+        if recognized:
+            camera.last_seen = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if self.on_detection is not None:
+                self.on_detection(camera.name, recognized)
+
+    def _local_stats(self):
+        with self._lock:
+            cameras = list(self.cameras.values())
+        return {
+            "owner": os.getpid(),
+            "updated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "workers": self.workers,
+            "queue_depth": self._ready.qsize(),
+            "cameras": [camera.stats() for camera in cameras],
+        }
+
+    def stats(self):
+        """
+        Per-camera throughput figures for the API, from whichever process reads the cameras.
+
+        Returns:
+        - Dictionary with the owner's pid, workers, cameras waiting for a worker,
+          and per-camera stats (as of the owner's last update when asked elsewhere)
+        """
+        if self.is_owner:
+            return self._local_stats()
+        try:
+            with open(self._path(STATS_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"owner": None, "updated_at": None, "workers": self.workers, "queue_depth": 0, "cameras": []}
+
+
+ingest = IngestManager()
+atexit.register(ingest.stop_all)
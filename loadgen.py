@@ -0,0 +1,256 @@
+"""
+Load generator for the CCTV recognition API.
+
+Simulated cameras each post JPEG frames to /api/criminal/recognize-frame at a
+fixed FPS over their own keep-alive connection, after logging in with a real
+session. Like the CCTV page, a camera waits for each answer before sending the
+next frame; ticks it falls behind on are counted as dropped frames. Frames are
+read from a directory of recorded JPEGs or synthesized from the face samples
+(the packed gallery is built from face_samples first if it is missing, as on
+a fresh checkout).
+
+Without --url the Flask app is started in-process on a free local port, so
+the run needs nothing but this checkout. Several camera counts can be given
+to find how many streams one node carries before p99 latency blows up.
+
+Usage: python loadgen.py [--url http://127.0.0.1:5001] [--frames dir] [--cameras 1,2,4,8]
+                         [--fps 5] [--duration 20] [--max-p99 1000] [--out result.json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+DEFAULT_USER = "admin@1234"
+DEFAULT_PASSWORD = "12345678"
+
+
+def load_frames(frame_dir):
+    frames = []
+    for filename in sorted(os.listdir(frame_dir)):
+        if os.path.splitext(filename)[1].lower() in (".jpg", ".jpeg"):
+            with open(os.path.join(frame_dir, filename), "rb") as f:
+                frames.append(f.read())
+    if not frames:
+        raise SystemExit("No JPEG frames in %s" % frame_dir)
+    return frames
+
+
+def synthesize_frames(count, width, height, fn_dir='face_samples'):
+    from bench_detectors import synthetic_scenes
+    scenes = synthetic_scenes(count, width, height, 40, fn_dir=fn_dir)
+    return [cv2.imencode(".jpg", cv2.cvtColor(scene, cv2.COLOR_GRAY2BGR))[1].tobytes() for scene, _ in scenes]
+
+
+def start_local_server():
+    """
+    Serve app.py on a free local port from a background thread.
+
+    Returns:
+    - Base URL of the server
+    """
+    from werkzeug.serving import make_server
+    from app import app
+    # One access log line per frame would bury the results
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "http://127.0.0.1:%d" % server.server_port
+
+
+def connect(url):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    return connection_class(parts.hostname, parts.port, timeout=30)
+
+
+def login(url, username, password):
+    """
+    Log in like the login page does.
+
+    Returns:
+    - Cookie header value carrying the session
+    """
+    connection = connect(url)
+    connection.request("POST", "/api/auth/login", json.dumps({"username": username, "password": password}),
+                       {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    body = response.read()
+    cookie = response.getheader("Set-Cookie")
+    connection.close()
+    if response.status != 200 or not cookie:
+        raise SystemExit("Login failed (%d): %s" % (response.status, body[:200].decode("utf-8", "replace")))
+    return cookie.split(";", 1)[0]
+
+
+class CameraStats:
+    def __init__(self):
+        self.latencies_ms = []
+        self.sent = 0
+        self.ok = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.errors = {}
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def run_camera(url, cookie, name, frames, offset, fps, deadline, stats):
+    connection = connect(url)
+    path = "/api/criminal/recognize-frame?camera=" + name
+    headers = {"Content-Type": "image/jpeg", "Cookie": cookie}
+    interval = 1.0 / fps
+    next_tick = time.perf_counter()
+    i = offset
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if now < next_tick:
+            time.sleep(next_tick - now)
+        elif now - next_tick >= interval:
+            # Missed ticks while the last answer was pending: a real camera's frames are gone
+            missed = int((now - next_tick) / interval)
+            stats.dropped += missed
+            next_tick += missed * interval
+        next_tick += interval
+
+        body = frames[i % len(frames)]
+        i += 1
+        stats.sent += 1
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body, headers)
+            response = connection.getresponse()
+            result = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            stats.error(type(e).__name__)
+            connection.close()
+            connection = connect(url)
+            continue
+        stats.latencies_ms.append((time.perf_counter() - start) * 1000)
+        if response.status != 200:
+            stats.error("HTTP %d" % response.status)
+            continue
+        try:
+            data = json.loads(result)
+        except ValueError:
+            stats.error("bad JSON")
+            continue
+        if not data.get("ok"):
+            stats.error(data.get("error") or "not ok")
+            continue
+        stats.ok += 1
+        stats.skipped += bool(data.get("skipped"))
+    connection.close()
+
+
+def run_step(url, cookie, frames, cameras, fps, duration):
+    """
+    Run a number of simulated cameras for a while.
+
+    Returns:
+    - Summary dictionary with throughput, latency percentiles and error counts
+    """
+    deadline = time.perf_counter() + duration
+    stats = [CameraStats() for _ in range(cameras)]
+    threads = []
+    for c in range(cameras):
+        # Cameras start at different frames so their scenes don't change in lockstep
+        offset = c * len(frames) // cameras
+        thread = threading.Thread(target=run_camera, args=(url, cookie, "loadgen-%d" % c, frames, offset, fps,
+                                                           deadline, stats[c]))
+        thread.daemon = True
+        threads.append(thread)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [ms for s in stats for ms in s.latencies_ms]
+    sent = sum(s.sent for s in stats)
+    ok = sum(s.ok for s in stats)
+    errors = {}
+    for s in stats:
+        for kind, n in s.errors.items():
+            errors[kind] = errors.get(kind, 0) + n
+
+    def percentile(p):
+        return round(float(np.percentile(latencies, p)), 1) if latencies else None
+
+    return {
+        "cameras": cameras,
+        "target_fps": fps * cameras,
+        "throughput_fps": round(ok / elapsed, 2),
+        "sent": sent,
+        "ok": ok,
+        "skipped": sum(s.skipped for s in stats),
+        "dropped": sum(s.dropped for s in stats),
+        "errors": errors,
+        "error_rate": round((sent - ok) / float(sent), 4) if sent else 0.0,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Server to load (default: start app.py in-process)")
+    parser.add_argument("--frames", help="Directory of recorded JPEG frames (default: synthetic frames)")
+    parser.add_argument("--width", type=int, default=1280, help="Size of synthetic frames")
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--samples", default="face_samples", help="Face samples synthetic frames are made from")
+    parser.add_argument("--cameras", default="1,2,4", help="Camera counts to run, one step each")
+    parser.add_argument("--fps", type=float, default=5.0, help="Frames per second per camera")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per step")
+    parser.add_argument("--max-p99", type=float, help="Stop stepping up once p99 latency exceeds this (ms)")
+    parser.add_argument("--user", default=DEFAULT_USER)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--out", help="Write the step results to this JSON file")
+    args = parser.parse_args()
+
+    if args.frames:
+        frames = load_frames(args.frames)
+    else:
+        frames = synthesize_frames(30, args.width, args.height, args.samples)
+    url = args.url.rstrip("/") if args.url else start_local_server()
+    cookie = login(url, args.user, args.password)
+    print("%d frames against %s" % (len(frames), url))
+
+    print("%8s %10s %10s %8s %8s %8s %8s %8s %8s" % (
+        "cameras", "target/s", "frames/s", "p50 ms", "p95 ms", "p99 ms", "errors", "dropped", "skipped"))
+    steps = []
+    for cameras in [int(c) for c in args.cameras.split(",") if c.strip()]:
+        step = run_step(url, cookie, frames, cameras, args.fps, args.duration)
+        steps.append(step)
+        print("%8d %10.1f %10.1f %8s %8s %8s %7.1f%% %8d %8d" % (
+            cameras, step["target_fps"], step["throughput_fps"], step["p50_ms"], step["p95_ms"], step["p99_ms"],
+            step["error_rate"] * 100, step["dropped"], step["skipped"]))
+        for kind, n in sorted(step["errors"].items()):
+            print("%8s %s: %d" % ("", kind, n))
+        if args.max_p99 is not None and step["p99_ms"] is not None and step["p99_ms"] > args.max_p99:
+            print("p99 above %.0f ms at %d cameras" % (args.max_p99, cameras))
+            break
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"url": url, "fps_per_camera": args.fps, "duration": args.duration, "steps": steps}, f,
+                      indent=2)
+        print("Results written to %s" % args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# metrics.py
+"""
+Process metrics in the Prometheus text format.
+
+Stage timers wrap the hot paths (frame decoding, detection, recognition,
+training, Supabase calls) and feed latency histograms; counters and gauges
+track frames, faces, recognitions, retrains, gallery size and model version.
+app.py serves render() on /metrics. Between begin_timings() and
+end_timings() the stages of the calling thread are also collected one by
+one, for the Server-Timing header of a single response.
+
+Every metric has its own lock that is held only to update or copy a few
+numbers, so a scrape never blocks the frame pipeline for long. With several
+gunicorn workers each process reports its own values.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PREFIX = 'cds_'
+# Latency buckets in seconds, from a cached-track lookup to a full retrain
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+# Stage timings of the request running on this thread, if collected
+_local = threading.local()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join('%s="%s"' % kv for kv in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s expects labels %s" % (self.name, self.labelnames))
+        return tuple(str(v) for v in labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return [(k, self._copy(v)) for k, v in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        for labels, value in sorted(self._snapshot()):
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return ['%s%s %s' % (self.name, _format_labels(self.labelnames, labels), _format_value(value))]
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. frames received."""
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. gallery size."""
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. stage latency in seconds."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _render_value(self, labels, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append('%s_bucket%s %d' % (self.name, _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))]), cumulative))
+        lines.append('%s_bucket%s %d' % (self.name, _format_labels(self.labelnames, labels, [('le', '+Inf')]), count))
+        lines.append('%s_sum%s %s' % (self.name, _format_labels(self.labelnames, labels), repr(total)))
+        lines.append('%s_count%s %d' % (self.name, _format_labels(self.labelnames, labels), count))
+        return lines
+
+
+def render():
+    """
+    Render every metric of the process.
+
+    Returns:
+    - Prometheus text exposition format (version 0.0.4)
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ---------- Metrics of the recognition pipeline ----------
+stage_seconds = Histogram('stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+request_seconds = Histogram('request_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+frames_total = Counter('frames_total', 'Frames received for recognition', ['source'])
+faces_total = Counter('faces_detected_total', 'Faces found by the detector', ['source'])
+recognitions_total = Counter('recognitions_total', 'Faces recognized as a registered criminal', ['source'])
+retrains_total = Counter('retrains_total', 'Model builds by kind', ['kind'])
+errors_total = Counter('errors_total', 'Failures by stage', ['stage'])
+gallery_samples = Gauge('gallery_samples', 'Training samples in the live model')
+gallery_identities = Gauge('gallery_identities', 'Identities in the live model')
+model_version = Gauge('model_version', 'Version of the live model (increments on every swap)')
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of code into stage_seconds.
+
+    Args:
+    - name: Stage label, e.g. "imdecode" or "detect_faces"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, name)
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def timed(name):
+    """
+    Decorator form of stage().
+
+    Args:
+    - name: Stage label
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def begin_timings():
+    """
+    Start collecting the stage timings of the calling thread.
+
+    Stages that run on pool threads (tiled detection, crowd chunks) are only
+    counted through the stage that waits for them.
+    """
+    _local.timings = []
+
+
+def end_timings():
+    """
+    Stop collecting stage timings on the calling thread.
+
+    Returns:
+    - Dictionary of stage name to total seconds, in the order the stages first ran
+    """
+    timings, _local.timings = getattr(_local, 'timings', None) or [], None
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+def server_timing(timings, total=None):
+    """
+    Format stage timings as a Server-Timing header value.
+
+    Args:
+    - timings: Dictionary from end_timings()
+    - total: Whole request time in seconds, or None
+
+    Returns:
+    - Header value such as "imdecode;dur=3.1, detect_faces;dur=41.7, total;dur=47.0"
+    """
+    entries = list(timings.items())
+    if total is not None:
+        entries.append(('total', total))
+    return ', '.join('%s;dur=%.2f' % (name, seconds * 1000.0) for name, seconds in entries)
@@ -0,0 +1,277 @@
+# model_registry.py
+"""
+Process-wide registry for the face recognition model.
+
+All Flask request threads and the desktop pages read the current model from
+here. Retraining runs on a background thread and the new model is swapped in
+with a single assignment, so requests already in flight keep the snapshot they
+started with and never wait on a retrain.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import facerec
+import metrics
+import shared_gallery
+from config import SHARED_GALLERY
+from gallery import packed_gallery
+
+# One immutable view of the model; replaced as a whole on every swap
+ModelSnapshot = namedtuple('ModelSnapshot', ['model', 'names', 'version', 'trained_at', 'fingerprint'])
+
+# Seconds between checks of the face_samples fingerprint from request threads
+CHECK_INTERVAL = 5.0
+
+
+class ModelRegistry:
+    def __init__(self, fn_dir='face_samples'):
+        self.fn_dir = fn_dir
+        self._snapshot = None
+        self._version = 0
+        self._swap_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._retrain_thread = None
+        self._retrain_again = False
+        # Strongest mode asked for while a retrain was running: a full request wins
+        self._retrain_full = False
+        self._last_check = 0.0
+        self.last_error = None
+
+    def current(self):
+        """
+        Get the current model snapshot.
+
+        Only the very first call (when nothing is loaded yet) blocks on
+        loading; afterwards this just returns the live snapshot.
+
+        Returns:
+        - ModelSnapshot with model, names, version, trained_at and fingerprint
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._load_lock:
+            if self._snapshot is None:
+                fingerprint = facerec.gallery_fingerprint(self.fn_dir)
+                model, names = self._load(fingerprint)
+                self._swap(model, names, fingerprint)
+        return self._snapshot
+
+    def get(self):
+        """
+        Get the current snapshot, scheduling a background retrain if face_samples changed.
+
+        Returns:
+        - ModelSnapshot; use .model and .names for recognize_face
+        """
+        snapshot = self.current()
+        self.check_for_changes()
+        return snapshot
+
+    def check_for_changes(self, force=False):
+        """
+        Start a background retrain if the face samples no longer match the model.
+
+        The check walks face_samples, so request threads only run it every
+        CHECK_INTERVAL seconds unless force is set.
+
+        Args:
+        - force: Check now regardless of when the last check ran
+
+        Returns:
+        - True if a retrain was scheduled
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < CHECK_INTERVAL:
+            return False
+        self._last_check = now
+        snapshot = self._snapshot
+        if snapshot is not None and facerec.gallery_fingerprint(self.fn_dir) == snapshot.fingerprint:
+            return False
+        self.retrain_async()
+        return True
+
+    def retrain_async(self, full=False):
+        """
+        Retrain on a background thread and swap the result in when done.
+
+        If a retrain is already running, another one is queued to start after
+        it, so samples added mid-train are not missed. The queued one is full
+        if any request made while waiting asked for a full retrain.
+
+        Args:
+        - full: Ignore the saved artifact and train from the images
+        """
+        with self._swap_lock:
+            if self._retrain_thread is not None:
+                self._retrain_again = True
+                self._retrain_full = self._retrain_full or full
+                return
+            self._retrain_thread = threading.Thread(target=self._retrain_loop, args=(full,))
+            self._retrain_thread.daemon = True
+            self._retrain_thread.start()
+
+    def retrain(self, full=False):
+        """
+        Retrain on the calling thread and swap the result in.
+
+        Args:
+        - full: Ignore the saved artifact and train from the images
+
+        Returns:
+        - The new ModelSnapshot
+        """
+        fingerprint = facerec.gallery_fingerprint(self.fn_dir)
+        snapshot = self._snapshot
+        if not full and snapshot is not None and snapshot.fingerprint == fingerprint:
+            return snapshot
+        model, names = self._load(fingerprint, full)
+        return self._swap(model, names, fingerprint)
+
+    def add_identity(self, name):
+        """
+        Add a newly registered subject to the live model without a full retrain.
+
+        Only the new subject's samples are read (from the packed gallery, or
+        face_samples/<name> if it is not packed); they are trained into a new
+        segment with LBPHFaceRecognizer.update() and the extended model is
+        swapped in. If the name is already known its old samples would stay
+        in the model, so a full rebuild is scheduled instead.
+
+        Args:
+        - name: Sub-directory of face_samples holding the new samples
+
+        Returns:
+        - The new ModelSnapshot, or None if a rebuild was scheduled instead
+        """
+        with self._update_lock:
+            snapshot = self.current()
+            if name in snapshot.names.values():
+                self.retrain_async(full=True)
+                return None
+            label, images = packed_gallery.subject(name)
+            if label is None or label in snapshot.names:
+                label = max(snapshot.names) + 1 if snapshot.names else 0
+                images = facerec.load_subject_images(os.path.join(self.fn_dir, name))
+            if len(images) == 0:
+                return None
+
+            with metrics.stage('train_segment'):
+                segment = facerec.train_segment(images, [label] * len(images))
+            metrics.retrains_total.inc('incremental')
+            model = facerec.add_segment(snapshot.model, segment)
+            names = dict(snapshot.names)
+            names[label] = name
+            fingerprint = facerec.gallery_fingerprint(self.fn_dir)
+            try:
+                facerec.save_segment(segment, names, fingerprint, snapshot.fingerprint, snapshot.trained_at)
+            except Exception as e:
+                print("Could not save model artifact: %s" % str(e))
+            if SHARED_GALLERY and isinstance(model, facerec.HistogramMatcher):
+                with shared_gallery.lock():
+                    model = shared_gallery.publish(model, names, fingerprint)
+            print("Added %s with %d samples" % (name, len(images)))
+            return self._swap(model, names, fingerprint)
+
+    def compact(self):
+        """
+        Schedule a full rebuild that merges incrementally added segments
+        (LBPH segments and matcher segments alike) into one gallery.
+        """
+        self.retrain_async(full=True)
+
+    def is_retraining(self):
+        return self._retrain_thread is not None
+
+    def info(self):
+        """
+        Describe the live model so operators can tell which gallery produced a result.
+
+        Returns:
+        - Dictionary with version, trained_at, fingerprint, identities and retraining
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"version": 0, "trained_at": None, "fingerprint": None,
+                    "identities": 0, "retraining": self.is_retraining(), "error": self.last_error}
+        return {
+            "version": snapshot.version,
+            "trained_at": snapshot.trained_at,
+            "fingerprint": snapshot.fingerprint,
+            "identities": len(snapshot.names),
+            "retraining": self.is_retraining(),
+            "error": self.last_error,
+        }
+
+    def _retrain_loop(self, full):
+        while True:
+            try:
+                self.retrain(full)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                metrics.errors_total.inc('retrain')
+                print("Background retrain failed: %s" % str(e))
+            with self._swap_lock:
+                if not self._retrain_again:
+                    self._retrain_thread = None
+                    return
+                full, self._retrain_full = self._retrain_full, False
+                self._retrain_again = False
+
+    def _load(self, fingerprint, full=False):
+        # Build the serving engine for the current face samples. Matcher engines
+        # are published to shared_gallery once and mapped by every worker.
+        engine = facerec.matcher_class()
+        if engine is None or not SHARED_GALLERY:
+            return self._build(full)
+        # Parts of the gallery this worker already maps are kept; only new segments are mapped
+        current = self._snapshot.model if self._snapshot is not None else None
+        if not full:
+            attached = shared_gallery.attach(fingerprint, engine, current)
+            if attached is not None:
+                return attached
+        with shared_gallery.lock():
+            if not full:
+                # Another worker may have published while we waited for the lock
+                attached = shared_gallery.attach(fingerprint, engine, current)
+                if attached is not None:
+                    return attached
+            model, names = self._build(full)
+            return shared_gallery.publish(model, names, fingerprint), names
+
+    def _build(self, full):
+        if full:
+            fingerprint = facerec.gallery_fingerprint(self.fn_dir)
+            model, names = facerec.train_model(self.fn_dir)
+            facerec.save_model(model, names, fingerprint)
+        else:
+            model, names = facerec.load_model(self.fn_dir)
+        return facerec.make_recognizer(model), names
+
+    def _swap(self, model, names, fingerprint):
+        meta = facerec.read_model_meta(fingerprint)
+        trained_at = meta['trained_at'] if meta else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._swap_lock:
+            self._version += 1
+            snapshot = ModelSnapshot(model, dict(names), self._version, trained_at, fingerprint)
+            self._snapshot = snapshot
+        metrics.model_version.set(snapshot.version)
+        metrics.gallery_identities.set(len(snapshot.names))
+        metrics.gallery_samples.set(_sample_count(model))
+        print("Model version %d active (%d identities)" % (snapshot.version, len(snapshot.names)))
+        return snapshot
+
+
+def _sample_count(model):
+    # NumPy matchers count their segments too; LBPH exposes getLabels()
+    if isinstance(model, facerec.HistogramMatcher):
+        return model.sample_count()
+    return len(model.getLabels())
+
+
+registry = ModelRegistry()
@@ -0,0 +1,139 @@
+# motion.py
+"""
+Motion gating for video feeds.
+
+Before the Haar cascade runs, each frame is shrunk to a thumbnail and compared
+with the thumbnail of the last frame that was actually processed. If too few
+pixels changed, detection and recognition are skipped and the previous result
+is reused. A frame is still processed every MOTION_MAX_SKIP_SECONDS so a
+static scene picks up a retrained model.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from config import MOTION_GATE, MOTION_MAX_SKIP_SECONDS, MOTION_MIN_CHANGED, MOTION_PIXEL_THRESHOLD
+
+# Width of the thumbnail frames are compared on
+THUMB_WIDTH = 80
+# HTTP clients (one gate each) remembered before the least recently used is dropped
+MAX_CLIENTS = 64
+
+_totals_lock = threading.Lock()
+_totals = {"processed": 0, "skipped": 0}
+
+
+def _count(key):
+    with _totals_lock:
+        _totals[key] += 1
+
+
+def totals():
+    """
+    Frames processed and skipped by all gates of this process.
+
+    Returns:
+    - Dictionary with processed, skipped and skip_ratio
+    """
+    with _totals_lock:
+        processed, skipped = _totals["processed"], _totals["skipped"]
+    seen = processed + skipped
+    return {"processed": processed, "skipped": skipped,
+            "skip_ratio": round(skipped / seen, 3) if seen else 0.0}
+
+
+class MotionGate:
+    """
+    Change detector for one video feed.
+
+    Usage: if gate.skip(gray): reuse gate.result, else process and call gate.remember(result).
+
+    Args:
+    - pixel_threshold: Grey-level difference that counts a pixel as changed
+    - min_changed: Fraction of changed pixels that counts the frame as changed
+    - max_skip_seconds: Longest time a result is reused without processing a frame
+    - enabled: False processes every frame (the counters still run)
+    """
+    def __init__(self, pixel_threshold=MOTION_PIXEL_THRESHOLD, min_changed=MOTION_MIN_CHANGED,
+                 max_skip_seconds=MOTION_MAX_SKIP_SECONDS, enabled=MOTION_GATE):
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.max_skip_seconds = max_skip_seconds
+        self.enabled = enabled
+        self.result = None
+        self.processed = 0
+        self.skipped = 0
+        self._reference = None
+        self._processed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _thumbnail(self, gray_frame):
+        height, width = gray_frame.shape[:2]
+        thumb_height = max(1, int(round(height * THUMB_WIDTH / float(width))))
+        return cv2.resize(gray_frame, (THUMB_WIDTH, thumb_height), interpolation=cv2.INTER_AREA)
+
+    def skip(self, gray_frame):
+        """
+        Decide whether a frame can reuse the previous result.
+
+        A frame that is not skipped becomes the new reference.
+
+        Args:
+        - gray_frame: Grayscale frame (any resolution)
+
+        Returns:
+        - True if nothing changed and self.result can be reused
+        """
+        thumb = self._thumbnail(gray_frame)
+        with self._lock:
+            reference = self._reference
+            now = time.monotonic()
+            if (self.enabled and self.result is not None and reference is not None
+                    and reference.shape == thumb.shape and now - self._processed_at < self.max_skip_seconds):
+                changed = np.count_nonzero(cv2.absdiff(thumb, reference) > self.pixel_threshold)
+                if changed < self.min_changed * thumb.size:
+                    self.skipped += 1
+                    _count("skipped")
+                    return True
+            self._reference = thumb
+            self._processed_at = now
+            self.processed += 1
+        _count("processed")
+        return False
+
+    def remember(self, result):
+        """Store the result of the frame that was just processed."""
+        with self._lock:
+            self.result = result
+
+    def stats(self):
+        return {"processed": self.processed, "skipped": self.skipped}
+
+
+class ClientStates:
+    """
+    Per-feed state (a MotionGate, a FaceTracker...) for each client of a
+    stateless endpoint, least recently used dropped first.
+
+    Args:
+    - factory: Called to create the state of a new client
+    - limit: Clients remembered
+    """
+    def __init__(self, factory=MotionGate, limit=MAX_CLIENTS):
+        self.factory = factory
+        self.limit = limit
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            state = self._states.pop(key, None)
+            if state is None:
+                state = self.factory()
+            self._states[key] = state
+            while len(self._states) > self.limit:
+                self._states.popitem(last=False)
+            return state
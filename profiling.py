@@ -0,0 +1,113 @@
+# profiling.py
+"""
+On-demand profiling of web requests.
+
+An admin arms the profiler for the next N requests to one endpoint; each of
+those requests runs under cProfile and its stats are written to
+PROFILE_DIR/<endpoint>-<timestamp>-<n>.prof, to be opened offline with
+pstats or snakeviz. Only one request is profiled at a time (cProfile can't
+profile two threads at once on newer Pythons); matching requests that arrive
+while one is being profiled run normally and don't use up the count.
+"""
+import cProfile
+import os
+import threading
+from datetime import datetime
+
+from config import PROFILE_DIR
+
+
+class RequestProfiler:
+    """
+    Profiles the next few requests to a chosen endpoint.
+
+    Args:
+    - out_dir: Directory the .prof files are written to
+    """
+    def __init__(self, out_dir=PROFILE_DIR):
+        self.out_dir = out_dir
+        self.endpoint = None
+        self.remaining = 0
+        self.saved = []
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def arm(self, endpoint, count):
+        """
+        Profile the next requests to an endpoint.
+
+        Args:
+        - endpoint: Flask endpoint name (e.g. "api_recognize_frame") or URL path
+        - count: Number of requests to profile; 0 disarms
+
+        Returns:
+        - Status dictionary, as from status()
+        """
+        with self._lock:
+            self.endpoint = endpoint if count > 0 else None
+            self.remaining = max(0, count)
+        return self.status()
+
+    def status(self):
+        with self._lock:
+            return {"endpoint": self.endpoint, "remaining": self.remaining, "saved": list(self.saved[-20:])}
+
+    def start(self, endpoint, path):
+        """
+        Begin profiling the current request if it is one of the armed ones.
+
+        Args:
+        - endpoint: Flask endpoint of the request
+        - path: URL path of the request
+
+        Returns:
+        - Running cProfile.Profile to pass to stop(), or None
+        """
+        with self._lock:
+            if not self.remaining or self.endpoint not in (endpoint, path):
+                return None
+            if not self._active.acquire(blocking=False):
+                return None
+            self.remaining -= 1
+            if not self.remaining:
+                self.endpoint = None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) owns the hook
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile, endpoint):
+        """
+        Finish a profile from start() and write it to disk.
+
+        Args:
+        - profile: Profile returned by start()
+        - endpoint: Endpoint name used in the file name
+
+        Returns:
+        - Path of the .prof file, or None if it could not be written
+        """
+        profile.disable()
+        self._active.release()
+        os.makedirs(self.out_dir, exist_ok=True)
+        with self._lock:
+            number = len(self.saved) + 1
+        filename = "%s-%s-%d.prof" % ((endpoint or "unmatched").replace("/", "_"),
+                                      datetime.now().strftime("%Y%m%d-%H%M%S"), number)
+        path = os.path.join(self.out_dir, filename)
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            print("Could not save profile %s: %s" % (path, str(e)))
+            return None
+        with self._lock:
+            self.saved.append(filename)
+        print("Saved request profile %s" % path)
+        return path
+
+
+profiler = RequestProfiler()
@@ -1,9 +1,26 @@
 # register.py
+import os
+import shutil
 import cv2
-from facerec import detect_faces
+from facerec import detect_faces, gallery_fingerprint
+from gallery import packed_gallery
 
-def registerCriminal(img, path, img_num):
-    size = 2
+def registerCriminal(img, path, img_num, gallery=packed_gallery):
+    """
+    Save the largest face of an image (and its mirror) as training samples.
+
+    Samples are written as PNGs under path and appended to the packed gallery
+    under the folder name, so training never has to decode them again.
+
+    Args:
+    - img: BGR image
+    - path: Folder collecting the subject's samples
+    - img_num: 1-based number of the image
+    - gallery: Packed gallery to append to, or None to only write PNGs
+
+    Returns:
+    - img_num if no face was found, otherwise None
+    """
     (im_width, im_height) = (112, 92)
     file_num = 2*img_num - 1
 
@@ -14,7 +31,7 @@ def registerCriminal(img, path, img_num):
         # Taking the largest face detected
         faces = sorted(faces, key=lambda x: x[3], reverse=True)  # sort based on height of image
         face_i = faces[0]
-        (x, y, w, h) = [v * size for v in face_i]
+        (x, y, w, h) = [int(v) for v in face_i]
 
         face = gray[y:y + h, x:x + w]
         face = cv2.resize(face, (im_width, im_height))
@@ -26,12 +43,45 @@ def registerCriminal(img, path, img_num):
 
         # Save flipped image
         print("Saving training sample " + str(img_num)+".2")
-        face = cv2.flip(face, 1, 0)
-        cv2.imwrite('%s/%s.png' % (path, file_num), face)
+        flipped = cv2.flip(face, 1, 0)
+        cv2.imwrite('%s/%s.png' % (path, file_num), flipped)
+
+        if gallery is not None:
+            gallery.append(os.path.basename(os.path.normpath(path)), [face, flipped])
 
     else:
         # No face present
         print("img %d : Face is not present" % (img_num))
         return img_num
 
-    return None
\ No newline at end of file
+    return None
+
+def commitRegistration(path, name, fn_dir='face_samples', gallery=packed_gallery):
+    """
+    Move staged samples to face_samples/<name> and rename them in the packed gallery.
+
+    Args:
+    - path: Staging folder passed to registerCriminal
+    - name: Subject name
+    - fn_dir: Directory containing one sub-directory per subject
+    - gallery: Packed gallery the samples were appended to
+    """
+    dest_dir = os.path.join(fn_dir, name)
+    base_fingerprint = gallery_fingerprint(fn_dir)
+    if os.path.exists(dest_dir):
+        shutil.rmtree(dest_dir, ignore_errors=True)
+    shutil.move(path, dest_dir)
+    if gallery is not None:
+        gallery.rename(os.path.basename(os.path.normpath(path)), name, gallery_fingerprint(fn_dir), base_fingerprint)
+
+def discardRegistration(path, gallery=packed_gallery):
+    """
+    Delete staged samples of a failed registration.
+
+    Args:
+    - path: Staging folder passed to registerCriminal
+    - gallery: Packed gallery the samples were appended to
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    if gallery is not None:
+        gallery.remove(os.path.basename(os.path.normpath(path)))
@@ -0,0 +1,185 @@
+# shared_gallery.py
+"""
+Gallery shared read-only between worker processes.
+
+The matcher arrays (quantized histograms, scales, sums, labels) and the names
+table are published once per model generation as .npy files under
+model_cache/shared/gen-<n>/. Every gunicorn worker memory-maps them read-only,
+so the gallery pages live once in the OS page cache instead of once per
+worker. Publishing a new generation (after a retrain or a registration) never
+touches files that other workers have mapped.
+
+A generation is a list of parts: the base gallery and one part per identity
+registered since (the matcher's segments). A registration writes only its own
+part and lists the earlier ones, and workers that already map those parts
+keep them, so the cost follows the new samples rather than the gallery size.
+"""
+import copy
+import json
+import os
+import shutil
+
+import numpy as np
+
+from facerec import MODEL_DIR, HistogramMatcher
+from gallery import file_lock
+
+SHARED_DIR = os.path.join(MODEL_DIR, 'shared')
+CURRENT_FILE = 'CURRENT'
+# Older generations may still be mapped by workers that haven't swapped yet
+KEEP_GENERATIONS = 3
+# Training a large gallery under the lock can take a while
+TRAIN_LOCK_SECONDS = 900
+ARRAYS = ('histograms_t', 'scales', 'sums', 'labels')
+
+
+def _path(*parts):
+    return os.path.join(SHARED_DIR, *parts)
+
+
+def lock():
+    """
+    Cross-process lock held while a worker trains and publishes, so the others
+    wait and map its result instead of training the same gallery again.
+    """
+    return file_lock(_path('publish.lock'), stale_after=TRAIN_LOCK_SECONDS)
+
+
+def current_generation():
+    """
+    Read the metadata of the generation currently published.
+
+    Returns:
+    - Dictionary with generation, fingerprint, dtype, names, dir and parts, or None
+    """
+    try:
+        with open(_path(CURRENT_FILE), 'r', encoding='utf-8') as f:
+            gen_dir = f.read().strip()
+        with open(_path(gen_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    meta['dir'] = gen_dir
+    # Generations written before parts existed hold one part, in their own directory
+    meta.setdefault('parts', [gen_dir])
+    return meta
+
+
+def publish(matcher, names, fingerprint):
+    """
+    Write a matcher's gallery as a new shared generation and make it current.
+
+    Args:
+    - matcher: HistogramMatcher (or subclass) to publish
+    - names: Dictionary containing subject names
+    - fingerprint: Fingerprint of the face samples the gallery was built from
+
+    Returns:
+    - Matcher of the same class backed by the published, memory-mapped files
+    """
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    current = current_generation()
+    generation = current['generation'] + 1 if current else 1
+    gen_dir = 'gen-%d' % generation
+    tmp_dir = _path(gen_dir + '.tmp%d' % os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    # Parts already on disk (mapped from an earlier generation) are listed, not written again
+    parts, written = [], []
+    for i, block in enumerate([matcher] + matcher.segments):
+        if block.shared_part and os.path.isdir(_path(block.shared_part)):
+            parts.append(block.shared_part)
+            continue
+        part = 'part-%d' % i
+        os.makedirs(os.path.join(tmp_dir, part))
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_dir, part, name + '.npy'), np.ascontiguousarray(getattr(block, name)))
+        parts.append(gen_dir + '/' + part)
+        written.append((block, parts[-1]))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'generation': generation,
+            'fingerprint': fingerprint,
+            'engine': type(matcher).__name__,
+            'dtype': str(matcher.histograms_t.dtype),
+            'names': {str(k): v for k, v in names.items()},
+            'parts': parts,
+        }, f, indent=2)
+    os.replace(tmp_dir, _path(gen_dir))
+
+    tmp_current = _path(CURRENT_FILE + '.tmp%d' % os.getpid())
+    with open(tmp_current, 'w', encoding='utf-8') as f:
+        f.write(gen_dir)
+    os.replace(tmp_current, _path(CURRENT_FILE))
+    print("Published shared gallery generation %d (%d of %d parts written)" % (generation, len(written), len(parts)))
+
+    _remove_old_generations(generation, parts)
+    if written and written[0][0] is matcher:
+        # New base gallery: serve it from the mapped files like the other workers do
+        return attach(fingerprint, type(matcher))[0]
+    # Only new segments were written; the in-memory ones are small
+    for block, part in written:
+        block.shared_part = part
+    return matcher
+
+
+def _map_part(part):
+    arrays = {name: np.load(_path(part, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+    return arrays['histograms_t'], arrays['scales'], arrays['labels'], arrays['sums']
+
+
+def attach(fingerprint, engine=HistogramMatcher, current=None):
+    """
+    Map the current generation read-only if it was built from the given face samples.
+
+    Args:
+    - fingerprint: Fingerprint of the face samples tree
+    - engine: Matcher class to build around the mapped arrays
+    - current: Matcher in use; its base and segments are reused where they
+      are the same parts, so only newly registered segments are mapped
+
+    Returns:
+    - Tuple containing matcher and names, or None if nothing matching is published
+    """
+    meta = current_generation()
+    if meta is None or meta.get('fingerprint') != fingerprint or meta.get('engine') != engine.__name__:
+        return None
+    parts = meta['parts']
+    reusable = []
+    if type(current) is engine and current.shared_part == parts[0]:
+        reusable = [current] + current.segments
+    try:
+        if reusable:
+            matcher = copy.copy(current)
+        else:
+            matcher = engine.from_arrays(*_map_part(parts[0]))
+            matcher.shared_part = parts[0]
+        segments = []
+        for i, part in enumerate(parts[1:], 1):
+            if i < len(reusable) and reusable[i].shared_part == part:
+                segments.append(reusable[i])
+                continue
+            segment = matcher._segment(HistogramMatcher.from_arrays(*_map_part(part)))
+            segment.shared_part = part
+            segments.append(segment)
+    except (OSError, ValueError) as e:
+        print("Could not map shared gallery: %s" % str(e))
+        return None
+    matcher.segments = segments
+    names = {int(k): v for k, v in meta['names'].items()}
+    return matcher, names
+
+
+def _remove_old_generations(generation, parts):
+    # Directories holding parts of the current generation are kept however old
+    in_use = set(part.split('/', 1)[0] for part in parts)
+    for entry in os.listdir(SHARED_DIR):
+        if not entry.startswith('gen-'):
+            continue
+        try:
+            number = int(entry[4:].split('.', 1)[0])
+        except ValueError:
+            continue
+        if number <= generation - KEEP_GENERATIONS and entry not in in_use:
+            # Mapped files stay readable on POSIX after removal; on Windows this may fail and is retried next time
+            shutil.rmtree(_path(entry), ignore_errors=True)
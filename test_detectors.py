@@ -0,0 +1,57 @@
+"""
+Tests for tiled detection helpers: run with python -m pytest test_detectors.py
+"""
+import numpy as np
+import pytest
+
+from detectors import DEFAULT_PROFILE, checked_profile, non_max_suppression, tile_origins
+
+
+def test_tile_origins_cover_the_frame():
+    origins = tile_origins(3840, 640, 160)
+    assert origins[0] == 0
+    assert origins[-1] == 3840 - 640
+    # Consecutive tiles overlap by at least the requested amount
+    assert all(b - a <= 640 - 160 for a, b in zip(origins, origins[1:]))
+    assert origins == sorted(set(origins))
+
+
+def test_tile_origins_small_frame_is_one_tile():
+    assert tile_origins(480, 640, 160) == [0]
+    assert tile_origins(640, 640, 160) == [0]
+
+
+def test_tile_origins_reject_overlap_of_a_whole_tile():
+    with pytest.raises(ValueError):
+        tile_origins(3840, 128, 128)
+    with pytest.raises(ValueError):
+        tile_origins(3840, 128, 160)
+
+
+def test_profile_overlap_clamped_to_half_a_tile():
+    profile = checked_profile(DEFAULT_PROFILE._replace(tile=128, tile_overlap=160))
+    assert profile.tile_overlap == 64
+    # 4K frame: a handful of tiles, not thousands
+    assert len(tile_origins(3840, profile.tile, profile.tile_overlap)) < 80
+    untiled = DEFAULT_PROFILE._replace(tile=0, tile_overlap=160)
+    assert checked_profile(untiled) == untiled
+
+
+def test_non_max_suppression_merges_duplicates():
+    boxes = np.array([[100, 100, 50, 50], [102, 101, 50, 50], [400, 400, 60, 60]])
+    kept = non_max_suppression(boxes)
+    assert kept.dtype == np.int32
+    assert kept.tolist() == [[100, 100, 50, 50], [400, 400, 60, 60]]
+
+
+def test_non_max_suppression_drops_face_cut_by_tile_edge():
+    # The cut-off half of a face lies inside the whole face found in the next tile
+    whole, cut = [300, 200, 80, 80], [340, 200, 40, 80]
+    assert non_max_suppression(np.array([cut, whole])).tolist() == [whole]
+
+
+def test_non_max_suppression_keeps_separate_faces():
+    boxes = np.array([[0, 0, 40, 40], [30, 0, 40, 40]])
+    # Overlap is 10/40 of the smaller box, below the default threshold
+    assert len(non_max_suppression(boxes)) == 2
+    assert len(non_max_suppression(np.empty((0, 4)))) == 0
@@ -0,0 +1,53 @@
+"""
+Tests for the face tracker: run with python -m pytest test_tracker.py
+"""
+import threading
+import time
+
+import numpy as np
+
+from crowd import CrowdRecognizer
+from tracker import FaceTracker
+
+BOXES = [(10, 10, 60, 60), (200, 40, 80, 80), (400, 100, 70, 70)]
+
+
+class SlowModel:
+    # Recognizer stand-in that yields the GIL mid-frame, as LBPH does
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, face):
+        self.calls += 1
+        time.sleep(0.001)
+        return 0, 10.0
+
+
+def test_match_from_two_threads():
+    tracker = FaceTracker(refresh_seconds=3600, crowd=CrowdRecognizer(min_faces=10 ** 6))
+    model = SlowModel()
+    gray = np.zeros((240, 640), dtype=np.uint8)
+    results, errors = [], []
+
+    def feed():
+        try:
+            for _ in range(100):
+                results.append(tracker.match(model, gray, BOXES, {0: "subject"}))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=feed) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    # Every frame continues the same three tracks, recognized once each
+    assert len(tracker.tracks) == len(BOXES)
+    track_ids = {tuple(match.track_id for match in matches) for matches in results}
+    assert len(track_ids) == 1
+    assert model.calls == len(BOXES)
+    stats = tracker.stats()
+    assert stats["recognized"] + stats["reused"] == 200 * len(BOXES)
+    assert all(match.name == "subject" for matches in results for match in matches)
@@ -0,0 +1,202 @@
+# tracker.py
+"""
+Face tracking between frames.
+
+Boxes from detect_faces are associated with the tracks of the previous frame
+by overlap (IoU), falling back to centroid distance for faces that moved
+further than their own size between frames. Each track caches the identity
+LBPH gave it, so recognition only runs for new tracks and, per track, once
+every TRACK_REFRESH_SECONDS. Crowded frames go through crowd.CrowdRecognizer,
+and faces it defers stay due for recognition on the next frame.
+"""
+import itertools
+import threading
+import time
+
+from config import TRACK_MAX_MISSED, TRACK_MIN_IOU, TRACK_REFRESH_SECONDS
+from crowd import CrowdRecognizer, face_quality
+from facerec import FaceMatch, crop_faces, predict_faces, to_match
+
+_totals_lock = threading.Lock()
+_totals = {"recognized": 0, "reused": 0, "deferred": 0}
+# Track IDs are unique across all trackers of the process
+_track_ids = itertools.count(1)
+
+
+def totals():
+    """
+    Faces recognized and faces served from a track's cached identity, for this process.
+
+    Returns:
+    - Dictionary with recognized, reused, deferred (crowd budget) and reuse_ratio
+    """
+    with _totals_lock:
+        recognized, reused, deferred = _totals["recognized"], _totals["reused"], _totals["deferred"]
+    seen = recognized + reused
+    return {"recognized": recognized, "reused": reused, "deferred": deferred,
+            "reuse_ratio": round(reused / seen, 3) if seen else 0.0}
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def _centroid_close(a, b):
+    # Centres closer than the larger box's width: the same face after a fast move
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2.0) - (bx + bw / 2.0)
+    dy = (ay + ah / 2.0) - (by + bh / 2.0)
+    return dx * dx + dy * dy < max(aw, bw) ** 2
+
+
+class Track:
+    def __init__(self, box):
+        self.id = next(_track_ids)
+        self.box = box
+        self.name = None
+        self.confidence = None
+        self.recognized_at = None
+        self.missed = 0
+
+
+class FaceTracker:
+    """
+    Tracks faces of one video feed and caches their identities.
+
+    Args:
+    - refresh_seconds: Age after which a track's identity is recognized again
+    - min_iou: Minimum overlap that continues a track
+    - max_missed: Frames a track is kept without a matching detection
+    - crowd: CrowdRecognizer for frames with many faces due, or None to always recognize inline
+    """
+    def __init__(self, refresh_seconds=TRACK_REFRESH_SECONDS, min_iou=TRACK_MIN_IOU, max_missed=TRACK_MAX_MISSED,
+                 crowd=None):
+        self.refresh_seconds = refresh_seconds
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.crowd = crowd if crowd is not None else CrowdRecognizer()
+        self.tracks = []
+        self.recognized = 0
+        self.reused = 0
+        self.deferred = 0
+        self._model = None
+        # One frame at a time: HTTP clients can have several frames in flight
+        self._lock = threading.RLock()
+
+    def update(self, boxes):
+        """
+        Associate detected boxes with existing tracks.
+
+        Args:
+        - boxes: List of (x, y, w, h) boxes in frame coordinates
+
+        Returns:
+        - List of Track objects, one per box and in the same order
+        """
+        with self._lock:
+            return self._update(boxes)
+
+    def _update(self, boxes):
+        pairs = sorted(((iou(track.box, box), t, b) for t, track in enumerate(self.tracks)
+                        for b, box in enumerate(boxes)), reverse=True)
+        assigned = [None] * len(boxes)
+        used = set()
+        for overlap, t, b in pairs:
+            if overlap < self.min_iou:
+                break
+            if t not in used and assigned[b] is None:
+                assigned[b] = self.tracks[t]
+                used.add(t)
+        for b, box in enumerate(boxes):
+            if assigned[b] is not None:
+                continue
+            for t, track in enumerate(self.tracks):
+                if t not in used and _centroid_close(track.box, box):
+                    assigned[b] = track
+                    used.add(t)
+                    break
+
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t not in used:
+                track.missed += 1
+                if track.missed <= self.max_missed:
+                    kept.append(track)
+        for b, box in enumerate(boxes):
+            track = assigned[b]
+            if track is None:
+                track = assigned[b] = Track(box)
+            track.box = box
+            track.missed = 0
+            kept.append(track)
+        self.tracks = kept
+        return assigned
+
+    def match(self, model, gray_frame, face_coords, names):
+        """
+        Tracked version of facerec.match_faces.
+
+        Only faces on new tracks, or on tracks whose identity is older than
+        refresh_seconds, are passed to the recognizer; the others reuse the
+        identity cached on their track. A new model invalidates all caches.
+
+        Args:
+        - model, gray_frame, face_coords, names: As for facerec.match_faces
+
+        Returns:
+        - List of FaceMatch tuples carrying track IDs
+        """
+        with self._lock:
+            return self._match(model, gray_frame, face_coords, names)
+
+    def _match(self, model, gray_frame, face_coords, names):
+        if model is not self._model:
+            self._model = model
+            for track in self.tracks:
+                track.recognized_at = None
+        boxes = [tuple(int(v) for v in face_coord) for face_coord in face_coords]
+        tracks = self._update(boxes)
+
+        now = time.monotonic()
+        stale = [i for i, track in enumerate(tracks)
+                 if track.recognized_at is None or now - track.recognized_at >= self.refresh_seconds]
+        deferred = 0
+        if stale:
+            stale_boxes, faces = crop_faces(gray_frame, [face_coords[i] for i in stale])
+            if self.crowd.applies(len(stale)):
+                # Never-recognized faces first, then larger and sharper ones
+                priorities = [(tracks[i].recognized_at is None, box[2] * box[3] * face_quality(face))
+                              for i, box, face in zip(stale, stale_boxes, faces)]
+                predictions = self.crowd.recognize(model, faces, priorities)
+            else:
+                predictions = predict_faces(model, faces)
+            for i, box, prediction in zip(stale, stale_boxes, predictions):
+                if prediction is None:
+                    # Deferred: keeps its cached identity (if any) and stays due
+                    deferred += 1
+                    continue
+                match = to_match(box, prediction, names)
+                tracks[i].name, tracks[i].confidence, tracks[i].recognized_at = match.name, match.confidence, now
+        recognized = len(stale) - deferred
+        reused = len(tracks) - len(stale)
+        self.recognized += recognized
+        self.reused += reused
+        self.deferred += deferred
+        with _totals_lock:
+            _totals["recognized"] += recognized
+            _totals["reused"] += reused
+            _totals["deferred"] += deferred
+        return [FaceMatch(track.box, track.name, track.confidence, track.id) for track in tracks]
+
+    def stats(self):
+        with self._lock:
+            return {"tracks": len(self.tracks), "recognized": self.recognized, "reused": self.reused,
+                    "deferred": self.deferred}